@@ -25,10 +25,8 @@ if __name__ == '__main__':
     client.init(client_port, server_addr, server_port, segment_size)
     client.connect()
 
-    # open a file and send it to the server
-    with open("large_data.txt", "rb") as f:
-        data = f.read()
-    sent = client.send(data)
+    # stream the file to the server without reading it into memory
+    sent = client.send_file("large_data.txt")
     print(f">> sent {sent} bytes of data")
     
     # close the connection
@@ -0,0 +1,161 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# bench_batch_io.py - packets per second with per-packet socket calls vs mrt_batch_io (sendmmsg/recvmmsg, GSO/GRO)
+#
+# usage: python bench_batch_io.py [--sizes 64 512 1460] [--packets 200000] [--burst 256] [--transfer 8] [--json]
+#
+
+import argparse
+import contextlib
+import json
+import os
+import socket
+import threading
+import time
+
+import mrt_batch_io
+import mrt_client
+import mrt_server
+
+SOCKET_BUFFER = 8 << 20  # Room for a whole burst in the receiver's socket
+TRANSFER_PORT = 60300  # Server port of the MRT transfer (the client uses TRANSFER_PORT + 1)
+
+def socket_pair():
+    """A sender and a receiver UDP socket on the loopback interface."""
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(1.0)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender.bind(('127.0.0.1', 0))
+    sender.settimeout(1.0)
+    return sender, receiver
+
+# Modes: name -> (batched, GSO/GRO)
+MODES = {'packet': (False, False), 'mmsg': (True, False), 'gso': (True, True)}
+
+def run(size, packets, burst, mode):
+    """
+    Send packets datagrams of size bytes in bursts of burst and receive each
+    burst before sending the next, timing the two sides separately.
+
+    return:
+    (send seconds, receive seconds, datagrams received)
+    """
+    batched, offload = MODES[mode]
+    sender, receiver = socket_pair()
+    addr = receiver.getsockname()
+    datagram = os.urandom(size)
+    buffer = bytearray(mrt_batch_io.RECEIVE_SLOT_SIZE)
+    batch_sender = mrt_batch_io.BatchSender(sender, addr, gso=offload) if batched else None
+    batch_receiver = mrt_batch_io.BatchReceiver(receiver, gro=offload) if batched else None
+    send_time = receive_time = 0.0
+    received = 0
+    try:
+        for first in range(0, packets, burst):
+            count = min(burst, packets - first)
+
+            start = time.perf_counter()
+            if batched:
+                for _ in range(count):
+                    batch_sender.next_slot()[:size] = datagram
+                    batch_sender.queue(size)
+                batch_sender.flush()
+            else:
+                for _ in range(count):
+                    sender.sendto(datagram, addr)
+            send_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            remaining = count
+            try:
+                while remaining:
+                    if batched:
+                        datagrams = batch_receiver.receive(receiver.gettimeout())
+                        if not datagrams:
+                            raise socket.timeout
+                        remaining -= len(datagrams)
+                    else:
+                        receiver.recvfrom_into(buffer)
+                        remaining -= 1
+            except socket.timeout:  # Dropped by the kernel
+                pass
+            receive_time += time.perf_counter() - start
+            received += count - remaining
+    finally:
+        sender.close()
+        receiver.close()
+    return send_time, receive_time, received
+
+def transfer(mb, segment_size, batched):
+    """
+    Send mb MB over MRT on the loopback interface.
+
+    return:
+    (seconds, DATA segments sent)
+    """
+    data = os.urandom(mb * 1024 * 1024)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        server = mrt_server.Server()
+        server.init(TRANSFER_PORT, segment_size, batch_io=batched, log_path=os.devnull)
+        received = []
+        thread = threading.Thread(target=lambda: received.append(server.receive(server.accept(), len(data))))
+        thread.start()
+        client = mrt_client.Client()
+        client.init(TRANSFER_PORT + 1, '127.0.0.1', TRANSFER_PORT, segment_size, batch_io=batched)
+        client.connect()
+        start = time.perf_counter()
+        client.send(data)
+        thread.join()
+        elapsed = time.perf_counter() - start
+        segments = -(-len(data) // client.max_payload_size)
+        client.close()
+        server.close()
+        os.remove(f"log_{TRANSFER_PORT + 1}.txt")
+    assert received == [data]
+    return elapsed, segments
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+                    prog='bench_batch_io.py',
+                    description='Benchmarks UDP packets per second with and without batching (sendmmsg/recvmmsg, GSO/GRO).')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 512, 1460], metavar='BYTES',
+                        help='datagram sizes')
+    parser.add_argument('--packets', type=int, default=200000, help='datagrams per size and mode')
+    parser.add_argument('--burst', type=int, default=256, help='datagrams sent before the receiver drains them')
+    parser.add_argument('--transfer', type=int, default=8, metavar='MB',
+                        help='also time an MRT transfer of MB MB per mode (0: skip)')
+    parser.add_argument('--segment', type=int, default=1460, help='segment size of the MRT transfer')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    if not mrt_batch_io.AVAILABLE:
+        parser.exit(1, "sendmmsg/recvmmsg are not available on this platform: nothing to compare\n")
+
+    results = []
+    for size in args.sizes:
+        for mode in MODES:
+            send_time, receive_time, received = run(size, args.packets, args.burst, mode)
+            results.append({'test': 'socket', 'mode': mode, 'bytes': size, 'packets': args.packets,
+                            'received': received, 'send_pps': args.packets / send_time,
+                            'receive_pps': received / receive_time})
+
+    if args.transfer:
+        for mode, batched in (('packet', False), ('batch', True)):
+            elapsed, segments = transfer(args.transfer, args.segment, batched)
+            results.append({'test': 'transfer', 'mode': mode, 'bytes': args.segment, 'packets': segments,
+                            'seconds': elapsed, 'pps': segments / elapsed, 'mb_per_s': args.transfer / elapsed})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'test':<9} {'mode':<7} {'bytes':>6} {'send pkt/s':>12} {'recv pkt/s':>12} {'lost':>6}")
+        for r in results:
+            if r['test'] == 'socket':
+                print(f"{r['test']:<9} {r['mode']:<7} {r['bytes']:>6} {r['send_pps']:>12.0f} "
+                      f"{r['receive_pps']:>12.0f} {r['packets'] - r['received']:>6}")
+            else:
+                print(f"{r['test']:<9} {r['mode']:<7} {r['bytes']:>6} {r['pps']:>12.0f} {'':>12} {'':>6}"
+                      f"  ({r['mb_per_s']:.1f} MB/s)")
@@ -0,0 +1,88 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# bench_checksum.py - throughput and error detection of the MRT checksum algorithms
+#
+# usage: python bench_checksum.py [--sizes 0 64 1460 9000] [--errors 20000] [--json]
+#
+
+import argparse
+import json
+import random
+import timeit
+
+import mrt_checksum
+import mrt_segment
+
+def bench_throughput(compute, payload, min_time=0.2):
+    """Return (ns per call, MB/s) for compute(payload)."""
+    timer = timeit.Timer(lambda: compute(payload))
+    number, elapsed = timer.autorange()
+    if elapsed < min_time:
+        number = max(1, int(number * min_time / elapsed))
+    elapsed = min(timer.repeat(repeat=3, number=number))
+    ns_per_call = elapsed / number * 1e9
+    mb_per_s = len(payload) / (ns_per_call / 1e9) / 1e6 if payload else 0.0
+    return ns_per_call, mb_per_s
+
+def undetected_errors(checksum, size, trials, rng):
+    """
+    Corrupt random segments like network.py does and count corruptions the
+    checksum misses. Half the trials flip 2-4 random bits, the other half
+    overwrite a 16-bit burst.
+    """
+    missed = 0
+    for trial in range(trials):
+        original = rng.randbytes(size)
+        data = bytearray(original)
+        expected = checksum.compute(data)
+        if trial % 2:
+            for _ in range(rng.randint(2, 4)):
+                bit = rng.randrange(size * 8)
+                data[bit // 8] ^= 1 << (bit % 8)
+        else:
+            pos = rng.randrange(size - 1)
+            data[pos:pos + 2] = rng.randbytes(2)
+        if data != original and checksum.compute(data) == expected:
+            missed += 1
+    return missed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+                    prog='bench_checksum.py',
+                    description='Benchmarks the checksum algorithms available to the MRT version 2 wire format.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[0, 64, 512, 1460, 4096, 9000],
+                        help='payload sizes in bytes')
+    parser.add_argument('--errors', type=int, default=0, metavar='TRIALS',
+                        help='also measure undetected corruptions over this many trials per algorithm')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    rng = random.Random(4119)
+    results = []
+    for size in args.sizes:
+        payload = rng.randbytes(size)
+        # The version 1 checksum (MD5 hexdigest truncated to 8 characters) for reference
+        ns, mbps = bench_throughput(mrt_segment.compute_checksum, payload)
+        results.append({'algorithm': 'v1-md5hex', 'size': size, 'ns_per_call': ns, 'mb_per_s': mbps})
+        for name in mrt_checksum.ALGORITHMS:
+            ns, mbps = bench_throughput(mrt_checksum.get(name).compute, payload)
+            results.append({'algorithm': name, 'size': size, 'ns_per_call': ns, 'mb_per_s': mbps})
+
+    detection = []
+    if args.errors:
+        for name in mrt_checksum.ALGORITHMS:
+            missed = undetected_errors(mrt_checksum.get(name), 1460, args.errors, rng)
+            detection.append({'algorithm': name, 'trials': args.errors, 'undetected': missed})
+
+    if args.json:
+        print(json.dumps({'throughput': results, 'detection': detection}, indent=2))
+    else:
+        crc32c = mrt_checksum.get('crc32c')
+        print(f"crc32c implementation: {crc32c.implementation}")
+        print(f"{'algorithm':<10} {'size':>6} {'ns/call':>12} {'MB/s':>10}")
+        for r in results:
+            print(f"{r['algorithm']:<10} {r['size']:>6} {r['ns_per_call']:>12.0f} {r['mb_per_s']:>10.1f}")
+        for d in detection:
+            print(f"{d['algorithm']:<10} undetected {d['undetected']}/{d['trials']} corrupted 1460-byte segments")
@@ -0,0 +1,323 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# bench_micro.py - ns per call and allocations per call of the per-packet functions of client and server,
+#                  with a baseline comparison
+#
+# usage: python bench_micro.py [--sizes 0 64 512 1460 4096 9000] [--functions create_segment ...] [--repeat 20]
+#                              [--output results.json] [--baseline baseline.json] [--threshold 10]
+#        python bench_micro.py --compare baseline.json results.json [--threshold 10]
+#
+
+import argparse
+import contextlib
+import gc
+import itertools
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+
+import mrt_checksum
+import mrt_client
+import mrt_log
+import mrt_segment
+import mrt_server
+
+SIZES = [0, 64, 512, 1460, 4096, 9000]
+REPEAT = 20  # Timing repeats per case; the fastest one is reported
+MIN_TIME = 0.02  # Seconds each timing repeat runs at least (many short repeats dodge interruptions)
+CONFIRM = 3  # Times a case that looks slower than the baseline is measured again before it counts
+ALLOC_CALLS = 1000  # Calls whose allocations are counted per case
+RECEIVE_WINDOW = 64 * 1024 * 1024  # Server window for _handle_data, so no segment is dropped
+DRAIN_EVERY = 256  # _handle_data steps between two drains of the in-order data
+ALLOC_TOLERANCE = 0.1  # Extra allocations per call that count as a regression
+
+# Compared against a baseline: metric -> minimum absolute change that counts, besides --threshold
+COMPARED = {'ns_per_op': 0.0, 'peak_bytes_per_op': 64, 'allocs_per_op': ALLOC_TOLERANCE}
+
+class Bench:
+    """
+    A client and a server set up like after the handshake, without sockets
+    between them, so single per-packet functions can be called in a loop.
+    The server's ACKs go to a socket nobody reads, like in a real transfer
+    they go to the network.
+    """
+    def __init__(self, workdir, version):
+        checksums = mrt_checksum.PREFERENCE
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            self.client = mrt_client.Client()
+            self.client._configure(0, '127.0.0.1', 0, mrt_client.UDP_MAX_SIZE, 'newreno', None, None,
+                                   (version,), checksums)
+            self.server = mrt_server.Server()
+            self.server._configure(0, mrt_server.UDP_MAX_SIZE, RECEIVE_WINDOW, (version,), checksums,
+                                   mrt_server.ACK_FREQUENCY, mrt_server.ACK_DELAY)
+        self.client.version = version
+        # Written by drain_logs() between timing runs, not by the writer thread during them
+        self.client.log_file = mrt_log.SegmentLog(os.path.join(workdir, f'client_v{version}.bin'), mrt_log.BINARY,
+                                                  flush_interval=3600)
+
+        self.sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sink.bind(('127.0.0.1', 0))
+        self.server.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.server.socket.bind(('127.0.0.1', 0))
+        self.server.log_file = mrt_log.SegmentLog(os.path.join(workdir, f'server_v{version}.bin'), mrt_log.BINARY,
+                                                  flush_interval=3600)
+        self.checksum = mrt_checksum.get(mrt_checksum.DEFAULT) if version == mrt_segment.V2 else None
+        self.version = version
+
+    def connection(self):
+        """A fresh server connection from the sink's address."""
+        conn = mrt_server.Connection(self.server, *self.sink.getsockname(), 0, 0)
+        conn.version = self.version
+        if self.checksum:
+            conn.checksum = self.checksum
+        return conn
+
+    def drain_logs(self):
+        """Write the queued log records, so they do not pile up over many timing runs."""
+        self.client.log_file._write()
+        self.server.log_file._write()
+
+    def close(self):
+        for log in (self.client.log_file, self.server.log_file):
+            log.close()
+        self.server.socket.close()
+        self.sink.close()
+
+def create_segment(bench, payload):
+    """Client: build a DATA segment."""
+    client = bench.client
+    return lambda: client._create_segment(mrt_segment.DATA, 1, 0, payload)
+
+def parse_segment(bench, payload):
+    """Server: parse and verify a DATA segment, as received into a datagram buffer."""
+    segment = memoryview(bytearray(bench.client._create_segment(mrt_segment.DATA, 1, 0, payload)))
+    server, checksum = bench.server, bench.checksum
+    return lambda: server._parse_segment(segment, checksum)
+
+def compute_checksum(bench, payload):
+    """The checksum of a segment: MD5 for version 1, the default algorithm for version 2."""
+    if bench.checksum is None:
+        compute = bench.client._compute_checksum
+    else:
+        compute = bench.checksum.compute
+    return lambda: compute(payload)
+
+def log_segment(bench, payload):
+    """Client: log a sent DATA segment (queued for the log's writer thread)."""
+    log, length = bench.client._log_segment, len(payload)
+    return lambda: log(0, 0, 1, 0, mrt_segment.DATA, length)
+
+def _data_steps(bench, payload, order):
+    """
+    Feed DATA segments to Server._handle_data, one per call, with sequence
+    numbers in the given repeating order of offsets.
+    """
+    server, conn = bench.server, bench.connection()
+    view = memoryview(bytearray(payload))  # Like a payload parsed in place from a datagram buffer
+    seqs = (base + offset for base in itertools.count(0, len(order)) for offset in order)
+    steps = itertools.count(1)
+
+    def step():
+        seq = next(seqs)
+        server._handle_data(conn, seq, 0, view)
+        if next(steps) % DRAIN_EVERY == 0:
+            conn.received_data.clear()
+    return step
+
+def handle_data(bench, payload):
+    """Server: take an in-order DATA segment (delayed ACK)."""
+    return _data_steps(bench, payload, (0,))
+
+def reassemble(bench, payload):
+    """
+    Server: segments arriving in swapped pairs. Every other call buffers an
+    out-of-order segment, the next fills the hole and delivers both; each
+    sends an ACK (with SACK in version 2).
+    """
+    return _data_steps(bench, payload, (1, 0))
+
+FUNCTIONS = {f.__name__: f for f in (create_segment, parse_segment, compute_checksum, log_segment,
+                                     handle_data, reassemble)}
+
+def time_call(step, reset, repeat=REPEAT, min_time=MIN_TIME):
+    """
+    Nanoseconds per call of step, the fastest of repeat runs of at least
+    min_time seconds. reset() is called after every run, outside the timing.
+    """
+    timer = timeit.Timer(step)
+    number, elapsed = timer.autorange()  # Runs for at least 0.2 seconds, which also warms up
+    number = max(1, round(number * min_time / elapsed))
+    reset()
+    fastest = float('inf')
+    for _ in range(repeat):
+        fastest = min(fastest, timer.timeit(number))
+        reset()
+    return fastest / number * 1e9
+
+def count_allocations(step, calls=ALLOC_CALLS):
+    """
+    Memory use per call of step.
+
+    return:
+    (allocations, peak bytes): the memory blocks a call leaves allocated,
+    its result included, and the most memory a single call had allocated at once.
+    """
+    results = [None] * calls
+    gc.collect()
+    gc.disable()
+    try:
+        step()  # Lazily created state is not part of a call
+        before = sys.getallocatedblocks()
+        for i in range(calls):
+            results[i] = step()
+        allocations = (sys.getallocatedblocks() - before) / calls
+
+        tracemalloc.start()
+        peak = 0
+        for _ in range(min(calls, 100)):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            step()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - current)
+        tracemalloc.stop()
+    finally:
+        gc.enable()
+    return allocations, peak
+
+def run(cases, repeat):
+    """
+    Measure (function, version, size) cases, for each wire format version
+    with one Bench.
+
+    return:
+    A list of dicts with function, version, size, ns_per_op, allocs_per_op and peak_bytes_per_op.
+    """
+    results = []
+    with tempfile.TemporaryDirectory(prefix='mrt-micro-') as workdir:
+        for version in mrt_segment.SUPPORTED_VERSIONS:
+            bench = Bench(workdir, version)
+            try:
+                for name, _, size in (case for case in cases if case[1] == version):
+                    payload = bytes(range(256)) * (size // 256) + bytes(size % 256)
+                    ns = time_call(FUNCTIONS[name](bench, payload), bench.drain_logs, repeat)
+                    bench.drain_logs()
+                    allocations, peak = count_allocations(FUNCTIONS[name](bench, payload))
+                    bench.drain_logs()
+                    results.append({'function': name, 'version': version, 'size': size, 'ns_per_op': ns,
+                                    'allocs_per_op': allocations, 'peak_bytes_per_op': peak})
+            finally:
+                bench.close()
+    return results
+
+def confirm(baseline, results, threshold, repeat, attempts=CONFIRM):
+    """
+    Measure the cases that look slower than baseline again, up to attempts
+    times, and keep their fastest time. A busy machine slows down single
+    cases now and then; a real regression stays.
+    """
+    best = {_key(r): r for r in results}
+    for _ in range(attempts):
+        slower = [key for key, metric, *_, regressed in compare(baseline, best.values(), threshold)
+                  if regressed and metric == 'ns_per_op']
+        if not slower:
+            break
+        for result in run(slower, repeat):
+            old = best[_key(result)]
+            old['ns_per_op'] = min(old['ns_per_op'], result['ns_per_op'])
+    return results
+
+def environment():
+    """Where the results were measured; ns per call only compare on the same machine."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'python': platform.python_version(), 'implementation': platform.python_implementation(),
+            'platform': platform.platform(), 'machine': platform.machine(), 'commit': commit,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def _key(result):
+    return result['function'], result['version'], result['size']
+
+def compare(baseline, results, threshold):
+    """
+    Compare results against baseline, case by case. A metric regresses if it
+    grew by more than threshold percent and by more than its COMPARED minimum.
+
+    return:
+    A list of (case, metric, baseline value, value, percent change, regressed).
+    """
+    before = {_key(r): r for r in baseline}
+    rows = []
+    for result in results:
+        old = before.get(_key(result))
+        if old is None:
+            continue
+        for metric, minimum in COMPARED.items():
+            if metric not in old:
+                continue
+            change = result[metric] - old[metric]
+            percent = change / old[metric] * 100 if old[metric] else (float('inf') if change > 0 else 0.0)
+            rows.append((_key(result), metric, old[metric], result[metric], percent,
+                         percent > threshold and change > minimum))
+    return rows
+
+def print_results(results):
+    print(f"{'function':<18} {'v':>2} {'size':>6} {'ns/op':>10} {'allocs/op':>10} {'peak B/op':>10}")
+    for r in results:
+        print(f"{r['function']:<18} {r['version']:>2} {r['size']:>6} {r['ns_per_op']:>10.0f} "
+              f"{r['allocs_per_op']:>10.2f} {r['peak_bytes_per_op']:>10}")
+
+def print_comparison(rows, threshold):
+    """Print the regressions in rows and return how many there are."""
+    regressions = [row for row in rows if row[5]]
+    for (function, version, size), metric, old, new, percent, _ in regressions:
+        print(f"REGRESSION {function} v{version} {size} bytes: {metric} {old:.2f} -> {new:.2f} ({percent:+.1f}%)")
+    print(f"{len(regressions)} regression(s) beyond {threshold}% in {len(rows)} comparisons")
+    return len(regressions)
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+                    prog='bench_micro.py',
+                    description='Benchmarks the per-packet functions of the MRT client and server.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='payload sizes in bytes')
+    parser.add_argument('--functions', nargs='+', choices=list(FUNCTIONS), default=list(FUNCTIONS),
+                        help='functions to measure')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='timing repeats per case (fastest counts)')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='compare against the results in this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'RESULTS'),
+                        help='only compare two result files')
+    parser.add_argument('--threshold', type=float, default=10.0, metavar='PERCENT',
+                        help='slowdown or growth that counts as a regression (default 10)')
+    args = parser.parse_args()
+
+    if args.compare:
+        rows = compare(load(args.compare[0]), load(args.compare[1]), args.threshold)
+        sys.exit(1 if print_comparison(rows, args.threshold) else 0)
+
+    results = run(list(itertools.product(args.functions, mrt_segment.SUPPORTED_VERSIONS, args.sizes)), args.repeat)
+    if args.baseline:
+        baseline = load(args.baseline)
+        results = confirm(baseline, results, args.threshold, args.repeat)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    if args.baseline:
+        rows = compare(baseline, results, args.threshold)
+        sys.exit(1 if print_comparison(rows, args.threshold) else 0)
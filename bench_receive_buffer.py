@@ -0,0 +1,80 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# bench_receive_buffer.py - server receive buffer: bytes concatenation vs mrt_buffer.ReceiveBuffer
+#
+# usage: python bench_receive_buffer.py [--sizes 1 4 16] [--payload 1460] [--read 65536] [--json]
+#
+
+import argparse
+import json
+import os
+import time
+
+import mrt_buffer
+
+class ConcatBuffer:
+    """The previous receive buffer: one bytes object, grown and sliced in place."""
+    def __init__(self):
+        self.data = b''
+
+    def __len__(self):
+        return len(self.data)
+
+    def append(self, payload):
+        self.data += payload
+
+    def read(self, n):
+        chunk = self.data[:n]
+        self.data = self.data[n:]
+        return chunk
+
+def run(buffer, payloads, read_size, reads_per_drain):
+    """
+    Feed every payload into buffer and read it back in read_size pieces,
+    reading after every reads_per_drain payloads (0: only after the last one,
+    like receive() asking for the whole transfer at once).
+
+    return:
+    (seconds, bytes read)
+    """
+    total = 0
+    start = time.perf_counter()
+    for i, payload in enumerate(payloads, 1):
+        buffer.append(payload)
+        if reads_per_drain and i % reads_per_drain == 0:
+            total += len(buffer.read(read_size))
+    while len(buffer):
+        total += len(buffer.read(read_size))
+    return time.perf_counter() - start, total
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+                    prog='bench_receive_buffer.py',
+                    description='Benchmarks the in-order receive buffer of a server connection.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 4, 16], metavar='MB',
+                        help='transfer sizes in MB')
+    parser.add_argument('--payload', type=int, default=1460, help='payload bytes per segment')
+    parser.add_argument('--read', type=int, default=65536, help='bytes per application read')
+    parser.add_argument('--every', type=int, default=0, metavar='SEGMENTS',
+                        help='read after every SEGMENTS segments (default: only after the whole transfer)')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for mb in args.sizes:
+        size = mb * 1024 * 1024
+        data = os.urandom(size)
+        payloads = [data[pos:pos + args.payload] for pos in range(0, size, args.payload)]
+        for name, factory in (('concat', ConcatBuffer), ('ring', mrt_buffer.ReceiveBuffer)):
+            elapsed, total = run(factory(), payloads, args.read, args.every)
+            assert total == size
+            results.append({'buffer': name, 'mb': mb, 'seconds': elapsed, 'mb_per_s': mb / elapsed})
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'buffer':<8} {'MB':>5} {'seconds':>10} {'MB/s':>10}")
+        for r in results:
+            print(f"{r['buffer']:<8} {r['mb']:>5} {r['seconds']:>10.3f} {r['mb_per_s']:>10.1f}")
@@ -0,0 +1,314 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# bench_transfer.py - end-to-end transfers through network.py over a matrix of segment sizes, loss
+#                     rates, bit error rates and file sizes, with a baseline comparison
+#
+# usage: python bench_transfer.py [--segments 1460 9000] [--loss 0 0.01 0.05] [--ber 0 0.00001] [--sizes 1000000]
+#                                 [--repeat 3] [--output results.json] [--baseline baseline.json] [--threshold 10]
+#        python bench_transfer.py --compare baseline.json results.json [--threshold 10]
+#
+
+import argparse
+import contextlib
+import hashlib
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPT = os.path.abspath(__file__)
+NETWORK = os.path.join(os.path.dirname(SCRIPT), 'network.py')
+CLIENT_PORT = 50500
+NETWORK_PORT = 51500
+SERVER_PORT = 60500
+RESULT_PREFIX = 'RESULT '  # Marks the line a worker process reports its measurements on
+READY = 'READY'  # Printed by the server worker once it is listening
+NETWORK_STARTUP = 0.3  # Seconds network.py gets to bind its socket
+TIMEOUT = 120  # Seconds a single transfer may take before it counts as failed
+SEED = 4119  # Seed of the generated file, so every run sends the same bytes
+
+# Medians compared against a baseline: metric -> True if higher is better
+COMPARED = {'goodput_mbps': True, 'client_cpu_per_mb': False, 'server_cpu_per_mb': False}
+
+def file_data(size):
+    """The bytes every run of a case transfers."""
+    return random.Random(SEED).getrandbits(size * 8).to_bytes(size, 'little') if size else b''
+
+def cpu_seconds():
+    """
+    User and system CPU seconds of this process, all threads included.
+    Workers report the difference over the transfer, without interpreter startup.
+    """
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+def report(result):
+    """Print a worker's measurements for the parent process."""
+    print(RESULT_PREFIX + json.dumps(result), flush=True)
+
+def run_server(args):
+    """Worker: receive args.size bytes from one client, check them and report."""
+    import mrt_server
+    expected = hashlib.sha256(file_data(args.size)).hexdigest()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        server = mrt_server.Server()
+        server.init(args.server_port, args.segment)
+    print(READY, flush=True)
+    cpu_start = cpu_seconds()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        conn = server.accept()
+        start = time.time()
+        data = server.receive(conn, args.size)
+        end = time.time()
+        # Answer the client's FIN before closing, or it retries until MAX_RETRIES
+        with conn.data_ready:
+            conn.data_ready.wait_for(lambda: not conn.connected, TIMEOUT)
+        stats = server.stats()
+        server.close()
+    connection = stats.connections[0] if stats.connections else None
+    report({
+        'ok': hashlib.sha256(data).hexdigest() == expected,
+        'received': len(data),
+        'start': start,
+        'end': end,
+        'cpu_seconds': cpu_seconds() - cpu_start,
+        'corrupt_segments': stats.corrupt_segments,
+        'duplicate_segments': connection.duplicate_segments if connection else 0,
+        'out_of_order_segments': connection.out_of_order_segments if connection else 0,
+        'acks_sent': connection.acks_sent if connection else 0,
+    })
+
+def run_client(args):
+    """Worker: connect through the network simulator, send args.size bytes and report."""
+    import mrt_client
+    data = file_data(args.size)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        client = mrt_client.Client()
+        client.init(args.client_port, '127.0.0.1', args.network_port, args.segment)
+        cpu_start = cpu_seconds()
+        start = time.time()
+        client.connect()
+        client.send(data)
+        end = time.time()
+        stats = client.stats()
+        client.close()
+    report({
+        'start': start,
+        'end': end,
+        'cpu_seconds': cpu_seconds() - cpu_start,
+        'segments_sent': stats.segments_sent,
+        'retransmits': stats.retransmits,
+        'fast_retransmits': stats.fast_retransmits,
+        'timeouts': stats.timeouts,
+        'srtt': stats.srtt,
+    })
+
+def _result(process):
+    """The RESULT line of a finished worker, or None."""
+    output = process.stdout.read() if process.stdout else ''
+    for line in output.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    return None
+
+def _stop(processes):
+    for process in processes:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+def run_case(segment, loss, ber, size, timeout=TIMEOUT):
+    """
+    One transfer of size bytes through network.py with the given loss rate
+    and bit error rate, server and client each in its own process.
+
+    return:
+    A dict of measurements; ok is False if the transfer failed or timed out.
+    """
+    common = ['--segment', str(segment), '--size', str(size), '--client-port', str(CLIENT_PORT),
+              '--network-port', str(NETWORK_PORT), '--server-port', str(SERVER_PORT)]
+    with tempfile.TemporaryDirectory(prefix='mrt-bench-') as workdir:
+        loss_file = os.path.join(workdir, 'loss.txt')
+        with open(loss_file, 'w') as f:
+            f.write(f"0 {loss} {ber}\n")
+
+        processes = []
+        try:
+            network = subprocess.Popen([sys.executable, NETWORK, str(NETWORK_PORT), '127.0.0.1', str(CLIENT_PORT),
+                                        '127.0.0.1', str(SERVER_PORT), loss_file], cwd=workdir,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            processes.append(network)
+            server = subprocess.Popen([sys.executable, SCRIPT, '--role', 'server'] + common, cwd=workdir,
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+            processes.append(server)
+            if server.stdout.readline().strip() != READY:
+                return {'ok': False, 'error': 'server did not start'}
+            time.sleep(NETWORK_STARTUP)
+            client = subprocess.Popen([sys.executable, SCRIPT, '--role', 'client'] + common, cwd=workdir,
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+            processes.append(client)
+
+            deadline = time.monotonic() + timeout
+            for process in (client, server):
+                try:
+                    process.wait(max(deadline - time.monotonic(), 0))
+                except subprocess.TimeoutExpired:
+                    return {'ok': False, 'error': 'timeout'}
+            client_result, server_result = _result(client), _result(server)
+        finally:
+            _stop(processes)
+
+    if client_result is None or server_result is None:
+        return {'ok': False, 'error': 'worker failed'}
+    seconds = server_result['end'] - client_result['start']  # From connect() to the last byte received
+    mb = size / 1e6
+    return {
+        'ok': server_result['ok'],
+        'seconds': seconds,
+        'goodput_mbps': size * 8 / seconds / 1e6,
+        'client_cpu_seconds': client_result['cpu_seconds'],
+        'server_cpu_seconds': server_result['cpu_seconds'],
+        'client_cpu_per_mb': client_result['cpu_seconds'] / mb,
+        'server_cpu_per_mb': server_result['cpu_seconds'] / mb,
+        'segments_sent': client_result['segments_sent'],
+        'retransmits': client_result['retransmits'],
+        'retransmit_rate': client_result['retransmits'] / max(client_result['segments_sent'], 1),
+        'fast_retransmits': client_result['fast_retransmits'],
+        'timeouts': client_result['timeouts'],
+        'srtt': client_result['srtt'],
+        'corrupt_segments': server_result['corrupt_segments'],
+        'duplicate_segments': server_result['duplicate_segments'],
+        'out_of_order_segments': server_result['out_of_order_segments'],
+    }
+
+def summarize(case, runs):
+    """A case with its runs and the median of every numeric measurement over the successful ones."""
+    ok_runs = [run for run in runs if run['ok']]
+    median = {}
+    for key in ok_runs[0] if ok_runs else ():
+        values = [run[key] for run in ok_runs if isinstance(run.get(key), (int, float)) and key != 'ok']
+        if values:
+            median[key] = statistics.median(values)
+    return dict(case, runs=runs, failures=len(runs) - len(ok_runs), median=median)
+
+def case_key(case):
+    return (case['segment'], case['loss'], case['ber'], case['size'])
+
+def compare(baseline, current, threshold):
+    """
+    Compare the medians of the cases found in both result documents.
+
+    return:
+    A list of (case, metric, baseline value, current value, change in percent, regressed).
+    Failures of a case that succeeded in the baseline are reported with metric 'failures'.
+    """
+    previous = {case_key(case): case for case in baseline['results']}
+    rows = []
+    for case in current['results']:
+        old = previous.get(case_key(case))
+        if old is None:
+            continue
+        if case['failures'] > old['failures']:
+            rows.append((case, 'failures', old['failures'], case['failures'], None, True))
+        for metric, higher_is_better in COMPARED.items():
+            before, after = old['median'].get(metric), case['median'].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            regressed = change < -threshold if higher_is_better else change > threshold
+            rows.append((case, metric, before, after, change, regressed))
+    return rows
+
+def print_comparison(rows, threshold):
+    """Print the comparison and return the number of regressions."""
+    print(f"{'segment':>7} {'loss':>6} {'ber':>8} {'size':>9} {'metric':<18} {'baseline':>10} {'current':>10} {'change':>8}")
+    for case, metric, before, after, change, regressed in rows:
+        change_text = '' if change is None else f"{change:+7.1f}%"
+        print(f"{case['segment']:>7} {case['loss']:>6} {case['ber']:>8} {case['size']:>9} {metric:<18} "
+              f"{before:>10.3f} {after:>10.3f} {change_text:>8}{'  REGRESSION' if regressed else ''}")
+    regressions = sum(row[5] for row in rows)
+    print(f"{regressions} regressions beyond {threshold:g}%")
+    return regressions
+
+def environment():
+    """Where the numbers were measured."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(SCRIPT),
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'commit': commit, 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+                    prog='bench_transfer.py',
+                    description='Times MRT transfers through network.py over a matrix of network conditions.')
+    parser.add_argument('--segments', type=int, nargs='+', default=[1460, 9000], help='segment sizes')
+    parser.add_argument('--loss', type=float, nargs='+', default=[0.0, 0.01, 0.05], help='segment loss rates')
+    parser.add_argument('--ber', type=float, nargs='+', default=[0.0, 0.00001], help='bit error rates')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000000], metavar='BYTES', help='file sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case (the median is compared)')
+    parser.add_argument('--timeout', type=float, default=TIMEOUT, help='seconds before a transfer counts as failed')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='compare the results with this earlier --output file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'RESULTS'),
+                        help='only compare two result files')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='percent change of a median that counts as a regression')
+    # Worker processes started by run_case()
+    parser.add_argument('--role', choices=['server', 'client'], help=argparse.SUPPRESS)
+    parser.add_argument('--segment', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--client-port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--network-port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--server-port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role == 'server':
+        run_server(args)
+        sys.exit(0)
+    if args.role == 'client':
+        run_client(args)
+        sys.exit(0)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        sys.exit(1 if print_comparison(compare(baseline, current, args.threshold), args.threshold) else 0)
+
+    results = []
+    print(f"{'segment':>7} {'loss':>6} {'ber':>8} {'size':>9} {'ok':>5} {'Mbit/s':>8} {'seconds':>8} "
+          f"{'retx':>6} {'timeouts':>8} {'cpu c/s':>13}")
+    for segment, loss, ber, size in itertools.product(args.segments, args.loss, args.ber, args.sizes):
+        case = {'segment': segment, 'loss': loss, 'ber': ber, 'size': size}
+        summary = summarize(case, [run_case(segment, loss, ber, size, args.timeout) for _ in range(args.repeat)])
+        results.append(summary)
+        m = summary['median']
+        if m:
+            print(f"{segment:>7} {loss:>6} {ber:>8} {size:>9} {args.repeat - summary['failures']:>2}/{args.repeat:<2} "
+                  f"{m['goodput_mbps']:>8.2f} {m['seconds']:>8.2f} {m['retransmits']:>6.0f} {m['timeouts']:>8.0f} "
+                  f"{m['client_cpu_seconds']:>6.2f}/{m['server_cpu_seconds']:<6.2f}")
+        else:
+            print(f"{segment:>7} {loss:>6} {ber:>8} {size:>9} {0:>2}/{args.repeat:<2} failed: "
+                  f"{', '.join(sorted({run.get('error', 'corrupted data') for run in summary['runs']}))}")
+
+    document = {'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        sys.exit(1 if print_comparison(compare(baseline, document, args.threshold), args.threshold) else 0)
@@ -0,0 +1,143 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# check_compat.py - checks that a client speaking the original (pre-negotiation) MRT format can still
+#                   connect, send data and close against the current server
+#
+# usage: python check_compat.py [--port 60700] [--segments 8] [--payload 1000]
+#
+
+import argparse
+import contextlib
+import hashlib
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+
+import mrt_segment
+import mrt_server
+
+REPLY_TIMEOUT = 2  # Seconds to wait for each reply of the server
+
+# The original format, written out here independently of mrt_segment:
+# |type(1B)|seq(4B)|ack(4B)|checksum(8B)|payload_len(4B)|payload|
+def original_create(seg_type, seq_num, ack_num, payload=b''):
+    """Build a segment the way the original client did."""
+    segment = struct.pack(f'!BII4s{len(payload)}s', seg_type, seq_num, ack_num,
+                          str(len(payload)).zfill(4).encode('ascii'), payload)
+    checksum = hashlib.md5(segment).hexdigest()[:8]
+    return segment[:9] + checksum.encode('ascii') + segment[9:]
+
+def original_parse(segment):
+    """
+    Parse a segment the way the original client did.
+
+    return:
+    (type, seq, ack, payload), or None if the segment is not valid in the original format.
+    """
+    if len(segment) < 21:
+        return None
+    seg_type = segment[0]
+    seq_num, ack_num = struct.unpack('!II', segment[1:9])
+    try:
+        received_checksum = segment[9:17].decode('ascii')
+        payload_len = int(segment[17:21].decode('ascii'))
+    except (UnicodeDecodeError, ValueError):
+        return None
+    if hashlib.md5(segment[:9] + segment[17:]).hexdigest()[:8] != received_checksum:
+        return None
+    if len(segment) < 21 + payload_len:
+        return None
+    return seg_type, seq_num, ack_num, segment[21:21 + payload_len]
+
+def check_codec(payload):
+    """Segments of mrt_segment version 1 and of the original format must be the same bytes."""
+    for seg_type in (mrt_segment.SYN, mrt_segment.DATA, mrt_segment.FIN):
+        original = original_create(seg_type, 7, 9, payload)
+        if mrt_segment.create_segment(seg_type, 7, 9, payload, window=1234) != original:
+            return f"version 1 {seg_type} segment differs from the original format"
+        parsed = mrt_segment.parse_segment(original)
+        if parsed is None or (parsed.type, parsed.seq, parsed.ack, bytes(parsed.payload)) != (seg_type, 7, 9, payload):
+            return f"original {seg_type} segment does not parse as version 1"
+    return None
+
+def check_exchange(port, segments, payload_size, workdir):
+    """
+    Run an original-format SYN / DATA / FIN exchange against a Server,
+    which writes its segment log to workdir.
+
+    return:
+    None if the server negotiated version 1 and delivered the data, else what went wrong.
+    """
+    data = os.urandom(segments * payload_size)
+    received = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        server = mrt_server.Server()
+        server.init(port, mrt_server.UDP_MAX_SIZE, log_path=os.path.join(workdir, f"log_{port}.txt"))
+    peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    peer.bind(('127.0.0.1', 0))
+    peer.settimeout(REPLY_TIMEOUT)
+
+    def receive():
+        conn = server.accept(REPLY_TIMEOUT * 2)
+        received['version'] = conn.version if conn else None
+        received['data'] = server.receive(conn, len(data), REPLY_TIMEOUT * 2) if conn else b''
+
+    def request(segment, expected_type):
+        peer.sendto(segment, ('127.0.0.1', port))
+        while True:
+            reply = original_parse(peer.recv(mrt_server.UDP_MAX_SIZE))
+            if reply is None:
+                raise ValueError(f"reply to segment type {segment[0]} is not in the original format")
+            if reply[0] == expected_type:
+                return reply
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        reader = threading.Thread(target=receive)
+        reader.start()
+        try:
+            syn_seq = 100
+            _, server_seq, ack, handshake = request(original_create(mrt_segment.SYN, syn_seq, 0), mrt_segment.SYN_ACK)
+            if ack != syn_seq + 1 or handshake:
+                return f"unexpected SYN-ACK: ack {ack}, payload {handshake!r}"
+            seq = ack
+            for i in range(segments):
+                chunk = data[i * payload_size:(i + 1) * payload_size]
+                peer.sendto(original_create(mrt_segment.DATA, seq, server_seq + 1, chunk), ('127.0.0.1', port))
+                seq += 1
+            _, _, ack, _ = request(original_create(mrt_segment.FIN, seq, server_seq + 1), mrt_segment.FIN_ACK)
+            if ack != seq + 1:
+                return f"unexpected FIN-ACK: ack {ack}, expected {seq + 1}"
+        except (OSError, ValueError) as e:
+            return str(e)
+        finally:
+            reader.join()
+            peer.close()
+            server.close()
+    if received.get('version') != mrt_segment.V1:
+        return f"server negotiated version {received.get('version')}, expected 1"
+    if received.get('data') != data:
+        return f"server received {len(received.get('data', b''))} of {len(data)} bytes or wrong data"
+    return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+                    prog='check_compat.py',
+                    description='Checks interoperability with clients that speak the original MRT format.')
+    parser.add_argument('--port', type=int, default=60700, help='port of the server under test')
+    parser.add_argument('--segments', type=int, default=8, help='DATA segments to send')
+    parser.add_argument('--payload', type=int, default=1000, help='payload bytes per DATA segment')
+    args = parser.parse_args()
+
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix='mrt-compat-') as workdir:
+        checks = (('codec', check_codec(os.urandom(args.payload))),
+                  ('exchange', check_exchange(args.port, args.segments, args.payload, workdir)))
+    for name, error in checks:
+        print(f"{name}: {'FAIL ' + error if error else 'OK'}")
+        failures += error is not None
+    sys.exit(1 if failures else 0)
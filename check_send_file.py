@@ -0,0 +1,118 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# check_send_file.py - checks that an interrupted send_file raises the exception that interrupted it
+#                      and releases the memory map of the file
+#
+# usage: python check_send_file.py [--port 60710] [--size 2000000]
+#
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import os
+import sys
+import tempfile
+
+import mrt_async
+import mrt_client
+import mrt_server
+
+ABORT_AFTER = 50  # DATA segments the interrupted client sends first
+CANCEL_AFTER = 0.5  # Seconds before the asynchronous transfer is cancelled
+RECEIVE_WINDOW = 64 * 1024  # Small, and never read by the server, so the async transfer stalls
+
+class Interrupted(Exception):
+    """Raised from inside the transfer by InterruptedClient."""
+
+class InterruptedClient(mrt_client.Client):
+    """A Client whose transfer fails after ABORT_AFTER DATA segments."""
+    sent = 0
+
+    def _send_data_segment(self, segment):
+        self.sent += 1
+        if self.sent == ABORT_AFTER:
+            raise Interrupted(f"interrupted after {ABORT_AFTER} segments")
+        return super()._send_data_segment(segment)
+
+def mapped(path):
+    """Whether path is still memory-mapped by this process (always False where /proc is missing)."""
+    try:
+        with open('/proc/self/maps') as maps:
+            return os.path.realpath(path) in maps.read()
+    except OSError:
+        return False
+
+def check_exception(port, path):
+    """send_file must raise Interrupted, not a BufferError from closing the map."""
+    client = InterruptedClient()
+    client.init(port + 1, '127.0.0.1', port, 1460)
+    client.connect()
+    try:
+        client.send_file(path)
+    except Interrupted:
+        pass
+    except Exception as e:
+        return f"send_file raised {type(e).__name__}: {e}"
+    else:
+        return "send_file was not interrupted"
+    finally:
+        client.socket.close()
+        client.log_file.close()
+    gc.collect()
+    return "the file is still mapped" if mapped(path) else None
+
+def check_cancel(port, path):
+    """Cancelling an AsyncClient.send_file task must raise CancelledError."""
+    async def run():
+        client = mrt_async.AsyncClient()
+        await client.init(port + 2, '127.0.0.1', port, 1460)
+        await client.connect()
+        task = asyncio.ensure_future(client.send_file(path))
+        await asyncio.sleep(CANCEL_AFTER)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return None
+        except Exception as e:
+            return f"send_file raised {type(e).__name__}: {e}"
+        finally:
+            client.socket.close()
+            client.log_file.close()
+        return "send_file finished before it was cancelled"
+
+    error = asyncio.run(run())
+    gc.collect()
+    return error or ("the file is still mapped" if mapped(path) else None)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+                    prog='check_send_file.py',
+                    description='Checks that interrupted send_file calls fail with their original exception.')
+    parser.add_argument('--port', type=int, default=60710, help='port of the server; clients use the next two')
+    parser.add_argument('--size', type=int, default=2000000, help='size of the file to send in bytes')
+    args = parser.parse_args()
+
+    failures = 0
+    with tempfile.TemporaryDirectory(prefix='mrt-send-file-') as workdir:
+        path = os.path.join(workdir, 'data.bin')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(args.size))
+        previous = os.getcwd()
+        os.chdir(workdir)  # Segment logs go to the temporary directory
+        try:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                server = mrt_server.Server()
+                server.init(args.port, mrt_server.UDP_MAX_SIZE, receive_window=RECEIVE_WINDOW)
+                checks = (('exception', check_exception(args.port, path)),
+                          ('cancel', check_cancel(args.port, path)))
+                server.close()
+        finally:
+            os.chdir(previous)
+    for name, error in checks:
+        print(f"{name}: {'FAIL ' + error if error else 'OK'}")
+        failures += error is not None
+    sys.exit(1 if failures else 0)
@@ -0,0 +1,504 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# mrt_analyze.py - offline analysis of client and server segment logs (log_<port>.txt or .bin)
+#
+# usage: python mrt_analyze.py log_50000.txt [log_60000.txt ...] [--interval 0.1] [--stall 0.2]
+#                              [--format text|json|csv] [--output FILE]
+#
+
+import argparse
+import csv
+import heapq
+import json
+import math
+import sys
+
+import mrt_log
+from mrt_segment import SYN, ACK, DATA, FIN
+
+# Constants
+INTERVAL = 0.1  # Seconds per goodput timeline bucket
+STALL = 0.2  # Shortest gap without progress reported as a stall, in seconds
+SETTLE = 1.0  # Seconds after a segment is acknowledged before its cross-log accounting is final
+BUCKETS_PER_OCTAVE = 8  # Resolution of the delay histograms (about 9% per bucket)
+HISTOGRAM_FLOOR = 1e-6  # Delays below one microsecond share the lowest bucket
+PAIR_WINDOW = 40.0  # Longest time between the two logs' first SYN of one connection (10 SYNs, 4 s apart)
+
+class Histogram:
+    """
+    Log-scale histogram of delays in seconds: percentiles of any number of
+    samples in constant memory, accurate to one bucket.
+    """
+    def __init__(self):
+        self.buckets = {}  # Bucket index -> count
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        """Record one sample."""
+        index = math.floor(math.log2(max(value, HISTOGRAM_FLOOR)) * BUCKETS_PER_OCTAVE)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, p):
+        """The upper bound of the bucket holding the p-th percentile (0-100), or None without samples."""
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(2 ** ((index + 1) / BUCKETS_PER_OCTAVE), self.max)
+        return self.max
+
+    def summary(self):
+        """Count, mean, min, p50, p90, p99 and max in seconds."""
+        return {
+            'samples': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+class Timeline:
+    """Per-interval counters of a connection, relative to its first segment."""
+    def __init__(self, interval):
+        self.interval = interval
+        self.start = None
+        self.buckets = {}  # Interval index -> {counter: value}
+
+    def add(self, t, counter, value=1):
+        """Add value to counter in the interval holding time t."""
+        if self.start is None:
+            self.start = t
+        bucket = self.buckets.setdefault(int((t - self.start) / self.interval), {})
+        bucket[counter] = bucket.get(counter, 0) + value
+
+    def rows(self):
+        """(interval start in seconds, counters) for every interval up to the last one, empty ones included."""
+        last = max(self.buckets, default=-1)
+        return [(index * self.interval, self.buckets.get(index, {})) for index in range(last + 1)]
+
+class Pair:
+    """
+    The two ends of one connection, when both the client and the server log
+    are analyzed: per sequence number, how often the client sent it and how
+    often the server received it. Entries are settled once the segment has
+    been acknowledged for SETTLE seconds, so memory stays around one window.
+    """
+    def __init__(self, start):
+        self.start = start  # Time of the first SYN record of the first end
+        self.sender = None
+        self.receiver = None
+        self.segments = {}  # seq -> [first send time, sends, receives]
+        self.settling = []  # Min-heap of (time acknowledged, seq)
+        self.lost = 0  # Transmissions the server never received
+        self.spurious = 0  # Receptions beyond the first: retransmissions that were not needed
+        self.forward_delay = Histogram()  # Client send to server receive, for segments sent once
+
+    def sent(self, t, seq):
+        entry = self.segments.get(seq)
+        if entry is None:
+            self.segments[seq] = [t, 1, 0]
+        else:
+            entry[1] += 1
+
+    def received(self, t, seq):
+        entry = self.segments.get(seq)
+        if entry is None:  # Settled already: a late duplicate
+            self.spurious += 1
+            return
+        entry[2] += 1
+        if entry[2] == 1 and entry[1] == 1:
+            self.forward_delay.add(t - entry[0])
+
+    def acknowledged(self, t, seq):
+        heapq.heappush(self.settling, (t, seq))
+
+    def settle(self, now):
+        """Account for the segments acknowledged more than SETTLE seconds before now."""
+        while self.settling and self.settling[0][0] <= now - SETTLE:
+            _, seq = heapq.heappop(self.settling)
+            entry = self.segments.pop(seq, None)
+            if entry is not None:
+                self.lost += max(0, entry[1] - entry[2])
+                self.spurious += max(0, entry[2] - 1)
+
+class Connection:
+    """One connection as seen in one log file."""
+    def __init__(self, path, local_port, peer_port, syn_seq, interval):
+        self.path = path
+        self.local_port = local_port
+        self.peer_port = peer_port
+        self.syn_seq = syn_seq  # Sequence number of the client's SYN (None if the log starts later)
+        self.closed = False  # Whether a FIN was seen; a later SYN starts a new connection
+        self.role = None  # "sender" (client side) or "receiver" (server side), known after the SYN or first DATA
+        self.pair = None
+        self.first_time = None
+        self.last_time = None
+        self.timeline = Timeline(interval)
+        self.stalls = []  # (start time, seconds) without progress
+        self.last_progress = None
+
+        # Sender side
+        self.outstanding = {}  # seq -> [send time, payload length, retransmitted]
+        self.cum_ack = None  # Highest cumulative ACK seen
+        self.segments_sent = 0
+        self.retransmissions = 0
+        self.bytes_acked = 0
+        self.duplicate_acks = 0
+        self.rtt = Histogram()
+
+        # Receiver side
+        self.expected = None  # Next in-order sequence number
+        self.above = {}  # seq -> payload length of segments received beyond a hole
+        self.segments_received = 0
+        self.duplicates = 0
+        self.out_of_order = 0
+        self.depths = {}  # Distance from the next expected segment -> count
+        self.bytes_delivered = 0
+        self.acks_sent = 0
+
+    def _progress(self, t, stall, waiting):
+        """Note progress at time t, recording a stall if nothing moved for longer than stall seconds while waiting."""
+        if waiting and self.last_progress is not None and t - self.last_progress > stall:
+            self.stalls.append((self.last_progress, t - self.last_progress))
+        self.last_progress = t
+
+    def on_record(self, record, stall):
+        """Update the connection with one of its log records."""
+        t = record.time
+        if self.first_time is None:
+            self.first_time = t
+        self.last_time = t
+        sending = record.direction == "SEND"
+
+        if record.type == DATA and sending:
+            self.role = "sender"
+            seq, length = record.seq, record.payload_len
+            if self.last_progress is None:
+                self.last_progress = t
+            if self.cum_ack is None:
+                self.cum_ack = seq
+            if seq in self.outstanding:
+                self.outstanding[seq][2] = True
+                self.retransmissions += 1
+                self.timeline.add(t, 'retransmissions')
+            elif seq >= self.cum_ack:
+                self.outstanding[seq] = [t, length, False]
+                self.segments_sent += 1
+            else:
+                self.retransmissions += 1  # Resent after it was acknowledged
+                self.timeline.add(t, 'retransmissions')
+            if self.pair:
+                self.pair.sent(t, seq)
+
+        elif record.type == ACK and not sending and self.role == "sender":
+            # An ACK before the first DATA (e.g. the reply to a resumed SYN)
+            # acknowledges nothing yet
+            if self.cum_ack is None:
+                return
+            ack = record.ack
+            if ack > self.cum_ack:
+                self._progress(t, stall, bool(self.outstanding))
+                seqs = range(self.cum_ack, ack) if ack - self.cum_ack <= 2 * len(self.outstanding) + 2 \
+                    else [seq for seq in self.outstanding if seq < ack]
+                newest = None
+                for seq in seqs:
+                    segment = self.outstanding.pop(seq, None)
+                    if segment is None:
+                        continue
+                    self.bytes_acked += segment[1]
+                    self.timeline.add(t, 'bytes', segment[1])
+                    newest = segment
+                    if self.pair:
+                        self.pair.acknowledged(t, seq)
+                # Like the sender's estimator: sample the newest segment, and only if it was sent once
+                if newest is not None and not newest[2]:
+                    self.rtt.add(t - newest[0])
+                self.cum_ack = ack
+            elif self.outstanding:
+                self.duplicate_acks += 1
+
+        elif record.type == DATA and not sending:
+            self.role = "receiver"
+            seq, length = record.seq, record.payload_len
+            self.segments_received += 1
+            if self.last_progress is None:
+                self.last_progress = t
+            if self.expected is None:
+                self.expected = seq
+            if self.pair:
+                self.pair.received(t, seq)
+            if seq < self.expected or seq in self.above:
+                self.duplicates += 1
+                self.timeline.add(t, 'duplicates')
+            elif seq == self.expected:
+                self._progress(t, stall, bool(self.above))
+                delivered = length
+                self.expected += 1
+                while self.expected in self.above:
+                    delivered += self.above.pop(self.expected)
+                    self.expected += 1
+                self.bytes_delivered += delivered
+                self.timeline.add(t, 'bytes', delivered)
+            else:
+                self.above[seq] = length
+                self.out_of_order += 1
+                depth = seq - self.expected
+                self.depths[depth] = self.depths.get(depth, 0) + 1
+                self.timeline.add(t, 'out_of_order')
+
+        elif record.type == ACK and sending:
+            self.acks_sent += 1
+
+        elif record.type == FIN:
+            self.closed = True
+
+    def finish(self, stall):
+        """Close the books at the end of the log: a transfer that ends waiting is a stall."""
+        if self.last_time is not None and (self.outstanding or self.above):
+            self._progress(self.last_time, stall, True)
+
+    def report(self):
+        """The summary of the connection as a dict."""
+        duration = (self.last_time - self.first_time) if self.first_time is not None else 0.0
+        report = {
+            'log': self.path,
+            'local_port': self.local_port,
+            'peer_port': self.peer_port,
+            'syn_seq': self.syn_seq,
+            'role': self.role,
+            'duration': duration,
+            'stalls': len(self.stalls),
+            'stall_seconds': sum(seconds for _, seconds in self.stalls),
+            'longest_stall': max(self.stalls, key=lambda stall: stall[1], default=None),
+        }
+        if report['longest_stall'] is not None:
+            start, seconds = report['longest_stall']
+            report['longest_stall'] = {'at': start - self.first_time, 'seconds': seconds}
+        if self.role == "sender":
+            transmissions = self.segments_sent + self.retransmissions
+            report.update({
+                'segments_sent': self.segments_sent,
+                'retransmissions': self.retransmissions,
+                'retransmission_rate': self.retransmissions / transmissions if transmissions else 0.0,
+                'duplicate_acks': self.duplicate_acks,
+                'bytes_acked': self.bytes_acked,
+                'goodput_mbps': self.bytes_acked * 8 / duration / 1e6 if duration else None,
+                'rtt': self.rtt.summary(),
+                'unacknowledged': len(self.outstanding),
+            })
+            if self.pair and self.pair.receiver:
+                report.update({
+                    'lost_in_network': self.pair.lost,
+                    'spurious_retransmissions': self.pair.spurious,
+                    'forward_delay': self.pair.forward_delay.summary(),
+                })
+        elif self.role == "receiver":
+            report.update({
+                'segments_received': self.segments_received,
+                'duplicates': self.duplicates,
+                'duplicate_rate': self.duplicates / self.segments_received if self.segments_received else 0.0,
+                'out_of_order': self.out_of_order,
+                'max_out_of_order_depth': max(self.depths, default=0),
+                'out_of_order_depths': dict(sorted(self.depths.items())),
+                'bytes_delivered': self.bytes_delivered,
+                'goodput_mbps': self.bytes_delivered * 8 / duration / 1e6 if duration else None,
+            })
+        return report
+
+def _tagged(path):
+    """The records of one log as (time, path, record)."""
+    for record in mrt_log.read(path):
+        yield record.time, path, record
+
+def _records(paths):
+    """The records of every log merged by time, each as (time, path, record)."""
+    return heapq.merge(*[_tagged(path) for path in paths], key=lambda item: item[0])
+
+def _ports(conn):
+    """(client port, server port) of a connection as its own log sees them."""
+    return (conn.local_port, conn.peer_port) if conn.role == "sender" else (conn.peer_port, conn.local_port)
+
+def _pair(pairs, conn, t):
+    """
+    The Pair of a connection whose SYN was logged at time t. The other end
+    is a connection of the other role with the same SYN seq, whose first SYN
+    was logged within PAIR_WINDOW, and whose log shows the same client and
+    server ports. Through a relay (network.py) neither log sees the other
+    end's port, but both see the relay's: the client's server port is then
+    the server's client port. The closest such connection in time wins, so
+    clients that happen to draw the same initial sequence number are kept apart.
+    """
+    other = "receiver" if conn.role == "sender" else "sender"
+    waiting = pairs[conn.syn_seq] = [pair for pair in pairs.get(conn.syn_seq, ())
+                                     if abs(t - pair.start) <= PAIR_WINDOW]
+    best = None
+    for pair in waiting:
+        end = getattr(pair, other)
+        if getattr(pair, conn.role) is not None or end is None:
+            continue
+        client_view, server_view = (conn, end) if conn.role == "sender" else (end, conn)
+        direct = _ports(client_view) == _ports(server_view)
+        if not direct and _ports(client_view)[1] != _ports(server_view)[0]:  # Not the same relay either
+            continue
+        rank = (not direct, abs(t - pair.start))
+        if best is None or rank < best[0]:
+            best = (rank, pair)
+    if best is None:
+        pair = Pair(t)
+        waiting.append(pair)
+    else:
+        pair = best[1]
+        waiting.remove(pair)  # Both ends are known
+        if not waiting:
+            del pairs[conn.syn_seq]
+    setattr(pair, conn.role, conn)
+    return pair
+
+def analyze(paths, interval=INTERVAL, stall=STALL):
+    """
+    Stream the given logs and reconstruct their connections.
+
+    A client log holds the SYN and DATA it sent and the ACKs it received; a
+    server log the same segments in the other direction. Connections found
+    in both are paired by the sequence number of the client's SYN, the
+    client and server ports and the time of the SYN (see _pair), which
+    adds losses in the network, spurious retransmissions and one-way delay.
+
+    return:
+    A list of Connection, in the order they started.
+    """
+    connections = []
+    current = {}  # (path, peer port) -> Connection receiving that peer's records
+    pairs = {}  # Client SYN seq -> Pairs still waiting for their second end
+    settling = set()  # Pairs with segments waiting to be settled
+
+    for t, path, record in _records(paths):
+        sending = record.direction == "SEND"
+        local, peer = (record.src_port, record.dst_port) if sending else (record.dst_port, record.src_port)
+        key = (path, peer)
+        conn = current.get(key)
+
+        if record.type == SYN and (conn is None or conn.syn_seq != record.seq or conn.closed):
+            if conn is not None:
+                conn.finish(stall)
+            conn = current[key] = Connection(path, local, peer, record.seq, interval)
+            connections.append(conn)
+            conn.role = "sender" if sending else "receiver"
+            conn.pair = _pair(pairs, conn, t)
+        elif conn is None:
+            conn = current[key] = Connection(path, local, peer, None, interval)
+            connections.append(conn)
+
+        conn.on_record(record, stall)
+        if conn.pair is not None:
+            if not (conn.pair.sender and conn.pair.receiver):
+                continue
+            settling.add(conn.pair)
+            conn.pair.settle(t)
+
+    for conn in connections:
+        conn.finish(stall)
+    for pair in settling:
+        pair.settle(math.inf)
+
+    # Drop the cross-log bookkeeping of connections seen in only one log
+    for conn in connections:
+        if conn.pair is not None and not (conn.pair.sender and conn.pair.receiver):
+            conn.pair = None
+    return connections
+
+def _seconds(value):
+    """Format a delay in seconds as milliseconds."""
+    return "-" if value is None else f"{value * 1000:.3f} ms"
+
+def write_text(connections, out):
+    """Human readable report: one block per connection and its goodput timeline."""
+    for conn in connections:
+        r = conn.report()
+        print(f"{r['log']}: {r['role'] or 'unknown'} {r['local_port']} <-> {r['peer_port']}"
+              f" (SYN seq {r['syn_seq']}), {r['duration']:.3f} s", file=out)
+        if r['role'] == "sender":
+            print(f"  sent {r['segments_sent']} segments, {r['retransmissions']} retransmissions"
+                  f" ({r['retransmission_rate']:.2%}), {r['duplicate_acks']} duplicate ACKs", file=out)
+            goodput = "-" if r['goodput_mbps'] is None else f"{r['goodput_mbps']:.2f} Mbit/s"
+            print(f"  {r['bytes_acked']} bytes acknowledged, goodput {goodput}", file=out)
+            rtt = r['rtt']
+            print(f"  RTT: {rtt['samples']} samples, min {_seconds(rtt['min'])}, p50 {_seconds(rtt['p50'])},"
+                  f" p90 {_seconds(rtt['p90'])}, p99 {_seconds(rtt['p99'])}, max {_seconds(rtt['max'])}", file=out)
+            if 'lost_in_network' in r:
+                delay = r['forward_delay']
+                print(f"  matched with the server log: {r['lost_in_network']} transmissions lost in the network,"
+                      f" {r['spurious_retransmissions']} spurious retransmissions,"
+                      f" one-way delay p50 {_seconds(delay['p50'])} p99 {_seconds(delay['p99'])}", file=out)
+        elif r['role'] == "receiver":
+            print(f"  received {r['segments_received']} segments, {r['duplicates']} duplicates"
+                  f" ({r['duplicate_rate']:.2%}), {r['out_of_order']} out of order"
+                  f" (max depth {r['max_out_of_order_depth']})", file=out)
+            goodput = "-" if r['goodput_mbps'] is None else f"{r['goodput_mbps']:.2f} Mbit/s"
+            print(f"  {r['bytes_delivered']} bytes delivered in order, goodput {goodput}", file=out)
+        if r['stalls']:
+            longest = r['longest_stall']
+            print(f"  {r['stalls']} stalls, {r['stall_seconds']:.3f} s in total, longest {longest['seconds']:.3f} s"
+                  f" at +{longest['at']:.3f} s", file=out)
+        rows = conn.timeline.rows()
+        if rows:
+            print(f"  goodput per {conn.timeline.interval:g} s (Mbit/s):", file=out)
+            rates = [counters.get('bytes', 0) * 8 / conn.timeline.interval / 1e6 for _, counters in rows]
+            for start in range(0, len(rates), 10):
+                print(f"    +{rows[start][0]:8.1f} s  " + " ".join(f"{rate:7.2f}" for rate in rates[start:start + 10]),
+                      file=out)
+        print(file=out)
+
+def write_json(connections, out):
+    """Summary and timeline of every connection as one JSON document."""
+    json.dump({'connections': [dict(conn.report(), timeline=[dict(start=start, **counters)
+                                                            for start, counters in conn.timeline.rows()])
+                               for conn in connections]}, out, indent=2)
+    print(file=out)
+
+TIMELINE_COLUMNS = ['bytes', 'retransmissions', 'duplicates', 'out_of_order']
+
+def write_csv(connections, out):
+    """The timelines as CSV, one row per connection and interval."""
+    writer = csv.writer(out)
+    writer.writerow(['log', 'local_port', 'peer_port', 'syn_seq', 'role', 'start', 'goodput_mbps'] + TIMELINE_COLUMNS)
+    for conn in connections:
+        for start, counters in conn.timeline.rows():
+            writer.writerow([conn.path, conn.local_port, conn.peer_port, conn.syn_seq, conn.role, f"{start:.3f}",
+                             f"{counters.get('bytes', 0) * 8 / conn.timeline.interval / 1e6:.3f}"]
+                            + [counters.get(column, 0) for column in TIMELINE_COLUMNS])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+                    prog='mrt_analyze.py',
+                    description='Reconstructs MRT transfers from client and server segment logs.')
+    parser.add_argument('logs', nargs='+', help='log_<port>.txt or log_<port>.bin files (client, server or both)')
+    parser.add_argument('--interval', type=float, default=INTERVAL, help='seconds per timeline interval')
+    parser.add_argument('--stall', type=float, default=STALL,
+                        help='report gaps without progress longer than this many seconds')
+    parser.add_argument('--format', choices=['text', 'json', 'csv'], default='text',
+                        help='text report, JSON summary with timelines, or CSV timelines')
+    parser.add_argument('--output', help='write the report to this file instead of stdout')
+    args = parser.parse_args()
+
+    connections = analyze(args.logs, args.interval, args.stall)
+    writer = {'text': write_text, 'json': write_json, 'csv': write_csv}[args.format]
+    if args.output:
+        with open(args.output, 'w', newline='') as out:
+            writer(connections, out)
+    else:
+        writer(connections, sys.stdout)
@@ -0,0 +1,566 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# mrt_async.py - asyncio versions of the MRT client and server APIs
+#
+
+import asyncio
+import collections
+import socket
+import time
+
+import mrt_checksum
+import mrt_client
+import mrt_log
+import mrt_segment
+import mrt_server
+
+# MRT segment types
+from mrt_segment import SYN_ACK, ACK, FIN, FIN_ACK
+
+# Constants
+SERVER_SOCKET_BUFFER = 4 << 20  # Kernel receive buffer of the server socket, for bursts from many clients (capped by the OS)
+
+class _ClientProtocol(asyncio.DatagramProtocol):
+    """Hands datagrams received on an AsyncClient's endpoint to the client."""
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client._datagram_received(data, addr)
+
+    def error_received(self, exc):
+        print(f"Socket error: {exc}")
+
+class _ServerProtocol(asyncio.DatagramProtocol):
+    """Hands datagrams received on an AsyncServer's endpoint to the server."""
+    def __init__(self, server):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server._datagram_received(data, addr)
+
+    def error_received(self, exc):
+        print(f"Socket error: {exc}")
+
+class AsyncClient(mrt_client.Client):
+    """
+    MRT client driven by an asyncio event loop instead of a blocking socket.
+
+    The wire format, handshake and the whole sending side (mrt_client.SendWindow)
+    are shared with Client; only the waiting differs. Replies are queued by
+    the datagram endpoint and every timeout is an event loop timer, so one
+    process can run thousands of AsyncClients concurrently.
+    """
+    async def init(self, src_port, dst_addr, dst_port, segment_size, congestion_control="newreno",
+                   pacing_rate=None, pacing_burst=None, versions=mrt_segment.SUPPORTED_VERSIONS,
+                   checksums=mrt_checksum.PREFERENCE, session=None, log_format=mrt_log.TEXT):
+        """
+        initialize the client and create the client UDP endpoint on the running event loop
+
+        arguments: as Client.init, except that src_port may be 0 to use an ephemeral port
+        """
+        self._configure(src_port, dst_addr, dst_port, segment_size, congestion_control, pacing_rate,
+                        pacing_burst, versions, checksums, session)
+        self._loop = asyncio.get_running_loop()
+        self._replies = collections.deque()  # Parsed segments not yet consumed
+        self._waiter = None  # Future resolved when a reply arrives
+        self.socket, _ = await self._loop.create_datagram_endpoint(
+            lambda: _ClientProtocol(self), local_addr=('0.0.0.0', src_port))
+        self._sendmsg = None  # Transports only take whole datagrams
+        self.src_port = self.socket.get_extra_info('sockname')[1]
+        self.log_file = mrt_log.SegmentLog(mrt_log.log_path(self.src_port, log_format), log_format)
+
+        print(f"Initialized client with max payload size: {self.max_payload_size} bytes")
+
+    def _datagram_received(self, data, addr):
+        """Parse and queue a datagram from the server (event loop callback)."""
+        reply = self._parse_segment(data)
+        if reply is None:  # Corrupted segment
+            print("Received corrupted segment")
+            return
+        self._log_segment(addr[1], self.src_port, reply.seq, reply.ack, reply.type, reply.payload_len, "RECV")
+        self._replies.append(reply)
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    async def _next_reply(self, timeout):
+        """
+        Wait up to timeout seconds for the next segment from the server.
+
+        return:
+        The parsed Segment, or None if the timeout expired first.
+        """
+        if not self._replies:
+            self._waiter = self._loop.create_future()
+            timer = self._loop.call_later(timeout, lambda waiter: waiter.done() or waiter.set_result(None),
+                                          self._waiter)
+            try:
+                await self._waiter
+            finally:
+                timer.cancel()
+                self._waiter = None
+        return self._replies.popleft() if self._replies else None
+
+    async def connect(self):
+        """
+        connect to the server
+        returns once the connection is established
+
+        it should support protection against segment loss/corruption/reordering
+        """
+        if self.connected:
+            print("Already connected")
+            return
+
+        print(f"Connecting to {self.dst_addr}:{self.dst_port}")
+
+        if self._can_resume():
+            self._resume()
+            return
+
+        for retry_count in range(mrt_client.MAX_RETRIES):
+            syn_sent_at = time.monotonic()
+            self._send_syn(self._handshake_offer())
+
+            # Wait for SYN-ACK, skipping anything else
+            deadline = syn_sent_at + self.rtt.rto
+            while True:
+                reply = await self._next_reply(max(deadline - time.monotonic(), 0))
+                if reply is None or (reply.type == SYN_ACK and reply.ack == self.seq_num + 1):
+                    break
+
+            if reply is None:
+                print(f"Timeout waiting for SYN-ACK, retrying ({retry_count + 1}/{mrt_client.MAX_RETRIES})")
+                self.rtt.backoff()
+                continue
+
+            print(f"Received SYN-ACK, seq={reply.seq}, ack={reply.ack}")
+
+            # Seed the RTT estimator from the handshake (Karn's rule: first attempt only)
+            if retry_count == 0:
+                self.rtt.sample(time.monotonic() - syn_sent_at)
+            self._accept_handshake(reply)
+
+            # Send ACK to complete three-way handshake
+            self.socket.sendto(self._create_segment(ACK, self.seq_num, self.ack_num), (self.dst_addr, self.dst_port))
+            self._log_segment(self.src_port, self.dst_port, self.seq_num, self.ack_num, ACK, 0)
+            print(f"Sent ACK, seq={self.seq_num}, ack={self.ack_num}")
+
+            self.connected = True
+            print("Connection established")
+            return
+
+        raise Exception("Failed to connect after maximum retries")
+
+    async def send(self, data, stream_id=None, end_stream=False):
+        """
+        send a chunk of data of arbitrary size to the server
+        returns once all data is acknowledged (see Client.send)
+
+        arguments:
+        data -- the bytes to be sent to the server
+        stream_id -- send on this stream (see open_stream) instead of the default stream
+        end_stream -- finish the stream with this data
+
+        return:
+        The number of bytes sent.
+        """
+        return await super().send(data, stream_id, end_stream)
+
+    async def send_stream(self, stream, stream_id=None, end_stream=False):
+        """
+        send everything produced by a file-like object or an iterable of
+        bytes-like chunks (see Client.send_stream)
+
+        Reading the stream is synchronous; use it for files and in-memory
+        iterables, not for sources that block for long.
+
+        return:
+        The number of bytes sent.
+        """
+        return await super().send_stream(stream, stream_id, end_stream)
+
+    async def send_file(self, path, stream_id=None, end_stream=False):
+        """
+        send the contents of a file through a memory map (see Client.send_file)
+
+        return:
+        The number of bytes sent.
+        """
+        if not self.connected:
+            raise Exception("Not connected to server")
+
+        with self._file_payloads(path, self._payload_limit(stream_id)) as payloads:
+            return await self._send_segments(self._stream_payloads(payloads, stream_id, end_stream))
+
+    async def send_streams(self, sources):
+        """
+        send each source on a new stream of its own (see Client.send_streams)
+
+        return:
+        The stream ids, in the order of sources.
+        """
+        if not self.connected:
+            raise Exception("Not connected to server")
+
+        stream_ids = []
+        await self._send_segments(self._sources_payloads(sources, stream_ids))
+        return stream_ids
+
+    async def send_message(self, message, stream_id=None):
+        """
+        send one framed message (see Client.send_message)
+
+        return:
+        The number of bytes sent, including the length prefix.
+        """
+        return await super().send_message(message, stream_id)
+
+    async def send_messages(self, messages, stream_id=None):
+        """
+        send a batch of framed messages through one window (see Client.send_messages)
+
+        return:
+        The number of bytes sent, including the length prefixes.
+        """
+        return await super().send_messages(messages, stream_id)
+
+    async def close_stream(self, stream_id):
+        """
+        finish a stream, returning once the server has acknowledged its end
+        (see Client.close_stream)
+        """
+        await super().close_stream(stream_id)
+
+    async def _send_segments(self, payloads):
+        """
+        Send payloads from an iterator as DATA segments until all of them are
+        acknowledged, waiting for ACKs on the event loop (see Client._send_segments).
+
+        return:
+        The number of bytes sent.
+        """
+        sender = self._sender = mrt_client.SendWindow(self, payloads)
+
+        try:
+            # Continue until all segments are produced and acknowledged
+            while True:
+                sender.transmit()
+                if sender.done:
+                    break
+
+                # Wait for ACKs, but no longer than the earliest retransmission deadline
+                # or the moment the pacer releases the next segment
+                wait = sender.wait_time()
+                if self._resume_at is not None:
+                    wait = min(wait, self._resume_wait())
+                reply = await self._next_reply(max(wait, 0))
+                if reply is not None:
+                    self._check_resume(reply)
+                    if reply.type == ACK:
+                        sender.on_ack(reply)
+
+                # Handle an expired retransmission timer
+                sender.on_timers()
+                self._check_resume()
+        except BaseException:  # Also a cancelled task
+            sender.abort()
+            raise
+        finally:
+            self._sender = None
+        print(f"All {sender.total_segments} segments sent and acknowledged")
+        return sender.total_bytes
+
+    async def close(self):
+        """
+        request to close the connection with the server
+        returns once the connection is closed
+        """
+        if not self.connected:
+            print("Not connected")
+            return
+
+        print(f"Closing connection with {self.dst_addr}:{self.dst_port}")
+
+        for retry_count in range(mrt_client.MAX_RETRIES):
+            # A resumed SYN that was never answered must reach the server before the FIN
+            if self._resume_at is not None:
+                self._send_syn(self._handshake_offer(self.session.ticket))
+
+            self.socket.sendto(self._create_segment(FIN, self.seq_num, self.ack_num), (self.dst_addr, self.dst_port))
+            self._log_segment(self.src_port, self.dst_port, self.seq_num, self.ack_num, FIN, 0)
+            print(f"Sent FIN, seq={self.seq_num}, ack={self.ack_num}")
+
+            # Wait for FIN-ACK, skipping late ACKs
+            deadline = time.monotonic() + self.rtt.rto
+            while True:
+                reply = await self._next_reply(max(deadline - time.monotonic(), 0))
+                if reply is None or reply.type == FIN_ACK:
+                    break
+                self._check_resume(reply)
+
+            if reply is not None:
+                print(f"Received FIN-ACK, seq={reply.seq}, ack={reply.ack}")
+                print("Connection closed")
+                break
+
+            print(f"Timeout waiting for FIN-ACK, retrying ({retry_count + 1}/{mrt_client.MAX_RETRIES})")
+            self.rtt.backoff()
+        else:
+            print("Connection forcibly closed after maximum retries")
+
+        # Close the endpoint and log file
+        self.connected = False
+        self.log_file.close()
+        self.socket.close()
+        await asyncio.sleep(0)  # The transport closes its socket on the next loop iteration: free the port now
+
+class AsyncServer(mrt_server.Server):
+    """
+    MRT server driven by an asyncio event loop instead of a receiver thread.
+
+    Segment handling (handshake, reordering, SACK, delayed ACKs, flow control)
+    is inherited from Server: the datagram endpoint feeds Server._handle_segment
+    and the transport stands in for the socket. accept() and receive() are
+    coroutines woken by the handlers, and delayed ACKs are flushed by an event
+    loop timer.
+    """
+    def __init__(self):
+        super().__init__()
+        self._loop = None
+        self._connection_event = None  # Set when a connection may be ready for accept()
+        self._data_events = {}  # Connection -> asyncio.Event set when data arrives or it closes
+        self._ack_timer = None  # Event loop timer of the earliest delayed ACK
+
+    async def init(self, listen_port, receive_buffer_size, receive_window=mrt_server.RECEIVE_WINDOW,
+                   versions=mrt_segment.SUPPORTED_VERSIONS, checksums=tuple(mrt_checksum.ALGORITHMS),
+                   ack_frequency=mrt_server.ACK_FREQUENCY, ack_delay=mrt_server.ACK_DELAY, ticket_key=None,
+                   log_path=None, log_format=mrt_log.TEXT):
+        """
+        Initialize the server and create the server UDP endpoint on the running event loop.
+
+        arguments: as Server.init (without reuse_port and batch_io)
+        """
+        self._configure(listen_port, receive_buffer_size, receive_window, versions, checksums,
+                        ack_frequency, ack_delay, ticket_key)
+        self._loop = asyncio.get_running_loop()
+        self._connection_event = asyncio.Event()
+        self.socket, _ = await self._loop.create_datagram_endpoint(
+            lambda: _ServerProtocol(self), local_addr=('0.0.0.0', listen_port))
+        # One socket serves every connection: give it room to absorb their
+        # combined bursts instead of dropping them
+        self.socket.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SERVER_SOCKET_BUFFER)
+        self.log_file = mrt_log.SegmentLog(log_path or mrt_log.log_path(listen_port, log_format), log_format)
+        self.listening = True
+
+    def _datagram_received(self, data, addr):
+        """Handle a datagram and wake whoever waits for its connection (event loop callback)."""
+        if not self.listening:
+            return
+        conn = self._handle_segment(data, addr)
+        if conn is not None:
+            if not conn.accepted:
+                self._connection_event.set()
+            event = self._data_events.get(conn)
+            if event is not None:
+                event.set()
+
+        # Wake up in time for the earliest delayed ACK. Deadlines are added in
+        # increasing order, so a pending timer is never late.
+        if self.delayed_acks and self._ack_timer is None:
+            earliest = min(self.delayed_acks.values())
+            self._ack_timer = self._loop.call_later(max(earliest - time.monotonic(), 0), self._on_ack_timer)
+
+    def _on_ack_timer(self):
+        """Send the delayed ACKs that are due and rearm the timer for the rest."""
+        self._ack_timer = None
+        self._flush_delayed_acks()
+        if self.delayed_acks and self.listening:
+            earliest = min(self.delayed_acks.values())
+            self._ack_timer = self._loop.call_later(max(earliest - time.monotonic(), 0), self._on_ack_timer)
+
+    async def accept(self, timeout=None):
+        """
+        Accept a connection from a client (see Server.accept).
+
+        arguments:
+        timeout -- the maximum number of seconds to wait, or None to wait forever
+
+        return:
+        A connection object that can be used to receive data from this client,
+        or None if the timeout expired first.
+        """
+        print("Waiting for client connection...")
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            conn = self._pending_connection()
+            if conn is not None or not self.listening:
+                break
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            self._connection_event.clear()
+            try:
+                await asyncio.wait_for(self._connection_event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+        if conn is None:
+            print("Timed out waiting for client connection")
+            return None
+
+        conn.accepted = True
+        print(f"Accepted connection from {conn.addr}:{conn.port}")
+        return conn
+
+    async def accept_stream(self, conn, timeout=None):
+        """
+        Wait for the client to open a new stream on a connection (see Server.accept_stream).
+
+        return:
+        A Stream to pass to receive(), or None if the timeout expired or the
+        client closed the connection first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        event = self._data_events.setdefault(conn, asyncio.Event())
+        while not conn.new_streams and conn.connected:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+        if not conn.new_streams:
+            return None
+        stream = conn.new_streams.popleft()
+        stream.accepted = True
+        print(f"Accepted stream {stream.id} from {conn.addr}:{conn.port}")
+        return stream
+
+    async def receive(self, conn, length, timeout=None, stream=None):
+        """
+        Receive data from the client (see Server.receive).
+
+        arguments:
+        conn -- the connection to receive data from
+        length -- the amount of data to receive in bytes
+        timeout -- the maximum number of seconds to wait, or None to wait forever
+        stream -- read this Stream (see accept_stream) instead of the default stream
+
+        return:
+        The received data as bytes. Shorter than length if the client closed
+        the connection (or finished the stream) or the timeout expired first.
+        """
+        if not conn:
+            raise Exception("Connection is not established")
+        buffer = conn.received_data if stream is None else stream.received_data
+
+        # Data that arrived before the client closed can still be read. A
+        # finished stream reads as empty, like the end of a file.
+        if not self._is_open(conn, stream) and not buffer:
+            if stream is not None:
+                self._retire_stream(conn, stream)
+                return b''
+            raise Exception("Connection is not established")
+
+        mrt_log.debug("Waiting to receive %d bytes from %s:%d", length, conn.addr, conn.port)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        event = self._data_events.setdefault(conn, asyncio.Event())
+        chunks = []  # In-order data already taken out of the receive window
+        collected = 0
+
+        while collected + len(buffer) < length and self._is_open(conn, stream):
+            if buffer:
+                # Take what is already in order, so a request larger than the
+                # receive window cannot stall the sender
+                collected += len(buffer)
+                chunks.extend(self._take(conn, stream))
+                self._update_window(conn)
+                continue
+
+            # Sleep until _handle_data delivers in-order data or the client closes
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+
+        chunks.extend(self._take(conn, stream, length - collected))
+        self._update_window(conn)
+        data = b''.join(chunks)
+
+        if len(data) < length:
+            reason = "Connection closed" if not conn.connected else "Stream finished" if stream and stream.finished \
+                else "Timed out"
+            print(f"{reason} before receiving enough data. Received {len(data)}/{length} bytes")
+        else:
+            print(f"Received {len(data)} bytes from {conn.addr}:{conn.port}")
+        if not conn.connected and not conn.received_data and not conn.stream_bytes:
+            self._data_events.pop(conn, None)
+        return data
+
+    async def receive_message(self, conn, timeout=None, stream=None):
+        """
+        Receive the next message the client sent with send_message() (see Server.receive_message).
+
+        arguments:
+        conn -- the connection to receive from
+        timeout -- the maximum number of seconds to wait for a message to start, or None to wait forever
+        stream -- read from this Stream (see accept_stream) instead of the default stream
+
+        return:
+        The message as bytes, or None if the client closed the connection (or
+        finished the stream) or the timeout expired before a whole message arrived.
+        """
+        if not conn:
+            raise Exception("Connection is not established")
+        buffer = conn.received_data if stream is None else stream.received_data
+        header_size = mrt_segment.MESSAGE_HEADER.size
+
+        # Wait for the length prefix
+        deadline = None if timeout is None else time.monotonic() + timeout
+        event = self._data_events.setdefault(conn, asyncio.Event())
+        while len(buffer) < header_size and self._is_open(conn, stream):
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        if len(buffer) < header_size:
+            return None
+        length, = mrt_segment.MESSAGE_HEADER.unpack(buffer.peek(header_size))
+        self._take(conn, stream, header_size)
+        self._update_window(conn)
+
+        readable = buffer or self._is_open(conn, stream)
+        message = await self.receive(conn, length, stream=stream) if length and readable else b''
+        if len(message) < length:
+            print(f"Message truncated: received {len(message)}/{length} bytes")
+            return None
+        return message
+
+    def close(self):
+        """
+        Close all connections and clean up, waking every pending accept() and receive().
+        """
+        if self._ack_timer is not None:
+            self._ack_timer.cancel()
+            self._ack_timer = None
+        super().close()
+        for event in self._data_events.values():
+            event.set()
+        if self._connection_event is not None:
+            self._connection_event.set()
@@ -0,0 +1,383 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# mrt_batch_io.py - batched UDP sends and receives on Linux: UDP GSO/GRO and sendmmsg/recvmmsg
+#
+
+import ctypes
+import ctypes.util
+import errno
+import select
+import socket
+import struct
+import sys
+
+# Constants
+MAX_BATCH = 64  # Datagrams per batch (also the kernel's limit of segments per GSO send)
+SEND_SLOT_SIZE = 9400  # Room for the largest MRT segment (9000 bytes) plus options
+RECEIVE_SLOT_SIZE = 65535  # Large enough for any UDP datagram, or datagrams coalesced by GRO
+GSO_MAX_BYTES = 65000  # Payload bytes per GSO send, below the 64 KB IP packet limit
+UDP_SEGMENT = 103  # Linux socket options (SOL_UDP), not exported by the socket module
+UDP_GRO = 104
+MSG_DONTWAIT = 0x40
+ADDRESS_CACHE_SIZE = 4096  # Peer addresses remembered in their parsed form
+
+class _IoVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(_IoVec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+class _PyBuffer(ctypes.Structure):
+    _fields_ = [('buf', ctypes.c_void_p), ('obj', ctypes.c_void_p), ('len', ctypes.c_ssize_t),
+                ('itemsize', ctypes.c_ssize_t), ('readonly', ctypes.c_int), ('ndim', ctypes.c_int),
+                ('format', ctypes.c_char_p), ('shape', ctypes.c_void_p), ('strides', ctypes.c_void_p),
+                ('suboffsets', ctypes.c_void_p), ('internal', ctypes.c_void_p)]
+
+# struct sockaddr_in: |family(2B, native)|port(2B)|address(4B)|zero(8B)|
+SOCKADDR_IN = struct.Struct('=H2s4s8x')
+# struct cmsghdr followed by the uint16 segment size of a UDP_GRO message
+CMSG_HEADER = struct.Struct('@Nii')
+GSO_SIZE = struct.Struct('=H')
+
+def _load_libc():
+    """The C library if it has sendmmsg and recvmmsg (Linux), otherwise None."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        libc.sendmmsg.restype = ctypes.c_int
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+        libc.recvmmsg.restype = ctypes.c_int
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+_libc = _load_libc()
+AVAILABLE = _libc is not None  # Whether batching is supported here; otherwise callers send per packet
+
+def _address(buffer):
+    """Memory address of a bytearray (it must not be resized while the address is in use)."""
+    return ctypes.addressof(ctypes.c_char.from_buffer(buffer))
+
+# The buffer protocol of the interpreter, which also exposes read-only
+# objects (bytes, memoryviews of an mmap) that ctypes.c_char.from_buffer refuses
+_get_buffer = ctypes.PYFUNCTYPE(ctypes.c_int, ctypes.py_object, ctypes.c_void_p, ctypes.c_int)(
+    ('PyObject_GetBuffer', ctypes.pythonapi))
+_release_buffer = ctypes.PYFUNCTYPE(None, ctypes.c_void_p)(('PyBuffer_Release', ctypes.pythonapi))
+PYBUF_SIMPLE = 0
+
+def _enable(sock, option, value):
+    """Set a SOL_UDP option, returning whether the kernel supports it."""
+    try:
+        sock.setsockopt(socket.SOL_UDP, option, value)
+        return True
+    except OSError:
+        return False
+
+class BatchSender:
+    """
+    Queues datagrams for one destination and sends them in as few system
+    calls as possible.
+
+    Datagrams are built back to back in a preallocated arena (next_slot(),
+    then queue()). A datagram may also end with a payload that stays where
+    it is: the arena then only holds its header, and the payload is handed
+    to the kernel as a second buffer of the same datagram (scatter-gather),
+    so it is never copied in user space. flush() sends each run of equally sized datagrams as one
+    UDP GSO send, which the kernel splits into the original datagrams, so
+    the per-packet cost of the UDP/IP stack is paid once per run. Without
+    GSO (kernels before 4.18, or if the device refuses it) the batch goes
+    out with a single sendmmsg call. A full arena is flushed automatically;
+    the owner calls flush() once it has queued everything it wants to send now.
+    """
+    def __init__(self, sock, addr, max_batch=MAX_BATCH, slot_size=SEND_SLOT_SIZE, gso=True):
+        """
+        arguments:
+        sock -- the UDP socket to send from
+        addr -- the (host, port) to send to; IPv4 only, like the rest of MRT
+        max_batch -- datagrams per batch
+        slot_size -- the largest datagram that can be queued
+        gso -- use UDP GSO when the kernel supports it
+        """
+        self.sock = sock
+        self.addr = (socket.gethostbyname(addr[0]), addr[1])
+        self.max_batch = max_batch
+        self.slot_size = slot_size
+        self.gso = gso and _enable(sock, UDP_SEGMENT, 0)  # 0: no segmentation unless a send asks for it
+        self.calls = 0  # Send system calls made, for statistics
+        self.datagrams = 0  # Datagrams sent, for statistics
+        self._arena = bytearray(max_batch * slot_size)
+        self._view = memoryview(self._arena)
+        self._base = _address(self._arena)
+        self._lengths = []  # Arena bytes of the queued datagrams, in arena order
+        self._payloads = []  # Payload of each queued datagram (b'' if it lies wholly in the arena)
+        self._used = 0  # Arena bytes taken by queued datagrams
+        self._iovecs = (_IoVec * (2 * max_batch))()  # Arena part and payload of each message
+        # The same memory as flat words: base, length, base, length, ... (cheaper to fill)
+        self._iovec_words = (ctypes.c_size_t * (4 * max_batch)).from_buffer(self._iovecs)
+        self._messages = (_MMsgHdr * max_batch)()
+        self._buffer_info = _PyBuffer()  # Filled by _payload_address()
+
+        # Every message goes to the same address
+        self._name = ctypes.create_string_buffer(SOCKADDR_IN.pack(
+            socket.AF_INET, struct.pack('!H', self.addr[1]), socket.inet_aton(self.addr[0])))
+        for i, message in enumerate(self._messages):
+            message.msg_hdr.msg_name = ctypes.addressof(self._name)
+            message.msg_hdr.msg_namelen = SOCKADDR_IN.size
+            message.msg_hdr.msg_iov = ctypes.pointer(self._iovecs[2 * i])
+            message.msg_hdr.msg_iovlen = 2  # The payload's is empty if there is none
+
+    @property
+    def pending(self):
+        """Datagrams queued and not yet sent."""
+        return len(self._lengths)
+
+    def next_slot(self):
+        """A writable memoryview where the next queued datagram is built."""
+        if len(self._lengths) == self.max_batch or self._used + self.slot_size > len(self._arena):
+            self.flush()
+        return self._view[self._used:self._used + self.slot_size]
+
+    def queue(self, length, payload=b''):
+        """
+        Queue the first length bytes of next_slot(), followed by payload, as a datagram.
+
+        arguments:
+        length -- bytes of the datagram written to next_slot()
+        payload -- a bytes-like object sent after them without being copied;
+                   it must not change until the next flush() or discard()
+        """
+        self._lengths.append(length)
+        self._payloads.append(payload)
+        self._used += length
+
+    def discard(self):
+        """Drop the queued datagrams without sending them, releasing their payloads."""
+        self._lengths = []
+        self._payloads = []
+        self._used = 0
+
+    def flush(self):
+        """
+        Send every queued datagram.
+
+        return:
+        The number of datagrams sent. Datagrams the kernel refuses with an
+        error other than a full send buffer are dropped, like a lost packet.
+        """
+        lengths = [length + len(payload) for length, payload in zip(self._lengths, self._payloads)]
+        sent = 0
+        if self.gso:
+            sent = self._send_gso(lengths)
+        if sent < len(lengths):
+            sent += self._send_mmsg(sent)
+        self.datagrams += sent
+        self.discard()
+        return sent
+
+    def _buffers(self, first, end):
+        """The arena parts and payloads of datagrams first to end, in order, for sendmsg."""
+        buffers = []
+        start = sum(self._lengths[:first])
+        for length, payload in zip(self._lengths[first:end], self._payloads[first:end]):
+            buffers.append(self._view[start:start + length])
+            if payload:
+                buffers.append(payload)
+            start += length
+        return buffers
+
+    def _send_gso(self, lengths):
+        """
+        Send runs of equally sized datagrams (the last may be shorter) with one
+        sendmsg each. The kernel cuts the concatenated buffers of a run into
+        datagrams at every multiple of the size, wherever the buffers end.
+        """
+        index = 0
+        while index < len(lengths):
+            size = lengths[index]
+            end = index + 1
+            total = size
+            while end < len(lengths) and lengths[end] <= size and total + lengths[end] <= GSO_MAX_BYTES:
+                total += lengths[end]
+                end += 1
+                if lengths[end - 1] < size:  # Only the last datagram of a run may be shorter
+                    break
+            try:
+                ancillary = [(socket.SOL_UDP, UDP_SEGMENT, GSO_SIZE.pack(size))] if end - index > 1 else []
+                self.sock.sendmsg(self._buffers(index, end), ancillary, 0, self.addr)
+                self.calls += 1
+            except OSError as e:
+                if e.errno in (errno.EINVAL, errno.EIO, errno.ENOPROTOOPT, errno.EOPNOTSUPP):
+                    print(f"UDP GSO failed ({e}), falling back to sendmmsg")
+                    self.gso = False
+                    return index
+                print(f"Error sending {end - index} datagrams: {e}")
+            index = end
+        return index
+
+    def _payload_address(self, payload):
+        """
+        Memory address of a queued payload. It stays valid while the payload
+        is queued: the payload itself (or the memoryview's own export) keeps
+        the memory in place.
+        """
+        info = ctypes.addressof(self._buffer_info)
+        _get_buffer(payload, info, PYBUF_SIMPLE)
+        address = self._buffer_info.buf
+        _release_buffer(info)
+        return address
+
+    def _send_mmsg(self, first):
+        """Send the datagrams from index first on with sendmmsg."""
+        messages, words = self._messages, self._iovec_words
+        lengths, payloads = self._lengths, self._payloads
+        offset = sum(lengths[:first])
+        for index in range(first, len(lengths)):
+            length, payload = lengths[index], payloads[index]
+            word = 4 * index
+            words[word] = self._base + offset
+            words[word + 1] = length
+            words[word + 2] = self._payload_address(payload) if payload else 0
+            words[word + 3] = len(payload)
+            offset += length
+
+        index = first
+        fd = self.sock.fileno()
+        while index < len(lengths):
+            count = _libc.sendmmsg(fd, ctypes.byref(messages[index]), len(lengths) - index, 0)
+            self.calls += 1
+            if count < 0:
+                error = ctypes.get_errno()
+                if error == errno.EINTR:
+                    continue
+                if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    # The socket has a timeout, so its descriptor is non-blocking
+                    select.select([], [self.sock], [], self.sock.gettimeout())
+                    continue
+                print(f"Error sending {len(lengths) - index} datagrams: {errno.errorcode.get(error, error)}")
+                break
+            index += count
+        return index - first
+
+class BatchReceiver:
+    """
+    Receives every datagram waiting on a socket with a single recvmmsg call.
+
+    With UDP GRO the kernel may also hand over a run of datagrams of the
+    same flow coalesced into one buffer together with their size; receive()
+    splits them again. Received datagrams are memoryviews into the
+    receiver's arena and are only valid until the next receive().
+    """
+    def __init__(self, sock, max_batch=MAX_BATCH, slot_size=RECEIVE_SLOT_SIZE, gro=True):
+        """
+        arguments:
+        sock -- the UDP socket to receive from
+        max_batch -- datagrams (or GRO buffers) per recvmmsg call
+        slot_size -- the largest datagram that is received whole (RECEIVE_SLOT_SIZE with GRO)
+        gro -- ask the kernel for coalesced datagrams when it supports UDP GRO
+        """
+        self.sock = sock
+        self.max_batch = max_batch
+        self.slot_size = slot_size
+        self.gro = gro and _enable(sock, UDP_GRO, 1)
+        self.calls = 0  # recvmmsg calls made, for statistics
+        self.datagrams = 0  # Datagrams received, for statistics
+        self._arena = bytearray(max_batch * slot_size)
+        self._view = memoryview(self._arena)
+        self._iovecs = (_IoVec * max_batch)()
+        self._messages = (_MMsgHdr * max_batch)()
+
+        # Per message: a slot of the arena, a sockaddr_in for the sender's
+        # address and a control buffer for the GRO segment size
+        self._control_size = socket.CMSG_SPACE(GSO_SIZE.size) if self.gro else 0
+        self._names = bytearray(max_batch * SOCKADDR_IN.size)
+        self._controls = bytearray(max(1, max_batch * self._control_size))
+        base, names, controls = _address(self._arena), _address(self._names), _address(self._controls)
+        for i, (message, iovec) in enumerate(zip(self._messages, self._iovecs)):
+            iovec.iov_base = base + i * slot_size
+            iovec.iov_len = slot_size
+            message.msg_hdr.msg_iov = ctypes.pointer(iovec)
+            message.msg_hdr.msg_iovlen = 1
+            message.msg_hdr.msg_name = names + i * SOCKADDR_IN.size
+            message.msg_hdr.msg_namelen = SOCKADDR_IN.size
+            if self.gro:
+                message.msg_hdr.msg_control = controls + i * self._control_size
+                message.msg_hdr.msg_controllen = self._control_size
+        self._used = 0  # Messages whose lengths the last call overwrote
+        self._addresses = {}  # Raw port and address bytes -> (host, port)
+
+    def receive(self, timeout=0):
+        """
+        Receive the datagrams waiting on the socket.
+
+        arguments:
+        timeout -- seconds to wait if none is waiting yet (0: return at once)
+
+        return:
+        A list of (datagram memoryview, (host, port)), empty if none arrived in time.
+        """
+        count = self._receive()
+        if not count and timeout and select.select([self.sock], [], [], timeout)[0]:
+            count = self._receive()
+
+        datagrams = []
+        messages = self._messages
+        names = self._names
+        addresses = self._addresses
+        for i in range(count):
+            start = i * SOCKADDR_IN.size
+            key = bytes(names[start + 2:start + 8])
+            addr = addresses.get(key)
+            if addr is None:
+                if len(addresses) >= ADDRESS_CACHE_SIZE:
+                    addresses.clear()
+                addr = addresses[key] = (socket.inet_ntoa(key[2:]), struct.unpack('!H', key[:2])[0])
+
+            start = i * self.slot_size
+            end = start + messages[i].msg_len
+            size = self._gso_size(i) if self.gro else 0
+            if size and end - start > size:
+                for pos in range(start, end, size):
+                    datagrams.append((self._view[pos:min(pos + size, end)], addr))
+            else:
+                datagrams.append((self._view[start:end], addr))
+        self.datagrams += len(datagrams)
+        return datagrams
+
+    def _receive(self):
+        """One non-blocking recvmmsg call; return the number of messages received."""
+        messages = self._messages
+        for i in range(self._used):
+            messages[i].msg_hdr.msg_namelen = SOCKADDR_IN.size
+            messages[i].msg_hdr.msg_controllen = self._control_size
+        self._used = 0
+        while True:
+            count = _libc.recvmmsg(self.sock.fileno(), messages, self.max_batch, MSG_DONTWAIT, None)
+            self.calls += 1
+            if count >= 0:
+                self._used = count
+                return count
+            error = ctypes.get_errno()
+            if error != errno.EINTR:
+                if error not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    print(f"Error receiving datagrams: {errno.errorcode.get(error, error)}")
+                return 0
+
+    def _gso_size(self, i):
+        """Size of the datagrams coalesced in message i by GRO, or 0 if it holds a single one."""
+        if self._messages[i].msg_hdr.msg_controllen < socket.CMSG_LEN(GSO_SIZE.size):
+            return 0
+        start = i * self._control_size
+        _, level, kind = CMSG_HEADER.unpack_from(self._controls, start)
+        if level != socket.SOL_UDP or kind != UDP_GRO:
+            return 0
+        return GSO_SIZE.unpack_from(self._controls, start + CMSG_HEADER.size)[0]
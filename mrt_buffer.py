@@ -0,0 +1,114 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# mrt_buffer.py - receive-side buffers: the in-order receive buffer and the datagram buffer pool
+#
+
+from collections import deque
+
+class ReceiveBuffer:
+    """
+    FIFO byte buffer made of the payloads as they arrived.
+
+    Appending a payload is O(1) and never copies it. Reads consume whole
+    chunks and slice at most one chunk through a memoryview, so every byte is
+    copied exactly once, into the bytes object returned to the application.
+    """
+    def __init__(self):
+        self._chunks = deque()
+        self._offset = 0  # Bytes of the first chunk already read
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def append(self, data):
+        """Add a bytes-like payload to the end of the buffer (kept by reference)."""
+        if len(data):
+            self._chunks.append(data)
+            self._size += len(data)
+
+    def take(self, n=None):
+        """
+        Remove up to n bytes (everything if n is None) from the front.
+
+        return:
+        A list of bytes-like pieces totalling the removed bytes, without
+        copying them.
+        """
+        n = self._size if n is None else min(n, self._size)
+        pieces = []
+        remaining = n
+        while remaining:
+            chunk = self._chunks[0]
+            available = len(chunk) - self._offset
+            if available <= remaining:
+                pieces.append(memoryview(chunk)[self._offset:] if self._offset else chunk)
+                self._chunks.popleft()
+                self._offset = 0
+                remaining -= available
+            else:
+                pieces.append(memoryview(chunk)[self._offset:self._offset + remaining])
+                self._offset += remaining
+                remaining = 0
+        self._size -= n
+        return pieces
+
+    def peek(self, n):
+        """Return up to the first n bytes as bytes without removing them."""
+        pieces = []
+        remaining = min(n, self._size)
+        offset = self._offset
+        for chunk in self._chunks:
+            if not remaining:
+                break
+            piece = memoryview(chunk)[offset:offset + remaining]
+            pieces.append(piece)
+            remaining -= len(piece)
+            offset = 0
+        return b''.join(pieces)
+
+    def read(self, n=None):
+        """Remove and return up to n bytes (everything if n is None) as bytes."""
+        return b''.join(self.take(n))
+
+    def clear(self):
+        """Drop all buffered data."""
+        self._chunks.clear()
+        self._offset = 0
+        self._size = 0
+
+class BufferPool:
+    """
+    Free list of equally sized bytearrays for socket.recvfrom_into.
+
+    acquire() hands out a free buffer (allocating one only when the pool is
+    empty) and release() returns it for reuse. Anything parsed out of a
+    buffer must be copied before the buffer is released.
+    """
+    def __init__(self, buffer_size, count):
+        """
+        arguments:
+        buffer_size -- the size of each buffer in bytes
+        count -- how many buffers to preallocate and keep around
+        """
+        self.buffer_size = buffer_size
+        self.count = count
+        self._free = deque(bytearray(buffer_size) for _ in range(count))
+        self.allocations = count  # Buffers allocated so far, for statistics
+
+    def acquire(self):
+        """Take a buffer from the pool."""
+        if self._free:
+            return self._free.pop()
+        self.allocations += 1
+        return bytearray(self.buffer_size)
+
+    def release(self, buffer):
+        """Give a buffer back to the pool."""
+        if len(self._free) < self.count:
+            self._free.append(buffer)
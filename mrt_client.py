@@ -6,27 +6,425 @@
 #
 
 import socket # for UDP connection
-import struct
-import hashlib
 import time
 import random
 import threading
+import heapq
+import mmap
+import contextlib
+import os
+from collections import namedtuple
+
+import mrt_batch_io
+import mrt_checksum
+import mrt_congestion
+import mrt_log
+import mrt_metrics
+import mrt_pacer
+import mrt_segment
 
 # MRT segment types
-SYN = 0
-SYN_ACK = 1
-ACK = 2
-DATA = 3
-FIN = 4
-FIN_ACK = 5
+from mrt_segment import SYN, SYN_ACK, ACK, DATA, FIN, FIN_ACK
 
 # Constants
 MAX_RETRIES = 10
-TIMEOUT = 0.5  # 500ms timeout
+TIMEOUT = 0.5  # 500ms timeout, used as the initial RTO before any RTT sample
+MIN_RTO = 0.1  # Lower bound on the retransmission timeout
+MAX_RTO = 4.0  # Upper bound on the retransmission timeout (also caps backoff)
 UDP_MAX_SIZE = 9000  # Soft limit of 9000 bytes to avoid "message too long" errors
+DUP_THRESH = 3  # Duplicate ACKs (or segments SACKed above a hole) that signal a loss
+
+# What a client remembers from a handshake to resume the session later
+# without waiting for the SYN-ACK: the server's ticket, the negotiated wire
+# format, the server's receive window and the RTT.
+Session = namedtuple('Session', ['server', 'ticket', 'version', 'checksum', 'window', 'srtt', 'issued_at'])
+
+class RttEstimator:
+    """
+    Smoothed RTT estimator and retransmission timeout (RFC 6298).
+
+    Samples must only come from segments that were transmitted once
+    (Karn's rule); the caller is responsible for filtering them.
+    """
+    ALPHA = 0.125
+    BETA = 0.25
+    K = 4
+
+    def __init__(self, initial_rto=TIMEOUT, min_rto=MIN_RTO, max_rto=MAX_RTO):
+        self.srtt = None
+        self.rttvar = None
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.rto = initial_rto
+
+    def sample(self, rtt):
+        """Update SRTT/RTTVAR with a new measurement and recompute the RTO."""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.rto = min(max(self.srtt + self.K * self.rttvar, self.min_rto), self.max_rto)
+
+    def backoff(self):
+        """Double the RTO after a retransmission timeout."""
+        self.rto = min(self.rto * 2, self.max_rto)
+
+class OutstandingSegment:
+    """A DATA segment that has been sent and is waiting to be acknowledged."""
+    __slots__ = ('payload', 'seq', 'index', 'sent_at', 'first_sent_at', 'transmissions', 'deadline', 'sacked',
+                 'lost', 'push', 'stream', 'stream_seq', 'fin')
+
+    def __init__(self, payload, seq, index):
+        self.payload = payload  # bytes-like, usually a memoryview into the caller's data
+        self.seq = seq
+        self.index = index  # Position within the current send, for log messages
+        self.sent_at = None  # Time of the last transmission
+        self.first_sent_at = None  # Time of the first transmission, for the ACK latency histogram
+        self.transmissions = 0  # Only segments sent exactly once give RTT samples
+        self.deadline = None  # Current retransmission deadline
+        self.sacked = False  # Reported received by a SACK block, never retransmitted again
+        self.lost = False  # Presumed lost and queued for retransmission
+        self.push = False  # Last segment of the send, asks the server not to delay its ACK
+        self.stream = None  # Stream id, None for the default stream
+        self.stream_seq = 0  # Position within the stream
+        self.fin = False  # Last segment of its stream
+
+class SendWindow:
+    """
+    The sending side of one transfer: the SACK scoreboard, retransmission
+    timers, loss detection and the congestion/receive window checks.
+
+    It does no I/O of its own. The owner calls transmit() to send what the
+    windows allow (through client._send_data_segment), feeds it every ACK
+    with on_ack(), waits at most wait_time() seconds for the next one and
+    then calls on_timers(), until done. Client drives it from a blocking
+    socket and mrt_async.AsyncClient from the event loop.
+    """
+    def __init__(self, client, payloads):
+        """
+        arguments:
+        client -- the Client whose seq_num, peer_window, rtt, cc and pacer are used and updated
+        payloads -- an iterator of bytes-like payloads of at most client._payload_limit() bytes,
+                    or of (stream_id, payload, last) tuples for segments on a stream
+        """
+        self.client = client
+        self.payloads = iter(payloads)
+        self._pull()
+        
+        # Segments sent but not yet cumulatively acknowledged, by sequence
+        # number. Together with their sacked/lost flags this is the SACK scoreboard.
+        self.window = {}
+        self.lost = []  # Min-heap of sequence numbers waiting for retransmission
+        self.base_seq = client.seq_num  # Oldest unacknowledged sequence number
+        self.total_bytes = 0
+        self.total_segments = 0
+        
+        # Per-segment retransmission timers: a min-heap of (deadline, seq).
+        # Entries are invalidated lazily, a popped entry only counts if the
+        # segment is still unacknowledged and the deadline is still current.
+        self.timers = []
+        
+        self.bytes_in_flight = 0  # Payload bytes sent and neither acknowledged, SACKed nor presumed lost
+        self.last_progress = time.monotonic()  # When the cumulative ACK last advanced
+        self.highest_ack = 0  # Highest cumulative ACK seen, to ignore stale window updates
+        self.probe_at = None  # When to probe a closed receive window
+        self.pace_until = None  # When the pacer releases the next segment
+        self.dup_acks = 0  # Consecutive ACKs that did not advance the cumulative ACK
+        self.highest_sacked = None  # Highest sequence number SACKed so far
+        self.fast_retransmit = False  # Send the next lost segment even if cwnd is full
+        
+        client.pacer.update(client.cc.cwnd, client.rtt.srtt, client.cc.in_slow_start())
+
+    def _pull(self):
+        """Fetch the next payload (None when there are no more) and its stream, if any."""
+        item = next(self.payloads, None)
+        if type(item) is tuple:
+            self.next_stream, item, self.next_fin = item
+        else:
+            self.next_stream, self.next_fin = None, False
+        self.next_payload = item
+
+    @property
+    def done(self):
+        """Whether every payload has been sent and acknowledged."""
+        return not self.window and self.next_payload is None
+
+    def abort(self):
+        """
+        Forget every outstanding and pending segment after the transfer was
+        interrupted, so the buffers their payloads point into (e.g. the
+        memory map of send_file) can be released.
+        """
+        self.window.clear()
+        self.lost.clear()
+        self.timers.clear()
+        self.next_payload = None
+        self.bytes_in_flight = 0
+        close = getattr(self.payloads, "close", None)
+        if close is not None:
+            close()  # Drops the payload the generator may hold
+
+    def _arm(self, segment):
+        """Start the retransmission timer of a segment that was just sent."""
+        segment.sent_at = time.monotonic()
+        segment.deadline = segment.sent_at + self.client.rtt.rto
+        heapq.heappush(self.timers, (segment.deadline, segment.seq))
+
+    def transmit(self):
+        """Send lost segments, then new ones, as far as the windows and the pacer allow."""
+        client = self.client
+        window, lost = self.window, self.lost
+        
+        # Retransmit presumed lost segments first, lowest sequence number
+        # first, as far as the congestion window and the pacer allow
+        self.pace_until = None
+        while lost:
+            segment = window.get(lost[0])
+            if segment is None or segment.sacked or not segment.lost:
+                heapq.heappop(lost)
+                continue
+            payload_size = len(segment.payload)
+            if self.bytes_in_flight and self.bytes_in_flight + payload_size > client.cc.cwnd \
+                    and not self.fast_retransmit:
+                break
+            delay = client.pacer.delay(payload_size)
+            if delay > 0:
+                self.pace_until = time.monotonic() + delay
+                break
+            heapq.heappop(lost)
+            self.fast_retransmit = False
+            mrt_log.info("Retransmitting segment %d (seq=%d)", segment.index, segment.seq)
+            client._send_data_segment(segment)
+            client.pacer.consume(payload_size)
+            self.bytes_in_flight += payload_size
+            segment.lost = False
+            segment.transmissions += 1
+            self._arm(segment)
+            client.segments_sent += 1
+            client.bytes_sent += payload_size
+            client.retransmits += 1
+            client.bytes_retransmitted += payload_size
+        
+        # Send new segments while both the congestion window and the server's
+        # receive window have room and the pacer allows it
+        while self.next_payload is not None and not lost and self.pace_until is None:
+            payload_size = len(self.next_payload)
+            if self.bytes_in_flight and self.bytes_in_flight + payload_size > min(client.cc.cwnd, client.peer_window):
+                break
+            if not self.bytes_in_flight and payload_size > client.peer_window:
+                # Zero window: wait one RTO for a window update, then send the
+                # next segment as a probe (its timer repeats the probe)
+                if self.probe_at is None:
+                    self.probe_at = time.monotonic() + client.rtt.rto
+                if time.monotonic() < self.probe_at:
+                    break
+                mrt_log.info("Receive window closed (%d bytes), probing", client.peer_window)
+                self.probe_at = None
+            
+            delay = client.pacer.delay(payload_size)
+            if delay > 0:
+                self.pace_until = time.monotonic() + delay
+                break
+            segment = OutstandingSegment(self.next_payload, client.seq_num, self.total_segments)
+            if self.next_stream is not None:
+                segment.stream = self.next_stream
+                segment.stream_seq = client._stream_seqs[segment.stream]
+                client._stream_seqs[segment.stream] += 1
+                segment.fin = self.next_fin
+                if segment.fin:
+                    del client._stream_seqs[segment.stream]
+            window[segment.seq] = segment
+            client.seq_num += 1
+            self.total_segments += 1
+            self.total_bytes += payload_size
+            self._pull()
+            segment.push = self.next_payload is None
+            
+            client._send_data_segment(segment)
+            client.pacer.consume(payload_size)
+            self.bytes_in_flight += payload_size
+            segment.transmissions = 1
+            self._arm(segment)
+            segment.first_sent_at = segment.sent_at
+            client.segments_sent += 1
+            client.bytes_sent += payload_size
+        
+        client._flush_data_segments()
+
+    def wait_time(self):
+        """
+        Seconds until the earliest retransmission deadline, pacer release or
+        window probe, i.e. how long the owner may wait for an ACK.
+        """
+        window, timers = self.window, self.timers
+        
+        # Drop timers of segments that were acknowledged, SACKed or marked lost in the meantime
+        while timers and (timers[0][1] not in window or timers[0][0] != window[timers[0][1]].deadline
+                          or window[timers[0][1]].sacked):
+            heapq.heappop(timers)
+        
+        now = time.monotonic()
+        wait = timers[0][0] - now if timers else self.client.rtt.rto
+        if self.pace_until is not None:
+            wait = min(wait, self.pace_until - now)
+        if self.probe_at is not None:
+            wait = min(wait, self.probe_at - now)
+        return wait
+
+    def on_ack(self, reply):
+        """Process an ACK segment: release, SACK-mark, sample RTT, grow cwnd, detect losses."""
+        client = self.client
+        window = self.window
+        
+        # Track the receive window from the most recent ACK
+        if reply.ack >= self.highest_ack:
+            self.highest_ack = reply.ack
+            client.peer_window = reply.window
+            self.probe_at = None
+        
+        # Server ACKs with next expected sequence number
+        acked_seq = reply.ack - 1  # The sequence number that was acknowledged
+        
+        mrt_log.debug("Received ACK for seq %d, current base seq: %d", acked_seq, self.base_seq)
+        
+        # Release every segment the cumulative ACK covers.
+        # acked_bytes is newly delivered data (for cwnd growth),
+        # released_bytes what leaves bytes_in_flight.
+        newest_acked = None
+        acked_bytes = 0
+        released_bytes = 0
+        previous_base = self.base_seq
+        now = time.monotonic()
+        client.acks_received += 1
+        while self.base_seq <= acked_seq and self.base_seq in window:
+            segment = window.pop(self.base_seq)
+            mrt_log.debug("Marking segment %d (seq=%d) as acknowledged", segment.index, segment.seq)
+            client.bytes_acked += len(segment.payload)
+            client.ack_latency.observe(now - segment.first_sent_at)
+            if not segment.sacked:  # SACKed bytes were already counted
+                acked_bytes += len(segment.payload)
+                if not segment.lost:
+                    released_bytes += len(segment.payload)
+                newest_acked = segment
+            self.base_seq += 1
+            self.last_progress = time.monotonic()
+        base_seq = self.base_seq
+        
+        # Mark segments above the cumulative ACK that the server
+        # already holds, so their timers never retransmit them
+        for start, end in mrt_segment.decode_sack(reply.options):
+            for seq in range(max(start, base_seq), min(end, client.seq_num)):
+                segment = window.get(seq)
+                if segment is not None and not segment.sacked:
+                    segment.sacked = True
+                    if self.highest_sacked is None or seq > self.highest_sacked:
+                        self.highest_sacked = seq
+                    self.last_progress = time.monotonic()  # New data was delivered (RFC 6298, 5.3)
+                    acked_bytes += len(segment.payload)
+                    if not segment.lost:
+                        released_bytes += len(segment.payload)
+                    if newest_acked is None or segment.sent_at > newest_acked.sent_at:
+                        newest_acked = segment
+        
+        # Take an RTT sample from the most recently sent segment this
+        # ACK newly delivers (a cumulative ACK jumping over segments
+        # SACKed long ago says nothing about the current RTT), unless
+        # it was retransmitted (Karn's rule)
+        if newest_acked is not None and newest_acked.transmissions == 1:
+            client.rtt.sample(now - newest_acked.sent_at)
+            client.rtt_histogram.observe(now - newest_acked.sent_at)
+        
+        # Let the congestion controller grow the window. During fast
+        # recovery only ACKs that advance the cumulative ACK count.
+        self.bytes_in_flight -= released_bytes
+        advanced = base_seq > previous_base
+        if acked_bytes and (advanced or not client.cc.in_recovery):
+            client.cc.on_ack(acked_bytes, reply.ack, client.rtt.srtt)
+            client.pacer.update(client.cc.cwnd, client.rtt.srtt, client.cc.in_slow_start())
+        
+        # Fast retransmit: infer losses from the ACK stream instead of
+        # waiting for the RTO. With SACK a segment is lost once
+        # DUP_THRESH segments above it are SACKed (RFC 6675); without,
+        # after DUP_THRESH duplicate ACKs or on a partial ACK during
+        # recovery (RFC 5681, RFC 6582).
+        self.dup_acks = 0 if advanced else self.dup_acks + 1 if window else 0
+        if self.dup_acks:
+            client.duplicate_acks += 1
+        newly_lost = []
+        if client.version == mrt_segment.V2:
+            if self.highest_sacked is not None and self.highest_sacked >= base_seq:
+                sacked_above = 0
+                for seq in range(self.highest_sacked, base_seq - 1, -1):
+                    segment = window.get(seq)
+                    if segment is None:
+                        continue
+                    if segment.sacked:
+                        sacked_above += 1
+                    elif sacked_above >= DUP_THRESH and not segment.lost \
+                            and segment.transmissions == 1:
+                        # A lost retransmission is left to the RTO
+                        newly_lost.append(segment)
+        elif base_seq in window and not window[base_seq].lost and (
+                self.dup_acks == DUP_THRESH or (advanced and client.cc.in_recovery)):
+            newly_lost.append(window[base_seq])
+        
+        if newly_lost:
+            if not client.cc.in_recovery:
+                mrt_log.info("Fast retransmit: segment %d lost, entering fast recovery", newly_lost[-1].index)
+                client.fast_retransmits += 1
+                client.cc.on_loss(self.bytes_in_flight, client.seq_num - 1)
+                client.pacer.update(client.cc.cwnd, client.rtt.srtt, client.cc.in_slow_start())
+            for segment in newly_lost:
+                segment.lost = True
+                segment.deadline = None
+                self.bytes_in_flight -= len(segment.payload)
+                heapq.heappush(self.lost, segment.seq)
+            self.fast_retransmit = True
+
+    def on_timers(self):
+        """Handle an expired retransmission timer, if any."""
+        client = self.client
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            deadline, seq = heapq.heappop(self.timers)
+            segment = self.window.get(seq)
+            if segment is None or deadline != segment.deadline or segment.sacked:
+                continue
+            
+            # While ACKs keep advancing the segment is most likely queued, not
+            # lost: restart its timer from the last progress (RFC 6298, 5.3)
+            if self.last_progress + client.rtt.rto > now:
+                segment.deadline = self.last_progress + client.rtt.rto
+                heapq.heappush(self.timers, (segment.deadline, seq))
+                continue
+            
+            # Timeout: everything outstanding that was not SACKed is presumed
+            # lost and is resent by transmit() at the pace of the collapsed
+            # congestion window (RFC 6675, 5.1), not in one burst
+            mrt_log.info("Timeout on segment %d, retransmitting unacknowledged segments", segment.index)
+            client.timeouts += 1
+            client.rtt.backoff()
+            # A segment that does not fit the advertised window is a zero-window
+            # probe; its loss says nothing about congestion
+            if len(segment.payload) <= client.peer_window:
+                client.cc.on_timeout(self.bytes_in_flight)
+                client.pacer.update(client.cc.cwnd, client.rtt.srtt, client.cc.in_slow_start())
+            for outstanding in self.window.values():
+                if not outstanding.sacked and not outstanding.lost:
+                    outstanding.lost = True
+                    outstanding.deadline = None
+                    heapq.heappush(self.lost, outstanding.seq)
+            self.bytes_in_flight = 0
+            self.dup_acks = 0
+            self.fast_retransmit = False
+            break
 
 class Client:
-    def init(self, src_port, dst_addr, dst_port, segment_size):
+    def init(self, src_port, dst_addr, dst_port, segment_size, congestion_control="newreno",
+             pacing_rate=None, pacing_burst=None, versions=mrt_segment.SUPPORTED_VERSIONS,
+             checksums=mrt_checksum.PREFERENCE, session=None, batch_io=True, log_format=mrt_log.TEXT):
         """
         initialize the client and create the client UDP channel
 
@@ -35,112 +433,280 @@ class Client:
         dst_addr -- the address of the server/network simulator
         dst_port -- the port of the server/network simulator
         segment_size -- the maximum size of a segment (including the header)
+        congestion_control -- congestion control algorithm, one of mrt_congestion.ALGORITHMS
+                              ("reno", "newreno", "cubic") or a CongestionControl instance
+        pacing_rate -- fixed pacing rate in bytes/s (default: follow cwnd/SRTT)
+        pacing_burst -- bytes that may be sent back to back (default: mrt_pacer.PACING_BURST segments)
+        versions -- wire format versions to offer in the SYN; the server picks the highest common one
+        checksums -- version 2 checksum algorithms (mrt_checksum.ALGORITHMS) in order of preference
+        session -- the session attribute of an earlier client of the same server; connect()
+                   then resumes it and returns without waiting for the SYN-ACK
+        batch_io -- send and receive with sendmmsg/recvmmsg where available (see mrt_batch_io)
+        log_format -- mrt_log.TEXT (log_<src_port>.txt) or mrt_log.BINARY (log_<src_port>.bin)
         """
+        self._configure(src_port, dst_addr, dst_port, segment_size, congestion_control, pacing_rate,
+                        pacing_burst, versions, checksums, session)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('', src_port))
+        self.socket.settimeout(self.rtt.rto)
+        self._sendmsg = getattr(self.socket, "sendmsg", None)  # Not available on every platform
+        if batch_io and mrt_batch_io.AVAILABLE:
+            self._batch_sender = mrt_batch_io.BatchSender(self.socket, (dst_addr, dst_port))
+            self._batch_receiver = mrt_batch_io.BatchReceiver(self.socket, slot_size=self.recv_size, gro=False)
+        self.log_file = mrt_log.SegmentLog(mrt_log.log_path(src_port, log_format), log_format)
+        
+        print(f"Initialized client with max payload size: {self.max_payload_size} bytes")
+
+    def _configure(self, src_port, dst_addr, dst_port, segment_size, congestion_control, pacing_rate,
+                   pacing_burst, versions, checksums, session=None):
+        """Set up the connection state shared by Client and mrt_async.AsyncClient (see init)."""
         self.src_port = src_port
         self.dst_addr = dst_addr
         self.dst_port = dst_port
         self.segment_size = min(segment_size, UDP_MAX_SIZE)  # Ensure segment_size doesn't exceed UDP limits
+        self.recv_size = max(self.segment_size, mrt_segment.MAX_HEADER_SIZE)  # Room for ACKs with SACK options
         self.seq_num = random.randint(0, 1000)  # Initial sequence number
         self.ack_num = 0
+        self.peer_window = 0  # Free receive window last advertised by the server, in bytes
         self.connected = False
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.bind(('', src_port))
-        self.socket.settimeout(TIMEOUT)
-        self.header_size = 21  # 1(type) + 4(seq) + 4(ack) + 8(checksum) + 4(payload_len)
+        self.rtt = RttEstimator()
+        self.versions = tuple(versions)
+        self.version = mrt_segment.V1  # The handshake itself always uses version 1
+        self.checksums = tuple(checksums)
+        self.checksum = mrt_checksum.get(self.checksums[0])
+        self.header_size = mrt_segment.header_size(self.version)
         self.max_payload_size = min(self.segment_size - self.header_size, UDP_MAX_SIZE - self.header_size)
-        self.log_file = open(f"log_{src_port}.txt", "w")
+        self._header = bytearray(mrt_segment.MAX_HEADER_SIZE)  # Reused for every DATA header
+        self._batch_sender = None  # mrt_batch_io.BatchSender queueing DATA segments, if batching
+        self._batch_receiver = None  # mrt_batch_io.BatchReceiver draining ACKs, if batching
+        self.cc = mrt_congestion.create(congestion_control, self.max_payload_size)
+        self.pacer = mrt_pacer.Pacer(pacing_rate, pacing_burst or mrt_pacer.PACING_BURST * self.max_payload_size)
         self.lock = threading.Lock()
+        self._next_stream_id = 1  # Stream ids are never reused within a connection
+        self._stream_seqs = {}  # Open stream id -> stream_seq of its next segment
+        self.session = session  # Set from the ticket in every SYN-ACK, see Session
+        self._resume_at = None  # While a resumed SYN is unanswered: when to resend it
+        self._syn_seq = self.seq_num  # Sequence number of our SYN
+        self._sender = None  # SendWindow of the transfer in progress, for stats()
         
-        print(f"Initialized client with max payload size: {self.max_payload_size} bytes")
+        # Counters (see stats())
+        self.segments_sent = 0
+        self.bytes_sent = 0
+        self.retransmits = 0
+        self.bytes_retransmitted = 0
+        self.fast_retransmits = 0
+        self.timeouts = 0
+        self.acks_received = 0
+        self.duplicate_acks = 0
+        self.corrupt_segments = 0
+        self.bytes_acked = 0
+        self.rtt_histogram = mrt_metrics.Histogram()
+        self.ack_latency = mrt_metrics.Histogram()
+
+    @property
+    def cwnd(self):
+        """The current congestion window in bytes."""
+        return self.cc.cwnd
+
+    @property
+    def rto(self):
+        """The current retransmission timeout in seconds."""
+        return self.rtt.rto
+
+    def stats(self):
+        """
+        Snapshot of the client's counters, windows and latency histograms.
+        Safe to call from any thread, also during a transfer.
+
+        return:
+        An mrt_metrics.ClientStats.
+        """
+        sender = self._sender
+        return mrt_metrics.ClientStats(
+            port=self.src_port, peer=(self.dst_addr, self.dst_port), connected=self.connected,
+            segments_sent=self.segments_sent, bytes_sent=self.bytes_sent,
+            retransmits=self.retransmits, bytes_retransmitted=self.bytes_retransmitted,
+            fast_retransmits=self.fast_retransmits, timeouts=self.timeouts,
+            acks_received=self.acks_received, duplicate_acks=self.duplicate_acks,
+            corrupt_segments=self.corrupt_segments, bytes_acked=self.bytes_acked,
+            segments_in_flight=len(sender.window) if sender else 0,
+            bytes_in_flight=sender.bytes_in_flight if sender else 0,
+            cwnd=self.cc.cwnd, ssthresh=self.cc.ssthresh, peer_window=self.peer_window,
+            srtt=self.rtt.srtt, rttvar=self.rtt.rttvar, rto=self.rtt.rto,
+            rtt=self.rtt_histogram.snapshot(), ack_latency=self.ack_latency.snapshot())
 
     def _compute_checksum(self, data):
         """Compute a simple checksum for data verification."""
-        return hashlib.md5(data).hexdigest()[:8]  # Use first 8 chars of MD5
+        return mrt_segment.compute_checksum(data)
     
-    def _create_segment(self, seg_type, seq_num, ack_num, payload=b''):
-        """
-        Create a segment with the specified parameters.
-        
-        Format: |type(1B)|seq(4B)|ack(4B)|checksum(8B)|payload_len(4B)|payload|
-        """
-        # Header: type(1) + seq(4) + ack(4) + checksum(8) + payload_len(4) = 21 bytes
-        payload_len = len(payload)
-        
-        # Create the segment without checksum
-        segment = struct.pack(f'!BII4s{payload_len}s', 
-                             seg_type, 
-                             seq_num, 
-                             ack_num, 
-                             str(payload_len).zfill(4).encode(), 
-                             payload)
-        
-        # Compute checksum
-        checksum = self._compute_checksum(segment)
-        
-        # Insert checksum into segment
-        segment = segment[:9] + checksum.encode() + segment[9:]
-        
-        return segment
+    def _create_segment(self, seg_type, seq_num, ack_num, payload=b'', window=0):
+        """Create a segment in the wire format negotiated for this connection."""
+        return mrt_segment.create_segment(seg_type, seq_num, ack_num, payload, window, self.version,
+                                          checksum=self.checksum)
     
     def _parse_segment(self, segment):
-        """Parse a received segment and verify its integrity."""
+        """Parse a received segment and verify its integrity (None if corrupted)."""
         try:
-            # Ensure the segment is long enough for basic header
-            if len(segment) < 21:
-                print(f"Segment too short: {len(segment)} bytes")
-                return None, None, None, None, None
-
-            # Extract components from segment
-            seg_type = segment[0]
-            seq_num = struct.unpack('!I', segment[1:5])[0]
-            ack_num = struct.unpack('!I', segment[5:9])[0]
-            received_checksum = segment[9:17].decode()
-            
-            # Verify checksum
-            checksum_data = segment[:9] + segment[17:]
-            computed_checksum = self._compute_checksum(checksum_data)
-            
-            if computed_checksum != received_checksum:
-                print(f"Checksum mismatch: received {received_checksum}, computed {computed_checksum}")
-                return None, None, None, None, None  # Corrupted segment
-            
-            payload_len_str = segment[17:21].decode()
-            try:
-                payload_len = int(payload_len_str)
-            except:
-                print(f"Invalid payload length: {payload_len_str}")
-                return None, None, None, None, None
-                
-            # Ensure the segment includes the full payload
-            if len(segment) < 21 + payload_len:
-                print(f"Incomplete segment: expected {21 + payload_len} bytes, got {len(segment)}")
-                return None, None, None, None, None
-                
-            payload = segment[21:21+payload_len]
-            
-            return seg_type, seq_num, ack_num, payload_len, payload
-            
+            parsed = mrt_segment.parse_segment(segment, self.checksum)
         except Exception as e:
             print(f"Error parsing segment: {e}")
-            return None, None, None, None, None
+            parsed = None
+        if parsed is None:
+            self.corrupt_segments += 1
+        return parsed
     
     def _log_segment(self, src_port, dst_port, seq_num, ack_num, seg_type, payload_len, direction="SEND"):
-        """Log segment information."""
-        type_str = {
-            SYN: "SYN",
-            SYN_ACK: "SYN-ACK",
-            ACK: "ACK",
-            DATA: "DATA",
-            FIN: "FIN",
-            FIN_ACK: "FIN-ACK"
-        }.get(seg_type, "UNKNOWN")
-        
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-        log_entry = f"{timestamp} {src_port} {dst_port} {seq_num} {ack_num} {type_str} {payload_len} {direction}\n"
-        
-        with self.lock:
-            self.log_file.write(log_entry)
-            self.log_file.flush()
+        """Log segment information (queued for the log's writer thread, see mrt_log.SegmentLog)."""
+        self.log_file.record(src_port, dst_port, seq_num, ack_num, seg_type, payload_len, direction)
+
+    def _send_data_segment(self, segment):
+        """
+        Transmit (or retransmit) an outstanding DATA segment.
+        
+        The header is built in a reusable buffer and sent together with a
+        memoryview of the payload (scatter-gather), so the payload bytes are
+        never copied in user space. When batching, the header is instead
+        built in the batch sender's next slot and queued with the payload,
+        again uncopied, to go out with the rest of the batch in
+        _flush_data_segments().
+        """
+        payload = segment.payload
+        flags = (mrt_segment.FLAG_PUSH if segment.push else 0) | (mrt_segment.FLAG_FIN_STREAM if segment.fin else 0)
+        options = mrt_segment.encode_stream(segment.stream, segment.stream_seq) if segment.stream is not None else b''
+        try:
+            batch = self._batch_sender
+            buffer = self._header if batch is None else batch.next_slot()
+            header = mrt_segment.header_into(buffer, DATA, segment.seq, self.ack_num, payload,
+                                             version=self.version, checksum=self.checksum,
+                                             flags=flags, options=options)
+            if batch is not None:
+                batch.queue(len(header), payload)
+            elif self._sendmsg is not None:
+                self._sendmsg([header, payload], (), 0, (self.dst_addr, self.dst_port))
+            else:
+                self.socket.sendto(bytes(header) + bytes(payload), (self.dst_addr, self.dst_port))
+            self._log_segment(self.src_port, self.dst_port, segment.seq, self.ack_num, DATA, len(payload))
+            mrt_log.debug("Sent segment %d, seq=%d, size=%d", segment.index, segment.seq, len(payload))
+        except Exception as e:
+            mrt_log.error("Error sending segment %d: %s", segment.index, e)
+
+    def _flush_data_segments(self):
+        """Send the DATA segments queued by _send_data_segment() with one system call, if batching."""
+        if self._batch_sender is not None and self._batch_sender.pending:
+            mrt_log.debug("Sending a batch of %d segments", self._batch_sender.pending)
+            self._batch_sender.flush()
+
+    def _handshake_offer(self, ticket=None):
+        """The SYN payload: the wire format versions and checksums this client supports."""
+        offer = {
+            mrt_segment.HS_VERSIONS: self.versions,
+            mrt_segment.HS_CHECKSUMS: [mrt_checksum.get(name).ident for name in self.checksums],
+        }
+        if ticket:
+            offer[mrt_segment.HS_TICKET] = ticket
+        return mrt_segment.encode_handshake(offer)
+
+    def _send_syn(self, offer):
+        """
+        Send (or resend) our SYN with the given handshake payload. It is
+        always a version 1 segment: the server parses it before it knows
+        which checksum the connection uses, even when resuming a session.
+        """
+        syn_segment = mrt_segment.create_segment(SYN, self._syn_seq, 0, offer)
+        self.socket.sendto(syn_segment, (self.dst_addr, self.dst_port))
+        self._log_segment(self.src_port, self.dst_port, self._syn_seq, 0, SYN, 0)
+        print(f"Sent SYN, seq={self._syn_seq}")
+
+    def _accept_handshake(self, reply):
+        """Adopt the sequence numbers, window, version and checksum of a valid SYN-ACK."""
+        # Update sequence and acknowledgment numbers
+        self.ack_num = reply.seq + 1
+        self.seq_num = reply.ack
+        self.peer_window = reply.window
+        self._adopt_choices(reply)
+
+    def _adopt_choices(self, reply):
+        """
+        Use the version and checksum the server picked, its receive window
+        and keep its session ticket. The SYN-ACK payload holds them (no
+        payload: version 1, whose segments carry no window).
+        """
+        choices = mrt_segment.decode_handshake(reply.payload)
+        window = choices.get(mrt_segment.HS_WINDOW, b'')
+        if len(window) == mrt_segment.WINDOW_FIELD.size:
+            self.peer_window = mrt_segment.WINDOW_FIELD.unpack(window)[0]
+        version = choices.get(mrt_segment.HS_VERSIONS, b'')
+        checksum = choices.get(mrt_segment.HS_CHECKSUMS, b'')
+        self._set_format(version[0] if version and version[0] in self.versions else self.version,
+                         mrt_checksum.from_ident(checksum[0]) if checksum and mrt_checksum.from_ident(checksum[0])
+                         else self.checksum)
+        ticket = choices.get(mrt_segment.HS_TICKET)
+        if ticket:
+            self.session = Session((self.dst_addr, self.dst_port), ticket, self.version, self.checksum.name,
+                                   self.peer_window, self.rtt.srtt, time.monotonic())
+
+    def _set_format(self, version, checksum):
+        """Switch to a wire format version and checksum, recomputing the payload size."""
+        self.version = version
+        self.checksum = checksum
+        self.header_size = mrt_segment.header_size(self.version)
+        self.max_payload_size = min(self.segment_size - self.header_size, UDP_MAX_SIZE - self.header_size)
+        self.cc.mss = self.max_payload_size
+        print(f"Using wire format version {self.version}" +
+              (f" with {self.checksum.name} checksum" if self.version == mrt_segment.V2 else ""))
+
+    def _can_resume(self):
+        """Whether session is a fresh ticket from this server in a version we still offer."""
+        session = self.session
+        return (session is not None and session.server == (self.dst_addr, self.dst_port)
+                and session.version in self.versions
+                and time.monotonic() - session.issued_at < mrt_segment.TICKET_LIFETIME)
+
+    def _resume(self):
+        """
+        Resume the session: send a SYN carrying the ticket and consider the
+        connection established right away, with the wire format, window and
+        RTT of the session. The server validates the ticket and keeps the
+        same format, so DATA can follow the SYN immediately. The SYN is
+        resent every RTO until a SYN-ACK or ACK shows it arrived.
+        """
+        session = self.session
+        print(f"Resuming session with {self.dst_addr}:{self.dst_port}, not waiting for the SYN-ACK")
+        self._set_format(session.version, mrt_checksum.get(session.checksum))
+        self.peer_window = session.window
+        if session.srtt is not None:
+            self.rtt.sample(session.srtt)
+        self._send_syn(self._handshake_offer(session.ticket))
+        self.seq_num = self._syn_seq + 1
+        self._resume_at = time.monotonic() + self.rtt.rto
+        self.connected = True
+        print("Connection established (resumed)")
+
+    def _resume_wait(self):
+        """Seconds until the resumed SYN is due again, or None if it was answered."""
+        return None if self._resume_at is None else self._resume_at - time.monotonic()
+
+    def _check_resume(self, reply=None):
+        """
+        Track the resumed handshake: stop resending the SYN once the server
+        answers it (reply), or resend it when it is due.
+        """
+        if self._resume_at is None:
+            return
+        if reply is not None:
+            if reply.type == SYN_ACK and reply.ack == self._syn_seq + 1:
+                print(f"Received SYN-ACK for the resumed session, seq={reply.seq}")
+                self.ack_num = reply.seq + 1
+                self._resume_at = None
+                if mrt_segment.decode_handshake(reply.payload).get(mrt_segment.HS_TICKET):
+                    self._adopt_choices(reply)
+            elif reply.type == ACK:
+                self._resume_at = None  # The server has the connection, the SYN-ACK was lost
+            return
+        if time.monotonic() >= self._resume_at:
+            print("No answer to the resumed SYN, resending it")
+            self._send_syn(self._handshake_offer(self.session.ticket))
+            self._resume_at = time.monotonic() + self.rtt.rto
 
     def connect(self):
         """
@@ -155,34 +721,39 @@ class Client:
         
         print(f"Connecting to {self.dst_addr}:{self.dst_port}")
         
+        if self._can_resume():
+            self._resume()
+            return
+        
         # Send SYN segment
         retry_count = 0
         while retry_count < MAX_RETRIES:
             # Create and send SYN segment
-            syn_segment = self._create_segment(SYN, self.seq_num, 0)
-            self.socket.sendto(syn_segment, (self.dst_addr, self.dst_port))
-            self._log_segment(self.src_port, self.dst_port, self.seq_num, 0, SYN, 0)
-            print(f"Sent SYN, seq={self.seq_num}")
+            self.socket.settimeout(self.rtt.rto)
+            syn_sent_at = time.monotonic()
+            self._send_syn(self._handshake_offer())
             
             # Wait for SYN-ACK
             try:
-                response, addr = self.socket.recvfrom(self.segment_size)
-                seg_type, srv_seq_num, srv_ack_num, payload_len, payload = self._parse_segment(response)
+                response, addr = self.socket.recvfrom(self.recv_size)
+                reply = self._parse_segment(response)
                 
-                if seg_type is None:  # Corrupted segment
+                if reply is None:  # Corrupted segment
                     print("Received corrupted segment")
                     retry_count += 1
                     continue
                 
-                self._log_segment(addr[1], self.src_port, srv_seq_num, srv_ack_num, seg_type, payload_len, "RECV")
+                self._log_segment(addr[1], self.src_port, reply.seq, reply.ack, reply.type, reply.payload_len, "RECV")
                 
-                if seg_type == SYN_ACK and srv_ack_num == self.seq_num + 1:
+                if reply.type == SYN_ACK and reply.ack == self.seq_num + 1:
                     # Valid SYN-ACK received
-                    print(f"Received SYN-ACK, seq={srv_seq_num}, ack={srv_ack_num}")
+                    print(f"Received SYN-ACK, seq={reply.seq}, ack={reply.ack}")
                     
-                    # Update sequence and acknowledgment numbers
-                    self.ack_num = srv_seq_num + 1
-                    self.seq_num = srv_ack_num
+                    # Seed the RTT estimator from the handshake (Karn's rule: first attempt only)
+                    if retry_count == 0:
+                        self.rtt.sample(time.monotonic() - syn_sent_at)
+                    
+                    self._accept_handshake(reply)
                     
                     # Send ACK to complete three-way handshake
                     ack_segment = self._create_segment(ACK, self.seq_num, self.ack_num)
@@ -197,10 +768,46 @@ class Client:
             except socket.timeout:
                 print(f"Timeout waiting for SYN-ACK, retrying ({retry_count + 1}/{MAX_RETRIES})")
                 retry_count += 1
+                self.rtt.backoff()
         
         raise Exception("Failed to connect after maximum retries")
 
-    def send(self, data):
+    def open_stream(self):
+        """
+        open a new multiplexed stream on this connection (wire format version 2)
+
+        Opening is local: the server learns about the stream from its first
+        segment, so streams cost no round trips. All streams share the
+        connection's congestion window, and the server reassembles each one
+        independently, so a loss on one stream does not hold back the others.
+
+        return:
+        The stream id, to pass to send(), send_stream(), send_file() and close_stream().
+        """
+        if not self.connected:
+            raise Exception("Not connected to server")
+        if self.version != mrt_segment.V2:
+            raise Exception("Streams require wire format version 2")
+        
+        stream_id = self._next_stream_id
+        self._next_stream_id += 1
+        self._stream_seqs[stream_id] = 0
+        return stream_id
+
+    def close_stream(self, stream_id):
+        """
+        finish a stream, blocking until the server has acknowledged its end
+        (see also the end_stream argument of send())
+
+        arguments:
+        stream_id -- a stream returned by open_stream()
+        """
+        if not self.connected:
+            raise Exception("Not connected to server")
+        
+        return self._send_segments(self._stream_payloads(iter(()), stream_id, True))
+
+    def send(self, data, stream_id=None, end_stream=False):
         """
         send a chunk of data of arbitrary size to the server
         blocking until all data is sent
@@ -209,136 +816,315 @@ class Client:
 
         arguments:
         data -- the bytes to be sent to the server
+        stream_id -- send on this stream (see open_stream) instead of the default stream
+        end_stream -- finish the stream with this data (see close_stream)
+
+        return:
+        The number of bytes sent.
         """
         if not self.connected:
             raise Exception("Not connected to server")
         
         print(f"Sending {len(data)} bytes of data")
         
-        # Break data into segments
-        segments = []
-        data_pos = 0
-        
-        # Store original sequence number to use as base
-        base_seq_num = self.seq_num
-        
-        while data_pos < len(data):
-            # Calculate payload size for this segment
-            # Limit to the minimum of:
-            # 1. Max payload size allowed by header
-            # 2. Remaining data to send
-            # 3. 9999 (4-digit limit)
-            # 4. UDP datagram size limit
-            payload_size = min(
-                self.max_payload_size,
-                len(data) - data_pos,
-                9999,
-                UDP_MAX_SIZE - self.header_size
-            )
-            payload = data[data_pos:data_pos + payload_size]
-            
-            # Create segment with current sequence number
-            segment = self._create_segment(DATA, self.seq_num, self.ack_num, payload)
-            segments.append((segment, self.seq_num, payload_size))
-            
-            # Update sequence number for next segment
-            # Important: Server expects sequential numbers, not based on payload size
-            self.seq_num += 1
-            data_pos += payload_size
-        
-        # Track acknowledged segments
-        acked_segments = [False] * len(segments)
-        
-        # Send segments with retransmission for reliability
-        window_size = 1  # Start with window size of 1 for reliability
-        base = 0  # Base of the window (index of the first unacked segment)
-        next_to_send = 0  # Next segment to send (index)
-        
-        # Set up timer for retransmission
-        timer = None
-        
-        # Continue until all segments are acknowledged
-        while base < len(segments):
-            # Send segments in window
-            while next_to_send < base + window_size and next_to_send < len(segments):
-                segment, seq_num, payload_size = segments[next_to_send]
-                try:
-                    self.socket.sendto(segment, (self.dst_addr, self.dst_port))
-                    self._log_segment(self.src_port, self.dst_port, seq_num, self.ack_num, DATA, payload_size)
-                    print(f"Sent segment {next_to_send}, seq={seq_num}, size={payload_size}")
-                except Exception as e:
-                    print(f"Error sending segment {next_to_send}: {e}")
-                
-                # Start timer for the oldest unacknowledged segment if not already running
-                if timer is None:
-                    timer = time.time()
-                
-                next_to_send += 1
-                
-                # Small delay between segments to prevent network congestion
-                time.sleep(0.01)
-            
-            # Wait for ACKs with a timeout
+        # Segments hold memoryviews into the caller's buffer; headers are only
+        # built when a segment is (re)sent
+        limit = self._payload_limit(stream_id)
+        return self._send_segments(self._stream_payloads(
+            self._split_buffer(memoryview(data).cast('B'), limit), stream_id, end_stream))
+
+    def send_stream(self, stream, stream_id=None, end_stream=False):
+        """
+        send everything produced by a file-like object or an iterable of
+        bytes-like chunks, blocking until all of it is acknowledged
+
+        Segments are read lazily as the window opens and dropped as soon as
+        they are acknowledged, so memory use is bounded by the window rather
+        than by the length of the stream.
+
+        arguments:
+        stream -- an object with readinto()/read() (e.g. an open binary file),
+                  or an iterable of bytes-like objects
+        stream_id, end_stream -- as for send()
+
+        return:
+        The number of bytes sent.
+        """
+        if not self.connected:
+            raise Exception("Not connected to server")
+        
+        print("Sending stream")
+        limit = self._payload_limit(stream_id)
+        if hasattr(stream, "readinto") or hasattr(stream, "read"):
+            payloads = self._split_file(stream, limit)
+        else:
+            payloads = self._split_iterable(stream, limit)
+        return self._send_segments(self._stream_payloads(payloads, stream_id, end_stream))
+
+    def send_file(self, path, stream_id=None, end_stream=False):
+        """
+        send the contents of a file, blocking until all of it is acknowledged
+
+        The file is memory-mapped, so segments are views into the page cache
+        and files larger than RAM can be sent.
+
+        arguments:
+        path -- the path of the file to send
+        stream_id, end_stream -- as for send()
+
+        return:
+        The number of bytes sent.
+        """
+        if not self.connected:
+            raise Exception("Not connected to server")
+        
+        with self._file_payloads(path, self._payload_limit(stream_id)) as payloads:
+            return self._send_segments(self._stream_payloads(payloads, stream_id, end_stream))
+
+    def send_streams(self, sources):
+        """
+        send each source on a new stream of its own and finish the stream,
+        blocking until everything is acknowledged
+
+        All sources go through one window back to back, so many small files
+        cost neither a handshake nor a round trip each.
+
+        arguments:
+        sources -- an iterable of bytes-like objects and/or file-like objects
+
+        return:
+        The stream ids, in the order of sources.
+        """
+        if not self.connected:
+            raise Exception("Not connected to server")
+        
+        stream_ids = []
+        self._send_segments(self._sources_payloads(sources, stream_ids))
+        return stream_ids
+
+    def send_message(self, message, stream_id=None):
+        """
+        send one framed message, blocking until it is acknowledged
+
+        The server reads it back whole with receive_message(). Messages can
+        be sent any number of times over one connection.
+
+        arguments:
+        message -- a bytes-like object of less than 4 GB
+        stream_id -- send on this stream (see open_stream) instead of the default stream
+
+        return:
+        The number of bytes sent, including the length prefix.
+        """
+        return self.send_messages((message,), stream_id)
+
+    def send_messages(self, messages, stream_id=None):
+        """
+        send a batch of framed messages back to back through one window,
+        blocking until all of them are acknowledged (see send_message)
+
+        arguments:
+        messages -- an iterable of bytes-like objects
+        stream_id -- send on this stream (see open_stream) instead of the default stream
+
+        return:
+        The number of bytes sent, including the length prefixes.
+        """
+        return self.send_stream(self._frame_messages(messages), stream_id)
+
+    def _frame_messages(self, messages):
+        """Yield each message preceded by its length prefix (mrt_segment.MESSAGE_HEADER)."""
+        for message in messages:
+            message = memoryview(message).cast('B')
+            yield mrt_segment.MESSAGE_HEADER.pack(len(message))
+            yield message
+
+    def _sources_payloads(self, sources, stream_ids):
+        """Open a stream per source as it is reached and yield its tagged payloads (see send_streams)."""
+        limit = self._payload_limit(True)
+        for source in sources:
+            stream_id = self.open_stream()
+            stream_ids.append(stream_id)
+            if hasattr(source, "readinto") or hasattr(source, "read"):
+                payloads = self._split_file(source, limit)
+            else:
+                payloads = self._split_buffer(memoryview(source).cast('B'), limit)
+            yield from self._stream_payloads(payloads, stream_id, True)
+
+    def _stream_payloads(self, payloads, stream_id, end_stream):
+        """
+        Tag payloads for a stream as (stream_id, payload, last) tuples, the
+        form SendWindow puts on a stream. Without a stream_id the payloads go
+        on the default stream unchanged. A stream that ends without data
+        still gets an empty final segment.
+        """
+        if stream_id is None:
+            return payloads
+        if stream_id not in self._stream_seqs:
+            raise Exception(f"Stream {stream_id} is not open")
+        return self._tag_payloads(payloads, stream_id, end_stream)
+
+    def _tag_payloads(self, payloads, stream_id, end_stream):
+        """Generator behind _stream_payloads: looks one payload ahead to flag the last."""
+        previous = None
+        for payload in payloads:
+            if previous is not None:
+                yield (stream_id, previous, False)
+            previous = payload
+        if previous is not None or end_stream:
+            yield (stream_id, b'' if previous is None else previous, end_stream)
+
+    @contextlib.contextmanager
+    def _file_payloads(self, path, limit):
+        """
+        Open a file for send_file and yield an iterator of its payloads,
+        memoryview slices of a memory map when the file can be mapped.
+        """
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            print(f"Sending file {path} ({size} bytes)")
+            if size == 0:
+                yield iter(())
+                return
             try:
-                response, addr = self.socket.recvfrom(self.segment_size)
-                seg_type, srv_seq_num, srv_ack_num, payload_len, payload = self._parse_segment(response)
-                
-                if seg_type is None:  # Corrupted segment
-                    print("Received corrupted ACK")
-                    continue
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError) as e:
+                # Not mappable (e.g. a pipe or special file): fall back to reading
+                print(f"Cannot mmap {path} ({e}), reading instead")
+                yield self._split_file(f, limit)
+                return
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            view = memoryview(mapped)
+            try:
+                yield self._split_buffer(view, limit)
+            except BaseException:
+                # An interrupted transfer: the traceback may still reference
+                # slices of the map. It is then unmapped once they are freed;
+                # a BufferError here would replace the original exception.
+                view.release()
+                try:
+                    mapped.close()
+                except BufferError:
+                    pass
+                raise
+            view.release()
+            mapped.close()
+
+    def _payload_limit(self, stream_id=None):
+        """
+        Largest payload for one segment. Limited by the segment size, the
+        payload length the wire format can describe (9999 in version 1) and
+        the UDP datagram size limit. Segments on a stream (stream_id not
+        None) also carry the STREAM option.
+        """
+        options_size = mrt_segment.STREAM_OPTION_SIZE if stream_id is not None else 0
+        return min(self.max_payload_size, mrt_segment.max_payload(self.version),
+                   UDP_MAX_SIZE - self.header_size) - options_size
+
+    def _split_buffer(self, data, limit):
+        """Yield consecutive memoryview slices of data of at most limit bytes."""
+        for pos in range(0, len(data), limit):
+            yield data[pos:pos + limit]
+
+    def _split_file(self, f, limit):
+        """Yield payloads of at most limit bytes read from a file-like object, each in its own buffer."""
+        while True:
+            if hasattr(f, "readinto"):
+                buf = bytearray(limit)
+                n = f.readinto(buf)
+                payload = memoryview(buf)[:n] if n else b''
+            else:
+                payload = f.read(limit)
+            if not payload:
+                return
+            yield payload
+
+    def _split_iterable(self, chunks, limit):
+        """Regroup an iterable of bytes-like chunks into payloads of limit bytes."""
+        pending = bytearray()
+        for chunk in chunks:
+            chunk = memoryview(chunk).cast('B')
+            if not pending and len(chunk) >= limit:
+                # Slice large chunks directly instead of copying them
+                whole = len(chunk) - len(chunk) % limit
+                yield from self._split_buffer(chunk[:whole], limit)
+                chunk = chunk[whole:]
+            pending += chunk
+            while len(pending) >= limit:
+                yield bytes(pending[:limit])
+                del pending[:limit]
+        if pending:
+            yield bytes(pending)
+
+    def _send_segments(self, payloads):
+        """
+        Send payloads from an iterator as DATA segments until all of them are
+        acknowledged.
+
+        Segments are pulled from the iterator only when the congestion and
+        receive windows have room for them, and forgotten once they are
+        cumulatively acknowledged, so only the current window is held in
+        memory (see SendWindow).
+
+        arguments:
+        payloads -- an iterator of bytes-like payloads of at most _payload_limit() bytes
+
+        return:
+        The number of bytes sent.
+        """
+        sender = self._sender = SendWindow(self, payloads)
+        
+        try:
+            # Continue until all segments are produced and acknowledged
+            while True:
+                sender.transmit()
+                if sender.done:
+                    break
                 
-                self._log_segment(addr[1], self.src_port, srv_seq_num, srv_ack_num, seg_type, payload_len, "RECV")
+                # Wait for ACKs, but no longer than the earliest retransmission deadline
+                # or the moment the pacer releases the next segment
+                wait = sender.wait_time()
+                if self._resume_at is not None:
+                    wait = min(wait, self._resume_wait())
+                if wait > 0 and self._batch_receiver is not None:
+                    # Every ACK that arrived meanwhile, with one call
+                    for response, addr in self._batch_receiver.receive(wait):
+                        self._handle_reply(sender, response, addr)
+                elif wait > 0:
+                    self.socket.settimeout(wait)
+                    try:
+                        response, addr = self.socket.recvfrom(self.recv_size)
+                        self._handle_reply(sender, response, addr)
+                    except socket.timeout:
+                        pass
                 
-                if seg_type == ACK:
-                    # Calculate which segment this ACK is for
-                    # Server ACKs with next expected sequence number
-                    acked_seq = srv_ack_num - 1  # The sequence number that was acknowledged
-                    
-                    print(f"Received ACK for seq {acked_seq}, current base seq: {segments[base][1]}")
-                    
-                    # Mark segments as acknowledged
-                    for i in range(base, len(segments)):
-                        if segments[i][1] <= acked_seq:
-                            if not acked_segments[i]:
-                                print(f"Marking segment {i} (seq={segments[i][1]}) as acknowledged")
-                                acked_segments[i] = True
-                        else:
-                            break
-                    
-                    # Advance base to the first unacknowledged segment
-                    while base < len(segments) and acked_segments[base]:
-                        base += 1
-                    
-                    # If we have acknowledged all segments, we're done
-                    if base == len(segments):
-                        print("All segments acknowledged")
-                        break
-                    
-                    # Reset timer if there are still unacknowledged segments
-                    if base < len(segments):
-                        timer = time.time()
-                    else:
-                        timer = None
-                    
-                    # Adjust window size (simple flow control)
-                    window_size = min(window_size + 1, 5)  # Increase window, max 5
-            
-            except socket.timeout:
-                # Check if we need to retransmit (timeout)
-                if timer is not None and time.time() - timer > TIMEOUT:
-                    print(f"Timeout, retransmitting from segment {base}")
-                    
-                    # Reduce window size for congestion control
-                    window_size = max(1, window_size // 2)
-                    
-                    # Reset next_to_send to retransmit from base
-                    next_to_send = base
-                    timer = time.time()  # Reset timer
-                    
-                    # A bit of additional delay before retransmission
-                    time.sleep(0.05)
+                # Handle an expired retransmission timer
+                sender.on_timers()
+                self._check_resume()
+        except BaseException:
+            sender.abort()
+            if self._batch_sender is not None:
+                self._batch_sender.discard()  # Queued segments reference their payloads
+            raise
+        finally:
+            self._sender = None
+        self.socket.settimeout(self.rtt.rto)
+        print(f"All {sender.total_segments} segments sent and acknowledged")
+        return sender.total_bytes
+
+    def _handle_reply(self, sender, response, addr):
+        """Parse a datagram from the server during a transfer and pass ACKs to sender."""
+        reply = self._parse_segment(response)
+        if reply is None:  # Corrupted segment
+            mrt_log.info("Received corrupted ACK")
+            return
+        
+        self._log_segment(addr[1], self.src_port, reply.seq, reply.ack, reply.type, reply.payload_len, "RECV")
         
-        print(f"All {len(segments)} segments sent and acknowledged")
+        self._check_resume(reply)
+        if reply.type == ACK:
+            sender.on_ack(reply)
 
     def close(self):
         """
@@ -354,27 +1140,33 @@ class Client:
         # Send FIN segment
         retry_count = 0
         while retry_count < MAX_RETRIES:
+            # A resumed SYN that was never answered must reach the server before the FIN
+            if self._resume_at is not None:
+                self._send_syn(self._handshake_offer(self.session.ticket))
+            
             # Create and send FIN segment
             fin_segment = self._create_segment(FIN, self.seq_num, self.ack_num)
+            self.socket.settimeout(self.rtt.rto)
             self.socket.sendto(fin_segment, (self.dst_addr, self.dst_port))
             self._log_segment(self.src_port, self.dst_port, self.seq_num, self.ack_num, FIN, 0)
             print(f"Sent FIN, seq={self.seq_num}, ack={self.ack_num}")
             
             # Wait for FIN-ACK
             try:
-                response, addr = self.socket.recvfrom(self.segment_size)
-                seg_type, srv_seq_num, srv_ack_num, payload_len, payload = self._parse_segment(response)
+                response, addr = self.socket.recvfrom(self.recv_size)
+                reply = self._parse_segment(response)
                 
-                if seg_type is None:  # Corrupted segment
+                if reply is None:  # Corrupted segment
                     print("Received corrupted segment")
                     retry_count += 1
                     continue
                 
-                self._log_segment(addr[1], self.src_port, srv_seq_num, srv_ack_num, seg_type, payload_len, "RECV")
+                self._log_segment(addr[1], self.src_port, reply.seq, reply.ack, reply.type, reply.payload_len, "RECV")
+                self._check_resume(reply)
                 
-                if seg_type == FIN_ACK:
+                if reply.type == FIN_ACK:
                     # Valid FIN-ACK received
-                    print(f"Received FIN-ACK, seq={srv_seq_num}, ack={srv_ack_num}")
+                    print(f"Received FIN-ACK, seq={reply.seq}, ack={reply.ack}")
                     self.connected = False
                     
                     # Close the socket and log file
@@ -387,6 +1179,7 @@ class Client:
             except socket.timeout:
                 print(f"Timeout waiting for FIN-ACK, retrying ({retry_count + 1}/{MAX_RETRIES})")
                 retry_count += 1
+                self.rtt.backoff()
         
         # Even if we didn't get FIN-ACK, close resources
         self.connected = False
@@ -0,0 +1,181 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# mrt_congestion.py - pluggable congestion control algorithms for the MRT client
+#
+
+import time
+
+# Constants
+INITIAL_WINDOW = 4  # Initial congestion window in segments (RFC 3390)
+MIN_WINDOW = 2  # Lower bound on ssthresh in segments
+ABC_LIMIT = 2  # Slow start growth per ACK in segments, so delayed ACKs do not halve it (RFC 3465)
+INITIAL_SSTHRESH = 2 ** 31  # Effectively unbounded until the first loss
+
+class CongestionControl:
+    """
+    Base class for congestion control algorithms.
+
+    The congestion window (cwnd) is kept in bytes. The sender may have at
+    most cwnd bytes of payload in flight. The client reports events through
+    the on_* hooks:
+
+    on_ack -- new data was cumulatively acknowledged
+    on_loss -- a loss was inferred from duplicate ACKs (fast retransmit)
+    on_timeout -- a retransmission timer expired
+    """
+    name = None
+
+    def __init__(self, mss, initial_window=INITIAL_WINDOW):
+        self.mss = mss
+        self.cwnd = initial_window * mss
+        self.ssthresh = INITIAL_SSTHRESH
+        self.in_recovery = False
+        self.recover = None  # Highest sequence number outstanding when recovery started
+
+    def in_slow_start(self):
+        return self.cwnd < self.ssthresh
+
+    def on_ack(self, acked_bytes, ack_seq, rtt=None):
+        """
+        Grow the window for newly acknowledged data.
+
+        arguments:
+        acked_bytes -- payload bytes newly acknowledged by this ACK
+        ack_seq -- the cumulative ACK number (next expected sequence number)
+        rtt -- the current smoothed RTT in seconds, if known
+        """
+        if self.in_recovery:
+            if self._recovery_complete(ack_seq):
+                self.in_recovery = False
+                self.cwnd = self.ssthresh
+            else:
+                # Partial ACK: stay in recovery, deflate by the data that left the network
+                self.cwnd = max(self.cwnd - acked_bytes + self.mss, self.mss)
+            return
+
+        if self.in_slow_start():
+            self.cwnd += min(acked_bytes, ABC_LIMIT * self.mss)
+        else:
+            self._congestion_avoidance(acked_bytes, rtt)
+
+    def on_loss(self, bytes_in_flight, recover_seq):
+        """
+        Enter fast recovery after a loss detected by duplicate ACKs.
+
+        arguments:
+        bytes_in_flight -- payload bytes outstanding when the loss was detected
+        recover_seq -- the highest sequence number sent so far
+        """
+        if self.in_recovery:
+            return
+        self._reduce(bytes_in_flight)
+        self.cwnd = self.ssthresh
+        self.in_recovery = True
+        self.recover = recover_seq
+
+    def on_timeout(self, bytes_in_flight):
+        """Collapse the window to one segment after a retransmission timeout."""
+        self._reduce(bytes_in_flight)
+        self.cwnd = self.mss
+        self.in_recovery = False
+        self.recover = None
+
+    def _reduce(self, bytes_in_flight):
+        self.ssthresh = max(bytes_in_flight // 2, MIN_WINDOW * self.mss)
+
+    def _recovery_complete(self, ack_seq):
+        return True
+
+    def _congestion_avoidance(self, acked_bytes, rtt):
+        # Additive increase of about one MSS per RTT
+        self.cwnd += max(1, self.mss * acked_bytes // self.cwnd)
+
+class Reno(CongestionControl):
+    """TCP Reno (RFC 5681): fast recovery ends on the first new ACK."""
+    name = "reno"
+
+class NewReno(CongestionControl):
+    """
+    TCP NewReno (RFC 6582): partial ACKs keep the sender in fast recovery
+    until everything outstanding at the time of the loss is acknowledged.
+    """
+    name = "newreno"
+
+    def _recovery_complete(self, ack_seq):
+        return ack_seq > self.recover
+
+class Cubic(CongestionControl):
+    """CUBIC (RFC 8312): window growth is a cubic function of time since the last loss."""
+    name = "cubic"
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self, mss, initial_window=INITIAL_WINDOW):
+        super().__init__(mss, initial_window)
+        self.w_max = 0.0  # Window (in segments) just before the last reduction
+        self.k = 0.0
+        self.epoch_start = None
+        self.w_est = 0.0  # Reno-friendly window estimate in segments
+
+    def _reduce(self, bytes_in_flight):
+        cwnd_segments = self.cwnd / self.mss
+        # Fast convergence: release bandwidth if the window keeps shrinking
+        if cwnd_segments < self.w_max:
+            self.w_max = cwnd_segments * (1 + self.BETA) / 2
+        else:
+            self.w_max = cwnd_segments
+        self.ssthresh = max(int(self.cwnd * self.BETA), MIN_WINDOW * self.mss)
+        self.epoch_start = None
+
+    def _congestion_avoidance(self, acked_bytes, rtt):
+        now = time.monotonic()
+        rtt = rtt or 0.0
+        cwnd_segments = self.cwnd / self.mss
+        if self.epoch_start is None:
+            self.epoch_start = now
+            if cwnd_segments < self.w_max:
+                self.k = ((self.w_max - cwnd_segments) / self.C) ** (1 / 3)
+            else:
+                self.k = 0.0
+                self.w_max = cwnd_segments
+            self.w_est = cwnd_segments
+
+        t = now - self.epoch_start + rtt
+        target = self.C * (t - self.k) ** 3 + self.w_max
+
+        # Stay at least as aggressive as Reno would be
+        acked_segments = acked_bytes / self.mss
+        self.w_est += 3 * (1 - self.BETA) / (1 + self.BETA) * acked_segments / cwnd_segments
+        target = max(target, self.w_est)
+
+        if target > cwnd_segments:
+            increase = (target - cwnd_segments) / cwnd_segments * acked_segments
+        else:
+            increase = 0.01 * acked_segments / cwnd_segments
+        self.cwnd += max(1, int(increase * self.mss))
+
+ALGORITHMS = {
+    Reno.name: Reno,
+    NewReno.name: NewReno,
+    Cubic.name: Cubic,
+}
+
+def create(algorithm, mss):
+    """
+    Create a congestion controller.
+
+    arguments:
+    algorithm -- an algorithm name from ALGORITHMS, a CongestionControl
+                 subclass, or an already constructed instance
+    mss -- the maximum payload size of a segment in bytes
+    """
+    if isinstance(algorithm, CongestionControl):
+        return algorithm
+    if isinstance(algorithm, type) and issubclass(algorithm, CongestionControl):
+        return algorithm(mss)
+    try:
+        return ALGORITHMS[algorithm.lower()](mss)
+    except (KeyError, AttributeError):
+        raise ValueError(f"Unknown congestion control algorithm: {algorithm!r}")
@@ -0,0 +1,272 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# mrt_log.py - buffered segment logs written by a background thread, and console log levels
+#
+
+import atexit
+import os
+import struct
+import threading
+import time
+from collections import deque, namedtuple
+
+from mrt_segment import SYN, SYN_ACK, ACK, DATA, FIN, FIN_ACK
+
+# Constants
+FLUSH_INTERVAL = 0.1  # Seconds between two writes of the queued records
+
+# Console message levels. Messages below the current level are dropped
+# before they are formatted. Per-packet messages are DEBUG, loss and
+# retransmission events INFO, socket errors ERROR.
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+level = INFO
+
+# Segment log formats
+TEXT = "text"  # One line per segment: <time> <src_port> <dst_port> <seq> <ack> <type> <payload_length> <direction>
+BINARY = "binary"  # MAGIC, then one BINARY_RECORD per segment
+FORMATS = (TEXT, BINARY)
+MAGIC = b'MRTLOG\x00\x01'
+BINARY_RECORD = struct.Struct('!dHHIIBIB')  # time, src_port, dst_port, seq, ack, type, payload_length, direction
+DIRECTIONS = ("SEND", "RECV")
+TYPE_NAMES = {SYN: "SYN", SYN_ACK: "SYN-ACK", ACK: "ACK", DATA: "DATA", FIN: "FIN", FIN_ACK: "FIN-ACK"}
+TYPES = {name: seg_type for seg_type, name in TYPE_NAMES.items()}
+
+# A logged segment as returned by read(). time is a Unix timestamp.
+Record = namedtuple('Record', ['time', 'src_port', 'dst_port', 'seq', 'ack', 'type', 'payload_len', 'direction'])
+
+def set_level(new_level):
+    """Drop console messages below new_level (DEBUG, INFO, WARNING or ERROR)."""
+    global level
+    level = new_level
+
+def _emit(message, args):
+    print(message % args if args else message)
+
+def debug(message, *args):
+    """Print a per-packet message, formatted with % args only if DEBUG messages are shown."""
+    if level <= DEBUG:
+        _emit(message, args)
+
+def info(message, *args):
+    """Print a loss or retransmission event (see debug)."""
+    if level <= INFO:
+        _emit(message, args)
+
+def warning(message, *args):
+    """Print a warning (see debug)."""
+    if level <= WARNING:
+        _emit(message, args)
+
+def error(message, *args):
+    """Print an error (see debug)."""
+    if level <= ERROR:
+        _emit(message, args)
+
+def log_path(port, log_format=TEXT):
+    """The default log file of a client or server on port: log_<port>.txt, or .bin for the binary format."""
+    return f"log_{port}.{'bin' if log_format == BINARY else 'txt'}"
+
+# The writer thread shared by every open SegmentLog. It is started with the
+# first log and stops once the last one is closed.
+_open_logs = []
+_open_logs_lock = threading.Lock()
+_open_logs_changed = threading.Condition(_open_logs_lock)  # Notified when a log opens or closes
+_writer = None
+
+def _open_log(log):
+    """Hand a new log to the writer thread, starting the thread if none runs."""
+    global _writer
+    with _open_logs_changed:
+        _open_logs.append(log)
+        if _writer is None:
+            _writer = threading.Thread(target=_run_writer, name="mrt-log-writer", daemon=True)
+            _writer.start()
+        _open_logs_changed.notify()
+
+def _close_log(log):
+    """Take a log away from the writer thread; return False if it was already closed."""
+    with _open_logs_changed:
+        if log not in _open_logs:
+            return False
+        _open_logs.remove(log)
+        _open_logs_changed.notify()
+    return True
+
+def _run_writer():
+    """Body of the writer thread: write every log whose flush interval has passed."""
+    global _writer
+    while True:
+        with _open_logs_changed:
+            if not _open_logs:
+                _writer = None
+                return
+            now = time.monotonic()
+            wait = min(log._due for log in _open_logs) - now
+            if wait > 0:
+                _open_logs_changed.wait(wait)
+                continue
+            due = [log for log in _open_logs if log._due <= now]
+        for log in due:
+            try:
+                log._flush(now)
+            except Exception as e:  # One failing file must not stop the other logs
+                error("Error writing segment log %s: %s", log.path, e)
+
+def _close_all():
+    """Write and close the logs still open when the interpreter exits."""
+    with _open_logs_lock:
+        logs = list(_open_logs)
+    for log in logs:
+        log.close()
+
+def _forget_after_fork():
+    """In a forked child the writer thread is gone, and the parent's logs are the parent's to write."""
+    global _open_logs, _open_logs_lock, _open_logs_changed, _writer
+    _open_logs = []
+    _open_logs_lock = threading.Lock()
+    _open_logs_changed = threading.Condition(_open_logs_lock)
+    _writer = None
+
+atexit.register(_close_all)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_after_fork)
+
+class SegmentLog:
+    """
+    The log of every segment a client or server sends and receives.
+
+    record() only appends a tuple to a queue of the calling thread (no lock,
+    no formatting, no system call); one background thread shared by all
+    logs collects the queues every flush_interval seconds, sorts the records
+    by time, formats them and writes them with one write() and flush().
+    close(), or the end of the interpreter, writes whatever is still queued.
+    """
+    def __init__(self, path, log_format=TEXT, flush_interval=FLUSH_INTERVAL):
+        """
+        arguments:
+        path -- the log file to create
+        log_format -- TEXT or BINARY
+        flush_interval -- seconds between two writes
+        """
+        if log_format not in FORMATS:
+            raise ValueError(f"Unknown log format {log_format!r}, expected one of {FORMATS}")
+        self.path = path
+        self.log_format = log_format
+        self.flush_interval = flush_interval
+        self.records_written = 0
+        self._file = open(path, "wb" if log_format == BINARY else "w")
+        if log_format == BINARY:
+            self._file.write(MAGIC)
+        self._local = threading.local()
+        self._queues = []  # (thread, deque of records) for every thread that logged
+        self._queues_lock = threading.Lock()  # Only taken when a thread logs for the first time
+        self._write_lock = threading.Lock()  # Held by the writer thread or close() while writing
+        self._due = time.monotonic() + flush_interval  # When the writer thread next writes this log
+        _open_log(self)
+
+    def record(self, src_port, dst_port, seq_num, ack_num, seg_type, payload_len, direction="SEND"):
+        """Queue a segment for the log file."""
+        try:
+            queue = self._local.queue
+        except AttributeError:
+            queue = self._register()
+        queue.append((time.time(), src_port, dst_port, seq_num, ack_num, seg_type, payload_len, direction))
+
+    def _register(self):
+        """Create the calling thread's queue."""
+        queue = self._local.queue = deque()
+        with self._queues_lock:
+            self._queues.append((threading.current_thread(), queue))
+        return queue
+
+    def _flush(self, now):
+        """Write the queued records unless the log was closed meanwhile (writer thread)."""
+        self._due = now + self.flush_interval
+        with self._write_lock:
+            if not self._file.closed:
+                self._write()
+
+    def _write(self):
+        """Write the records queued so far, oldest first."""
+        records = []
+        with self._queues_lock:
+            queues = list(self._queues)
+            # Forget the queues of threads that are gone once they are empty
+            self._queues = [(thread, queue) for thread, queue in queues if thread.is_alive() or queue]
+        for _, queue in queues:
+            for _ in range(len(queue)):
+                records.append(queue.popleft())
+        if not records:
+            return
+        if len(queues) > 1:
+            records.sort(key=lambda record: record[0])
+        if self.log_format == BINARY:
+            self._file.write(b''.join(BINARY_RECORD.pack(t, src, dst, seq, ack, seg_type, length,
+                                                         direction == "RECV")
+                                      for t, src, dst, seq, ack, seg_type, length, direction in records))
+        else:
+            self._file.write(_format_text(records))
+        self._file.flush()
+        self.records_written += len(records)
+
+    def close(self):
+        """Write the remaining records and close the file."""
+        if not _close_log(self):
+            return
+        with self._write_lock:
+            self._write()
+            self._file.close()
+
+def _format_text(records):
+    """The text lines of records, with millisecond timestamps in local time."""
+    lines = []
+    second = prefix = None
+    for t, src, dst, seq, ack, seg_type, length, direction in records:
+        if int(t) != second:
+            second = int(t)
+            prefix = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+        lines.append(f"{prefix}.{int((t - second) * 1000):03d} {src} {dst} {seq} {ack} "
+                     f"{TYPE_NAMES.get(seg_type, 'UNKNOWN')} {length} {direction}\n")
+    return ''.join(lines)
+
+def read(path):
+    """
+    Read a segment log in either format.
+
+    Text lines that do not parse are skipped. Timestamps without
+    milliseconds (logs written before the background writer) are read as
+    whole seconds.
+
+    return:
+    An iterator of Record.
+    """
+    with open(path, "rb") as log:
+        if log.read(len(MAGIC)) == MAGIC:
+            while True:
+                data = log.read(BINARY_RECORD.size * 4096)
+                for fields in BINARY_RECORD.iter_unpack(data[:len(data) - len(data) % BINARY_RECORD.size]):
+                    yield Record(*fields[:7], DIRECTIONS[fields[7]])
+                if len(data) < BINARY_RECORD.size * 4096:
+                    return
+
+    seconds = {}  # Parsed "date time" prefixes
+    with open(path) as log:
+        for line in log:
+            fields = line.split()
+            if len(fields) < 8:
+                continue
+            try:
+                stamp, _, fraction = fields[1].partition('.')
+                key = (fields[0], stamp)
+                if key not in seconds:
+                    seconds[key] = time.mktime(time.strptime(f"{fields[0]} {stamp}", "%Y-%m-%d %H:%M:%S"))
+                yield Record(seconds[key] + (int(fraction) / 1000 if fraction else 0), int(fields[2]), int(fields[3]),
+                             int(fields[4]), int(fields[5]), TYPES.get(fields[6], -1), int(fields[7]),
+                             fields[8] if len(fields) > 8 else "SEND")
+            except ValueError:
+                continue
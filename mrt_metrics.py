@@ -0,0 +1,261 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# mrt_metrics.py - latency histograms, stats snapshots and a Prometheus exporter for clients and servers
+#
+
+import bisect
+import http.server
+import threading
+from collections import namedtuple
+
+# Constants
+# Upper bounds of the latency histogram buckets in seconds (an implicit +Inf bucket follows)
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+EXPORTER_ADDR = '127.0.0.1'  # The exporter only listens locally unless told otherwise
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'  # Prometheus text exposition format
+
+class HistogramSnapshot(namedtuple('HistogramSnapshot', ['bounds', 'counts', 'sum', 'count'])):
+    """
+    A copy of a Histogram. counts[i] is the number of samples in
+    (bounds[i - 1], bounds[i]]; the last count is the +Inf bucket.
+    """
+    __slots__ = ()
+
+    def percentile(self, p):
+        """The upper bound of the bucket holding the p-th percentile (0-100), or None without samples."""
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets. observe() is a binary search and
+    an increment, cheap enough for every ACK. Only the thread that owns the
+    connection observes; snapshot() may be called from any thread.
+    """
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Record one sample in seconds."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        """The current counts as a HistogramSnapshot."""
+        return HistogramSnapshot(self.bounds, tuple(self.counts), self.sum, self.count)
+
+# Snapshots returned by Client.stats() and Server.stats(). Counters count
+# from init(); byte counts are payload bytes.
+ClientStats = namedtuple('ClientStats', [
+    'port', 'peer', 'connected',
+    'segments_sent', 'bytes_sent',  # Every DATA transmission, retransmissions included
+    'retransmits', 'bytes_retransmitted',
+    'fast_retransmits',  # Losses detected from ACKs (entries into fast recovery)
+    'timeouts',  # Expired retransmission timers
+    'acks_received', 'duplicate_acks', 'corrupt_segments', 'bytes_acked',
+    'segments_in_flight', 'bytes_in_flight',  # Of the transfer in progress, 0 between transfers
+    'cwnd', 'ssthresh', 'peer_window',  # Bytes
+    'srtt', 'rttvar', 'rto',  # Seconds, srtt and rttvar None before the first sample
+    'rtt',  # HistogramSnapshot of RTT samples
+    'ack_latency',  # HistogramSnapshot of first transmission to cumulative ACK, per segment
+])
+
+ConnectionStats = namedtuple('ConnectionStats', [
+    'addr', 'port', 'connected',
+    'segments_received', 'bytes_received',  # New in-order and out-of-order segments
+    'out_of_order_segments', 'duplicate_segments', 'acks_sent',
+    'buffered_segments', 'buffered_bytes',  # Waiting in the reassembly buffer for a hole to fill
+    'unread_bytes',  # In order, not yet read by the application
+    'stream_bytes',  # Held by multiplexed streams
+    'receive_window',  # Last advertised window in bytes
+    'reassembly_delay',  # HistogramSnapshot of how long out-of-order segments waited for the hole to fill
+])
+
+ServerStats = namedtuple('ServerStats', [
+    'port', 'datagrams_received', 'corrupt_segments', 'connections_opened', 'open_connections',
+    'connections',  # Tuple of ConnectionStats, one per connection the server still holds
+])
+
+# Prometheus metric families: (snapshot field, metric name, type, help)
+CLIENT_METRICS = (
+    ('connected', 'mrt_client_connected', 'gauge', 'Whether the client is connected'),
+    ('segments_sent', 'mrt_client_segments_sent_total', 'counter', 'DATA segments sent, retransmissions included'),
+    ('bytes_sent', 'mrt_client_bytes_sent_total', 'counter', 'Payload bytes sent, retransmissions included'),
+    ('retransmits', 'mrt_client_retransmits_total', 'counter', 'DATA segments retransmitted'),
+    ('bytes_retransmitted', 'mrt_client_bytes_retransmitted_total', 'counter', 'Payload bytes retransmitted'),
+    ('fast_retransmits', 'mrt_client_fast_retransmits_total', 'counter', 'Losses detected from the ACK stream'),
+    ('timeouts', 'mrt_client_timeouts_total', 'counter', 'Retransmission timeouts'),
+    ('acks_received', 'mrt_client_acks_received_total', 'counter', 'ACKs received during transfers'),
+    ('duplicate_acks', 'mrt_client_duplicate_acks_total', 'counter', 'ACKs that did not advance the cumulative ACK'),
+    ('corrupt_segments', 'mrt_client_corrupt_segments_total', 'counter', 'Replies dropped for a bad checksum'),
+    ('bytes_acked', 'mrt_client_bytes_acked_total', 'counter', 'Payload bytes cumulatively acknowledged'),
+    ('segments_in_flight', 'mrt_client_segments_in_flight', 'gauge', 'Segments sent and not yet acknowledged'),
+    ('bytes_in_flight', 'mrt_client_bytes_in_flight', 'gauge', 'Payload bytes in flight'),
+    ('cwnd', 'mrt_client_cwnd_bytes', 'gauge', 'Congestion window'),
+    ('ssthresh', 'mrt_client_ssthresh_bytes', 'gauge', 'Slow start threshold'),
+    ('peer_window', 'mrt_client_peer_window_bytes', 'gauge', 'Receive window last advertised by the server'),
+    ('srtt', 'mrt_client_srtt_seconds', 'gauge', 'Smoothed round-trip time'),
+    ('rttvar', 'mrt_client_rttvar_seconds', 'gauge', 'Round-trip time variation'),
+    ('rto', 'mrt_client_rto_seconds', 'gauge', 'Retransmission timeout'),
+    ('rtt', 'mrt_client_rtt_seconds', 'histogram', 'Round-trip time samples'),
+    ('ack_latency', 'mrt_client_ack_latency_seconds', 'histogram',
+     'Time from the first transmission of a segment to its cumulative ACK'),
+)
+
+SERVER_METRICS = (
+    ('datagrams_received', 'mrt_server_datagrams_received_total', 'counter', 'Datagrams received'),
+    ('corrupt_segments', 'mrt_server_corrupt_segments_total', 'counter', 'Segments dropped for a bad checksum'),
+    ('connections_opened', 'mrt_server_connections_opened_total', 'counter', 'Connections created by a SYN'),
+    ('open_connections', 'mrt_server_open_connections', 'gauge', 'Connections not yet closed by the client'),
+)
+
+CONNECTION_METRICS = (
+    ('connected', 'mrt_connection_open', 'gauge', 'Whether the client has not closed the connection'),
+    ('segments_received', 'mrt_connection_segments_received_total', 'counter', 'New DATA segments received'),
+    ('bytes_received', 'mrt_connection_bytes_received_total', 'counter', 'New payload bytes received'),
+    ('out_of_order_segments', 'mrt_connection_out_of_order_segments_total', 'counter',
+     'Segments received ahead of a hole'),
+    ('duplicate_segments', 'mrt_connection_duplicate_segments_total', 'counter', 'Segments received again'),
+    ('acks_sent', 'mrt_connection_acks_sent_total', 'counter', 'ACKs sent'),
+    ('buffered_segments', 'mrt_connection_buffered_segments', 'gauge', 'Segments in the reassembly buffer'),
+    ('buffered_bytes', 'mrt_connection_buffered_bytes', 'gauge', 'Payload bytes in the reassembly buffer'),
+    ('unread_bytes', 'mrt_connection_unread_bytes', 'gauge', 'In-order bytes not yet read by the application'),
+    ('stream_bytes', 'mrt_connection_stream_bytes', 'gauge', 'Bytes held by multiplexed streams'),
+    ('receive_window', 'mrt_connection_receive_window_bytes', 'gauge', 'Last advertised receive window'),
+    ('reassembly_delay', 'mrt_connection_reassembly_delay_seconds', 'histogram',
+     'Time out-of-order segments waited in the reassembly buffer'),
+)
+
+def _labels(labels, extra=None):
+    """A Prometheus label set: {name="value",...}."""
+    pairs = list(labels.items()) + ([extra] if extra else [])
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+def _value(value):
+    """A sample value; booleans are 0 or 1, unknown values NaN."""
+    if value is None:
+        return 'NaN'
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+def _samples(name, kind, labels, value):
+    """The sample lines of one metric of one source."""
+    if kind != 'histogram':
+        return [f"{name}{_labels(labels)} {_value(value)}"]
+    lines = []
+    cumulative = 0
+    for bound, count in zip(value.bounds + (float('inf'),), value.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(labels, ('le', _value(float(bound))))} {cumulative}")
+    lines.append(f"{name}_sum{_labels(labels)} {_value(float(value.sum))}")
+    lines.append(f"{name}_count{_labels(labels)} {value.count}")
+    return lines
+
+def render(snapshots):
+    """
+    Format stats snapshots in the Prometheus text exposition format.
+
+    arguments:
+    snapshots -- ClientStats and ServerStats, in any mix
+
+    return:
+    The text, one HELP/TYPE header per metric family followed by the samples of every source.
+    """
+    families = {}  # (name, type, help) -> sample lines, in first-seen order
+    def add(metrics, snapshot, labels):
+        for field, name, kind, help_text in metrics:
+            families.setdefault((name, kind, help_text), []).extend(
+                _samples(name, kind, labels, getattr(snapshot, field)))
+
+    for snapshot in snapshots:
+        if isinstance(snapshot, ClientStats):
+            add(CLIENT_METRICS, snapshot, {'port': snapshot.port, 'peer': f"{snapshot.peer[0]}:{snapshot.peer[1]}"})
+        elif isinstance(snapshot, ServerStats):
+            add(SERVER_METRICS, snapshot, {'port': snapshot.port})
+            for conn in snapshot.connections:
+                add(CONNECTION_METRICS, conn, {'port': snapshot.port, 'client': f"{conn.addr}:{conn.port}"})
+        else:
+            raise TypeError(f"Cannot export {type(snapshot).__name__}")
+
+    lines = []
+    for (name, kind, help_text), samples in families.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+class MetricsExporter:
+    """
+    A local HTTP endpoint serving the stats of clients and servers in the
+    Prometheus text format at /metrics. Snapshots are taken per scrape, so
+    the protocol threads pay nothing between scrapes.
+    """
+    def __init__(self, port, sources=(), addr=EXPORTER_ADDR):
+        """
+        Start serving in a background thread.
+
+        arguments:
+        port -- the TCP port to listen on (0 picks a free one, see self.port)
+        sources -- objects with a stats() method returning ClientStats or ServerStats (Client, Server, ...)
+        addr -- the address to listen on
+        """
+        self.sources = list(sources)
+        self.lock = threading.Lock()
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass  # Scrapes are not worth a console line each
+
+        self.httpd = http.server.ThreadingHTTPServer((addr, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name=f"mrt-metrics-{self.port}", daemon=True)
+        self.thread.start()
+
+    def add(self, source):
+        """Export the stats of another client or server."""
+        with self.lock:
+            self.sources.append(source)
+
+    def remove(self, source):
+        """Stop exporting a client or server."""
+        with self.lock:
+            self.sources.remove(source)
+
+    def render(self):
+        """The current stats of every source in the Prometheus text format."""
+        with self.lock:
+            sources = list(self.sources)
+        return render(source.stats() for source in sources)
+
+    def close(self):
+        """Stop serving and free the port."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
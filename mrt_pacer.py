@@ -0,0 +1,63 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# mrt_pacer.py - token-bucket pacing of outgoing DATA segments
+#
+
+import time
+
+# Constants
+PACING_BURST = 4  # Default bucket depth in segments
+SLOW_START_GAIN = 2.0  # Pace at twice cwnd/SRTT while the window is still doubling
+CONGESTION_AVOIDANCE_GAIN = 1.25  # Headroom above cwnd/SRTT in congestion avoidance
+
+class Pacer:
+    """
+    Token bucket that spreads segment transmissions over time.
+
+    Tokens are bytes. They accumulate at `rate` bytes per second up to
+    `burst` bytes, and each transmission spends its payload size. The rate
+    is either fixed at construction or derived from cwnd/SRTT through
+    update(). With no rate at all the pacer never delays anything.
+    """
+    def __init__(self, rate=None, burst=None, clock=time.perf_counter):
+        """
+        arguments:
+        rate -- a fixed pacing rate in bytes/s, or None to follow cwnd/SRTT
+        burst -- the bucket depth in bytes (how much may be sent back to back)
+        clock -- a monotonic clock returning seconds as a float
+        """
+        self.fixed_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst or 0
+        self.last = clock()
+
+    def update(self, cwnd, srtt, slow_start=False):
+        """Recompute the rate from the congestion window and smoothed RTT."""
+        if self.fixed_rate is not None or not srtt:
+            return
+        self._refill(self.clock())
+        gain = SLOW_START_GAIN if slow_start else CONGESTION_AVOIDANCE_GAIN
+        self.rate = gain * cwnd / srtt
+
+    def delay(self, nbytes):
+        """Return how many seconds to wait before nbytes may be sent (0 if now)."""
+        if not self.rate or self.burst is None:
+            return 0.0
+        self._refill(self.clock())
+        missing = min(nbytes, self.burst) - self.tokens
+        return missing / self.rate if missing > 0 else 0.0
+
+    def consume(self, nbytes):
+        """Spend tokens for a transmission. The balance may go negative."""
+        if self.rate and self.burst is not None:
+            self._refill(self.clock())
+            self.tokens -= nbytes
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
@@ -0,0 +1,277 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# mrt_segment.py - MRT segment encoding and parsing shared by the client and server
+#
+
+import struct
+import hashlib
+from collections import namedtuple
+
+import mrt_checksum
+
+# MRT segment types
+SYN = 0
+SYN_ACK = 1
+ACK = 2
+DATA = 3
+FIN = 4
+FIN_ACK = 5
+
+# Wire format versions. The version lives in the upper nibble of the first
+# byte and the segment type in the lower nibble, so a segment can always be
+# parsed without knowing which version the connection negotiated. Version 1
+# segments have an upper nibble of 0.
+V1 = 1
+V2 = 2
+SUPPORTED_VERSIONS = (V1, V2)
+TYPE_MASK = 0x0F
+
+# Version 1: |type(1B)|seq(4B)|ack(4B)|checksum(8B)|payload_len(4B)|payload|
+# The original MRT format, unchanged so that older peers still interoperate.
+# The checksum is the first 8 hex characters of an MD5 over the segment
+# without the checksum field, and the payload length is 4 ASCII digits.
+# There is no window field: parsed segments report V1_WINDOW (unlimited).
+V1_HEADER_SIZE = 21
+V1_MAX_PAYLOAD = 9999
+V1_FIELDS = struct.Struct('!BII')
+V1_WINDOW = 0xFFFFFFFF
+
+# Version 2: |ver/type(1B)|flags(1B)|options_len(2B)|seq(4B)|ack(4B)|window(4B)|payload_len(4B)|checksum(4B)|options|payload|
+# All fields are binary. The checksum covers the whole segment with the
+# checksum field set to zero; the algorithm (CRC32 by default, see
+# mrt_checksum) is picked in the handshake. Options carry extensions such as
+# SACK blocks.
+V2_HEADER = struct.Struct('!BBHIIIII')
+V2_CHECKSUM = struct.Struct('!I')
+V2_HEADER_SIZE = V2_HEADER.size
+V2_CHECKSUM_OFFSET = V2_HEADER_SIZE - V2_CHECKSUM.size
+V2_MAX_PAYLOAD = 0xFFFFFFFF
+FLAG_PUSH = 0x01  # DATA: the sender has nothing more queued, acknowledge without delay
+FLAG_FIN_STREAM = 0x02  # DATA: the last segment of its stream (see OPT_STREAM)
+MAX_OPTIONS_SIZE = 256
+MAX_HEADER_SIZE = V2_HEADER_SIZE + MAX_OPTIONS_SIZE  # Enough for either version
+_ZERO_CHECKSUM = bytes(V2_CHECKSUM.size)
+_DEFAULT_CHECKSUM = mrt_checksum.get(mrt_checksum.DEFAULT)
+
+# A parsed segment. options and flags are always empty/0 for version 1.
+# payload and options are memoryviews into the received buffer: copy them
+# (bytes(...)) before the buffer is reused.
+Segment = namedtuple('Segment', ['type', 'seq', 'ack', 'window', 'payload_len', 'payload', 'version', 'flags', 'options'])
+
+def header_size(version):
+    """Size of the fixed header of the given version in bytes."""
+    return V2_HEADER_SIZE if version == V2 else V1_HEADER_SIZE
+
+def max_payload(version):
+    """Largest payload the given version can describe."""
+    return V2_MAX_PAYLOAD if version == V2 else V1_MAX_PAYLOAD
+
+# Handshake parameters carried in the SYN (offers) and SYN-ACK (choices)
+# payloads as a list of |kind(1B)|length(1B)|value| entries. A SYN without a
+# payload comes from a client that only speaks version 1.
+HS_VERSIONS = 1  # Wire format versions
+HS_CHECKSUMS = 2  # mrt_checksum idents, in order of preference
+HS_TICKET = 3  # Session ticket: issued in the SYN-ACK, presented in a later SYN to resume
+HS_WINDOW = 4  # SYN-ACK: the server's free receive window (4 bytes), since the SYN-ACK is a version 1 segment
+WINDOW_FIELD = struct.Struct('!I')
+TICKET_LIFETIME = 600  # Seconds a session ticket stays valid
+
+# Framed messages (send_message/receive_message) are prefixed with their
+# length on the byte stream they are sent on.
+MESSAGE_HEADER = struct.Struct('!I')
+
+def encode_handshake(params):
+    """Encode a dict of handshake kind -> bytes-like value."""
+    return b''.join(bytes([kind, len(value)]) + bytes(value) for kind, value in params.items())
+
+def decode_handshake(payload):
+    """Decode a SYN/SYN-ACK payload into a dict of kind -> bytes, skipping malformed tails."""
+    params = {}
+    pos = 0
+    while pos + 2 <= len(payload):
+        kind, length = payload[pos], payload[pos + 1]
+        params[kind] = bytes(payload[pos + 2:pos + 2 + length])
+        pos += 2 + length
+    return params
+
+# Version 2 header options use the same |kind(1B)|length(1B)|value| layout.
+# A SACK option lists blocks of segments the receiver holds beyond the
+# cumulative ACK, each as |start(4B)|end(4B)| with end exclusive.
+# A STREAM option puts a DATA segment on a multiplexed stream as
+# |stream_id(4B)|stream_seq(4B)|, stream_seq counting the stream's segments
+# from 0. Segments without it belong to the connection's default stream.
+OPT_SACK = 1
+OPT_STREAM = 2
+SACK_BLOCK = struct.Struct('!II')
+MAX_SACK_BLOCKS = 16
+STREAM_FIELDS = struct.Struct('!II')
+STREAM_OPTION_SIZE = 2 + STREAM_FIELDS.size
+
+encode_options = encode_handshake
+decode_options = decode_handshake
+
+def encode_sack(blocks):
+    """Encode up to MAX_SACK_BLOCKS (start, end) ranges as a SACK option."""
+    blocks = blocks[:MAX_SACK_BLOCKS]
+    return encode_options({OPT_SACK: b''.join(SACK_BLOCK.pack(start, end) for start, end in blocks)}) if blocks else b''
+
+def decode_sack(options):
+    """Return the (start, end) ranges of the SACK option in options (empty if none)."""
+    value = decode_options(options).get(OPT_SACK, b'') if options else b''
+    return [SACK_BLOCK.unpack_from(value, pos) for pos in range(0, len(value) - SACK_BLOCK.size + 1, SACK_BLOCK.size)]
+
+def encode_stream(stream_id, stream_seq):
+    """Encode the STREAM option of a DATA segment."""
+    return bytes([OPT_STREAM, STREAM_FIELDS.size]) + STREAM_FIELDS.pack(stream_id, stream_seq)
+
+def decode_stream(options):
+    """Return (stream_id, stream_seq) from the STREAM option in options, or None if there is none."""
+    value = decode_options(options).get(OPT_STREAM) if options else None
+    return STREAM_FIELDS.unpack(value) if value is not None and len(value) == STREAM_FIELDS.size else None
+
+def choose_version(offer, versions):
+    """Pick the highest version both sides support (version 1 if none)."""
+    common = set(offer) & set(versions)
+    return max(common) if common else V1
+
+def choose_checksum(offer, names):
+    """Pick the first checksum in the client's preference order that the server supports."""
+    for ident in offer:
+        checksum = mrt_checksum.from_ident(ident)
+        if checksum is not None and checksum.name in names:
+            return checksum
+    return mrt_checksum.get(mrt_checksum.DEFAULT)
+
+def create_segment(seg_type, seq_num, ack_num, payload=b'', window=0, version=V1, flags=0, options=b'',
+                   checksum=None):
+    """Create a segment in the given wire format version as a single bytes object."""
+    header = bytearray(header_size(version) + len(options))
+    return bytes(header_into(header, seg_type, seq_num, ack_num, payload, window, version, flags, options,
+                             checksum)) + bytes(payload)
+
+def header_into(header, seg_type, seq_num, ack_num, payload=b'', window=0, version=V1, flags=0, options=b'',
+                checksum=None):
+    """
+    Write the header (and options) of a segment carrying payload into a
+    reusable buffer. The payload is only read to compute the checksum, never
+    copied, so header and payload can go out together with socket.sendmsg.
+
+    arguments:
+    header -- a bytearray of at least header_size(version) + len(options) bytes
+    payload -- any bytes-like object, typically a memoryview into the caller's data
+
+    return:
+    A memoryview of the header bytes written.
+    """
+    view = memoryview(header)
+    if version == V2:
+        size = V2_HEADER_SIZE + len(options)
+        V2_HEADER.pack_into(header, 0, (V2 << 4) | seg_type, flags, len(options),
+                            seq_num, ack_num, window, len(payload), 0)
+        view[V2_HEADER_SIZE:size] = options
+        checksum = checksum or _DEFAULT_CHECKSUM
+        V2_CHECKSUM.pack_into(header, V2_CHECKSUM_OFFSET, checksum.compute(view[:size], payload))
+        return view[:size]
+
+    V1_FIELDS.pack_into(header, 0, seg_type, seq_num, ack_num)  # Version 1 has no window field
+    view[17:21] = str(len(payload)).zfill(4).encode('ascii')
+    digest = hashlib.md5(view[:9])
+    digest.update(view[17:21])
+    digest.update(payload)
+    view[9:17] = digest.hexdigest()[:8].encode('ascii')
+    return view[:V1_HEADER_SIZE]
+
+def parse_segment(segment, checksum=None):
+    """
+    Parse a received segment and verify its integrity.
+
+    arguments:
+    segment -- the received bytes-like object
+    checksum -- the connection's mrt_checksum algorithm (version 2 only)
+
+    return:
+    A Segment, or None if the segment is truncated or corrupted.
+    """
+    if not segment:
+        _corrupt("Segment too short: 0 bytes")
+        return None
+    if segment[0] >> 4 == V2:
+        return _parse_v2(segment, checksum or _DEFAULT_CHECKSUM)
+    return _parse_v1(segment)
+
+def _corrupt(message, *args):
+    """
+    Report a segment that failed to parse as a DEBUG message (see mrt_log);
+    callers count corrupt segments in their stats. mrt_log imports the
+    segment types from this module, so it is imported here on first use.
+    """
+    import mrt_log
+    mrt_log.debug(message, *args)
+
+def compute_checksum(data):
+    """Compute the version 1 checksum: the first 8 hex characters of an MD5."""
+    return hashlib.md5(data).hexdigest()[:8]
+
+def _parse_v1(segment):
+    # Ensure the segment is long enough for basic header
+    if len(segment) < V1_HEADER_SIZE:
+        _corrupt("Segment too short: %d bytes", len(segment))
+        return None
+
+    view = memoryview(segment)
+    seg_type = view[0]
+    seq_num, ack_num = V1_FIELDS.unpack_from(view)[1:]
+
+    try:
+        received_checksum = bytes(view[9:17]).decode('ascii')
+    except UnicodeDecodeError:
+        _corrupt("Checksum decode error: treating segment as corrupted")
+        return None
+
+    # Verify checksum over everything except the checksum field
+    digest = hashlib.md5(view[:9])
+    digest.update(view[17:])
+    computed_checksum = digest.hexdigest()[:8]
+    if computed_checksum != received_checksum:
+        _corrupt("Checksum mismatch: received %s, computed %s", received_checksum, computed_checksum)
+        return None
+
+    try:
+        payload_len = int(bytes(view[17:21]).decode('ascii'))
+    except (UnicodeDecodeError, ValueError):
+        _corrupt("Invalid payload length: cannot decode or convert to integer")
+        return None
+
+    # Ensure the segment includes the full payload
+    if len(segment) < V1_HEADER_SIZE + payload_len:
+        _corrupt("Incomplete segment: expected %d bytes, got %d", V1_HEADER_SIZE + payload_len, len(segment))
+        return None
+
+    payload = view[V1_HEADER_SIZE:V1_HEADER_SIZE + payload_len]
+    return Segment(seg_type, seq_num, ack_num, V1_WINDOW, payload_len, payload, V1, 0, view[:0])
+
+def _parse_v2(segment, checksum):
+    if len(segment) < V2_HEADER_SIZE:
+        _corrupt("Segment too short: %d bytes", len(segment))
+        return None
+
+    type_byte, flags, options_len, seq_num, ack_num, window, payload_len, received_checksum = \
+        V2_HEADER.unpack_from(segment)
+    payload_start = V2_HEADER_SIZE + options_len
+    end = payload_start + payload_len
+    if len(segment) < end:
+        _corrupt("Incomplete segment: expected %d bytes, got %d", end, len(segment))
+        return None
+
+    # Verify checksum over the segment with the checksum field zeroed
+    view = memoryview(segment)
+    computed_checksum = checksum.compute(view[:V2_CHECKSUM_OFFSET], _ZERO_CHECKSUM,
+                                         view[V2_HEADER_SIZE:end])
+    if computed_checksum != received_checksum:
+        _corrupt("Checksum mismatch: received %08x, computed %08x", received_checksum, computed_checksum)
+        return None
+
+    return Segment(type_byte & TYPE_MASK, seq_num, ack_num, window, payload_len,
+                   view[payload_start:end], V2, flags, view[V2_HEADER_SIZE:payload_start])
@@ -6,26 +6,42 @@
 #
 
 import socket
-import struct
-import hashlib
 import time
 import threading
 import random
 import binascii  # Added for debug hex printing
+import hashlib
+import hmac
+import os
+import struct
+from collections import deque
+
+import mrt_batch_io
+import mrt_buffer
+import mrt_checksum
+import mrt_log
+import mrt_metrics
+import mrt_segment
 
 # MRT segment types
-SYN = 0
-SYN_ACK = 1
-ACK = 2
-DATA = 3
-FIN = 4
-FIN_ACK = 5
+from mrt_segment import SYN, SYN_ACK, ACK, DATA, FIN, FIN_ACK
 
 # Constants
 MAX_RETRIES = 10
 TIMEOUT = 0.5  # 500ms timeout
 BUFFER_THRESHOLD = 0.8  # When buffer is 80% full, slow down
+RECEIVE_WINDOW = 1 << 20  # Per-connection bytes buffered for the application (1 MB)
 UDP_MAX_SIZE = 9000  # Soft limit of 9000 bytes to avoid "message too long" errors
+ACK_FREQUENCY = 2  # Acknowledge at least every second in-order segment
+ACK_DELAY = 0.01  # Longest an in-order segment may wait for its ACK, in seconds
+DATAGRAM_BUFFER_SIZE = 65535  # Large enough for any UDP datagram
+DATAGRAM_BUFFERS = 4  # Datagram buffers kept in the receiver thread's pool
+
+# Session tickets are |version(1B)|checksum ident(1B)|expiry(4B, unix time)|mac(16B)|,
+# the MAC an HMAC-SHA256 over the body and the client's IP address, so only
+# this server (or its workers sharing ticket_key) can issue them
+TICKET_BODY = struct.Struct('!BBI')
+TICKET_MAC_SIZE = 16
 
 # Enable or disable detailed debugging
 DEBUG = False
@@ -35,6 +51,27 @@ def debug_print(*args, **kwargs):
     if DEBUG:
         print("[DEBUG]", *args, **kwargs)
 
+class Stream:
+    """
+    One multiplexed stream of a connection (see Client.open_stream).
+
+    Segments are put in order by their stream_seq, independently of the
+    connection's sequence numbers, so a hole in another stream never holds
+    this one back.
+    """
+    def __init__(self, stream_id):
+        self.id = stream_id
+        self.received_data = mrt_buffer.ReceiveBuffer()  # In-order data not yet read by the application
+        self.pending = {}  # stream_seq -> payload that arrived ahead of next_seq
+        self.next_seq = 0  # stream_seq of the next segment to deliver
+        self.fin_seq = None  # stream_seq of the last segment, once seen
+        self.accepted = False  # Whether accept_stream() has returned this stream
+
+    @property
+    def finished(self):
+        """Whether every segment up to the end of the stream has arrived."""
+        return self.fin_seq is not None and self.next_seq > self.fin_seq
+
 class Connection:
     """Represents a connection with a client"""
     def __init__(self, server, addr, port, seq_num, ack_num):
@@ -44,50 +81,124 @@ class Connection:
         self.seq_num = seq_num
         self.ack_num = ack_num
         self.connected = True
-        self.received_data = b''
+        self.received_data = mrt_buffer.ReceiveBuffer()  # In-order data not yet read by the application
         self.receive_buffer = {}  # To store out-of-order segments
+        self.buffered_at = {}  # seq -> when the out-of-order segment in receive_buffer arrived
+        self.buffered_bytes = 0  # Payload bytes held in receive_buffer
         self.next_expected_seq = ack_num
+        self.version = mrt_segment.V1  # Wire format version negotiated in the handshake
+        self.checksum = mrt_checksum.get(mrt_checksum.DEFAULT)  # Version 2 checksum algorithm
+        self.handshake_reply = b''  # SYN-ACK payload, resent with every SYN-ACK
+        self.last_advertised_window = server.receive_window
+        self.unacked_segments = 0  # In-order segments received since the last ACK
+        self.ack_deadline = None  # When a delayed ACK is due, if one is pending
         self.lock = threading.Lock()
-        
-        # Debug counters
+        self.data_ready = threading.Condition(self.lock)  # Notified when in-order data arrives or the client closes
+        self.accepted = False  # Whether accept() has returned this connection
+        self.fin_seq = None  # Sequence number of the client's FIN, once received
+        self.streams = {}  # Stream id -> Stream, for the multiplexed streams the client opened
+        self.new_streams = deque()  # Streams not yet returned by accept_stream()
+        self.stream_bytes = 0  # Payload bytes held by streams (unread or waiting for earlier stream segments)
+        
+        # Counters (see Server.stats())
         self.total_bytes_received = 0
         self.segments_received = 0
         self.out_of_order_segments = 0
         self.duplicate_segments = 0
+        self.acks_sent = 0
+        self.reassembly_delay = mrt_metrics.Histogram()  # How long out-of-order segments waited for the hole
         
         debug_print(f"Connection initialized with addr={addr}, port={port}, seq={seq_num}, ack={ack_num}")
         debug_print(f"Initial next_expected_seq={self.next_expected_seq}")
 
+    def free_space(self):
+        """Bytes of the receive window not taken by unread or out-of-order data."""
+        return max(0, self.server.receive_window - len(self.received_data) - self.buffered_bytes
+                   - self.stream_bytes)
+
+    def sack_blocks(self):
+        """Ranges [start, end) of out-of-order segments held in receive_buffer, lowest first."""
+        blocks = []
+        for seq in sorted(self.receive_buffer):
+            if blocks and blocks[-1][1] == seq:
+                blocks[-1][1] += 1
+            elif len(blocks) == mrt_segment.MAX_SACK_BLOCKS:
+                break
+            else:
+                blocks.append([seq, seq + 1])
+        return blocks
+
+    def stats(self):
+        """Snapshot of the connection's counters and buffers (an mrt_metrics.ConnectionStats)."""
+        return mrt_metrics.ConnectionStats(
+            addr=self.addr, port=self.port, connected=self.connected,
+            segments_received=self.segments_received, bytes_received=self.total_bytes_received,
+            out_of_order_segments=self.out_of_order_segments, duplicate_segments=self.duplicate_segments,
+            acks_sent=self.acks_sent, buffered_segments=len(self.receive_buffer),
+            buffered_bytes=self.buffered_bytes, unread_bytes=len(self.received_data),
+            stream_bytes=self.stream_bytes, receive_window=self.last_advertised_window,
+            reassembly_delay=self.reassembly_delay.snapshot())
+
 class Server:
     def __init__(self):
         """Initialize the server."""
         self.socket = None
         self.listen_port = None
         self.receive_buffer_size = None
+        self.receive_window = RECEIVE_WINDOW
+        self.ack_frequency = ACK_FREQUENCY
+        self.ack_delay = ACK_DELAY
+        self.delayed_acks = {}  # Connections with a delayed ACK pending -> deadline
+        self.versions = mrt_segment.SUPPORTED_VERSIONS
+        self.checksums = tuple(mrt_checksum.ALGORITHMS)
         self.connections = {}  # Dictionary to store client connections
         self.listening = False
         self.log_file = None
         self.lock = threading.Lock()
-        
-    def init(self, listen_port, receive_buffer_size):
+        self.buffer_pool = mrt_buffer.BufferPool(DATAGRAM_BUFFER_SIZE, DATAGRAM_BUFFERS)
+        self.connection_ready = threading.Condition()  # Notified when a client connects
+        self.ticket_key = None  # Secret that session tickets are signed with
+        self.batch_receiver = None  # mrt_batch_io.BatchReceiver draining datagrams, if batching
+        
+        # Counters (see stats())
+        self.datagrams_received = 0
+        self.corrupt_segments = 0
+        self.connections_opened = 0
+        
+    def init(self, listen_port, receive_buffer_size, receive_window=RECEIVE_WINDOW,
+             versions=mrt_segment.SUPPORTED_VERSIONS, checksums=tuple(mrt_checksum.ALGORITHMS),
+             ack_frequency=ACK_FREQUENCY, ack_delay=ACK_DELAY, reuse_port=False, log_path=None,
+             ticket_key=None, batch_io=True, log_format=mrt_log.TEXT):
         """
         Initialize the server and create the server UDP channel.
 
         arguments:
         listen_port -- the port that the server is listening on
         receive_buffer_size -- the buffer size for receiving segments
+        receive_window -- bytes each connection may buffer before the application reads them
+        versions -- wire format versions this server accepts (see mrt_segment)
+        checksums -- version 2 checksum algorithms this server accepts (see mrt_checksum)
+        ack_frequency -- acknowledge every this many in-order segments (1 disables delayed ACKs)
+        ack_delay -- seconds an in-order segment may wait for a delayed ACK
+        reuse_port -- bind with SO_REUSEPORT so several servers can share listen_port (see mrt_shard)
+        log_path -- the log file to write (default: log_<listen_port>.txt, or .bin in the binary format)
+        ticket_key -- secret for signing session tickets (default: random, so tickets die with the server)
+        batch_io -- drain waiting datagrams with recvmmsg where available (see mrt_batch_io)
+        log_format -- mrt_log.TEXT or mrt_log.BINARY
         """
-        self.listen_port = listen_port
-        self.receive_buffer_size = min(receive_buffer_size, UDP_MAX_SIZE)  # Ensure buffer size doesn't exceed UDP limits
-        
-        print(f"Initializing server on port {listen_port} with buffer size {self.receive_buffer_size}")
+        self._configure(listen_port, receive_buffer_size, receive_window, versions, checksums,
+                        ack_frequency, ack_delay, ticket_key)
         
         # Create UDP socket
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.socket.bind(('', listen_port))
+        if batch_io and mrt_batch_io.AVAILABLE:
+            self.batch_receiver = mrt_batch_io.BatchReceiver(self.socket)
         
         # Initialize log file
-        self.log_file = open(f"log_{listen_port}.txt", "w")
+        self.log_file = mrt_log.SegmentLog(log_path or mrt_log.log_path(listen_port, log_format), log_format)
         
         # Start the receiver thread to handle all incoming segments
         self.listening = True
@@ -95,181 +206,204 @@ class Server:
         self.receiver_thread.daemon = True
         self.receiver_thread.start()
 
+    def _configure(self, listen_port, receive_buffer_size, receive_window, versions, checksums,
+                   ack_frequency, ack_delay, ticket_key=None):
+        """Store the settings shared by Server and mrt_async.AsyncServer (see init)."""
+        self.listen_port = listen_port
+        self.receive_window = max(receive_window, UDP_MAX_SIZE)  # Must hold at least one full segment
+        self.versions = tuple(versions)
+        self.checksums = tuple(checksums)
+        self.ack_frequency = max(1, ack_frequency)
+        self.ack_delay = ack_delay
+        self.ticket_key = ticket_key or os.urandom(32)
+        self.receive_buffer_size = min(receive_buffer_size, UDP_MAX_SIZE)  # Ensure buffer size doesn't exceed UDP limits
+        
+        print(f"Initializing server on port {listen_port} with buffer size {self.receive_buffer_size}")
+
     def _compute_checksum(self, data):
         """Compute a simple checksum for data verification."""
-        return hashlib.md5(data).hexdigest()[:8]  # Use first 8 chars of MD5
+        return mrt_segment.compute_checksum(data)
     
-    def _create_segment(self, seg_type, seq_num, ack_num, payload=b''):
-        """
-        Create a segment with the specified parameters.
-        
-        Format: |type(1B)|seq(4B)|ack(4B)|checksum(8B)|payload_len(4B)|payload|
-        """
-        # Header: type(1) + seq(4) + ack(4) + checksum(8) + payload_len(4) = 21 bytes
-        payload_len = len(payload)
-        
-        # Create the segment without checksum
-        segment = struct.pack(f'!BII4s{payload_len}s', 
-                             seg_type, 
-                             seq_num, 
-                             ack_num, 
-                             str(payload_len).zfill(4).encode('ascii'), 
-                             payload)
-        
-        # Compute checksum
-        checksum = self._compute_checksum(segment)
-        
-        # Insert checksum into segment
-        segment = segment[:9] + checksum.encode('ascii') + segment[9:]
-        
-        return segment
+    def _create_segment(self, seg_type, seq_num, ack_num, payload=b'', window=0, version=mrt_segment.V1,
+                        checksum=None, options=b''):
+        """Create a segment in the given wire format version (see mrt_segment)."""
+        return mrt_segment.create_segment(seg_type, seq_num, ack_num, payload, window, version,
+                                          options=options, checksum=checksum)
     
-    def _parse_segment(self, segment):
-        """Parse a received segment and verify its integrity."""
+    def _parse_segment(self, segment, checksum=None):
+        """Parse a received segment and verify its integrity (None if corrupted)."""
         try:
-            # Ensure the segment is long enough for basic header
-            if len(segment) < 21:
-                print(f"Segment too short: {len(segment)} bytes")
-                return None, None, None, None, None
-
-            # Extract components from segment
-            seg_type = segment[0]
-            seq_num = struct.unpack('!I', segment[1:5])[0]
-            ack_num = struct.unpack('!I', segment[5:9])[0]
-            
-            # Use try-except to handle potential decode errors for checksum
-            try:
-                received_checksum = segment[9:17].decode('ascii')
-            except UnicodeDecodeError:
-                # Handle binary data that can't be decoded as UTF-8
-                print(f"Checksum decode error: treating segment as corrupted")
-                # Optionally print the hex representation for debugging
-                if DEBUG:
-                    debug_print(f"Corrupted checksum bytes: {binascii.hexlify(segment[9:17])}")
-                return None, None, None, None, None
-            
-            # Verify checksum
-            checksum_data = segment[:9] + segment[17:]
-            computed_checksum = self._compute_checksum(checksum_data)
-            
-            if computed_checksum != received_checksum:
-                print(f"Checksum mismatch: received {received_checksum}, computed {computed_checksum}")
-                return None, None, None, None, None  # Corrupted segment
-            
-            # Use try-except for payload length decoding as well
-            try:
-                payload_len_str = segment[17:21].decode('ascii')
-                payload_len = int(payload_len_str)
-            except (UnicodeDecodeError, ValueError):
-                print(f"Invalid payload length: cannot decode or convert to integer")
-                if DEBUG:
-                    debug_print(f"Corrupted payload length bytes: {binascii.hexlify(segment[17:21])}")
-                return None, None, None, None, None
-                
-            # Ensure the segment includes the full payload
-            if len(segment) < 21 + payload_len:
-                print(f"Incomplete segment: expected {21 + payload_len} bytes, got {len(segment)}")
-                return None, None, None, None, None
-                
-            payload = segment[21:21+payload_len]
+            parsed = mrt_segment.parse_segment(segment, checksum)
             
             # Debug payload data (first few bytes)
-            if DEBUG and payload_len > 0:
-                preview = payload[:min(16, payload_len)]
-                debug_print(f"Payload preview: {binascii.hexlify(preview).decode()} (first {len(preview)} of {payload_len} bytes)")
+            if DEBUG and parsed is not None and parsed.payload_len > 0:
+                preview = parsed.payload[:min(16, parsed.payload_len)]
+                debug_print(f"Payload preview: {binascii.hexlify(preview).decode()} (first {len(preview)} of {parsed.payload_len} bytes)")
             
-            return seg_type, seq_num, ack_num, payload_len, payload
+            return parsed
             
         except Exception as e:
             print(f"Error parsing segment: {e}")
             import traceback
             traceback.print_exc()
-            return None, None, None, None, None
+            return None
     
     def _log_segment(self, src_port, dst_port, seq_num, ack_num, seg_type, payload_len, direction="SEND"):
-        """Log segment information."""
-        type_str = {
-            SYN: "SYN",
-            SYN_ACK: "SYN-ACK",
-            ACK: "ACK",
-            DATA: "DATA",
-            FIN: "FIN",
-            FIN_ACK: "FIN-ACK"
-        }.get(seg_type, "UNKNOWN")
-        
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-        log_entry = f"{timestamp} {src_port} {dst_port} {seq_num} {ack_num} {type_str} {payload_len} {direction}\n"
-        
-        with self.lock:
-            self.log_file.write(log_entry)
-            self.log_file.flush()
+        """Log segment information (queued for the log's writer thread, see mrt_log.SegmentLog)."""
+        self.log_file.record(src_port, dst_port, seq_num, ack_num, seg_type, payload_len, direction)
     
     def _get_client_key(self, addr, port):
         """Generate a unique key for a client connection."""
         return f"{addr}:{port}"
     
     def _receive_segments(self):
-        """Thread to receive segments from all clients."""
+        """
+        Thread to receive segments from all clients.
+        
+        Datagrams are received into pooled buffers with recvfrom_into and
+        parsed in place; payloads are only copied by _handle_data when they
+        are kept in a receive buffer. When batching, every wakeup instead
+        takes all waiting datagrams with one recvmmsg (see mrt_batch_io).
+        """
         self.socket.settimeout(0.1)  # Short timeout for non-blocking
         
         while self.listening:
-            try:
-                segment, addr = self.socket.recvfrom(65535)  # Use large buffer for receiving
-                
+            # Wake up in time for the earliest delayed ACK
+            if self.delayed_acks:
+                self._flush_delayed_acks()
+                earliest = min(self.delayed_acks.values(), default=None)
+                self.socket.settimeout(0.1 if earliest is None else min(0.1, max(earliest - time.monotonic(), 0.001)))
+            
+            if self.batch_receiver is not None:
                 try:
-                    # Parse and verify the segment
-                    seg_type, seq_num, ack_num, payload_len, payload = self._parse_segment(segment)
-                    
-                    if seg_type is None:  # Corrupted segment
-                        print(f"Received corrupted segment from {addr}")
-                        continue
-                    
-                    client_key = self._get_client_key(addr[0], addr[1])
-                    
-                    # Log the received segment
-                    self._log_segment(addr[1], self.listen_port, seq_num, ack_num, seg_type, payload_len, "RECV")
-                    print(f"RECV: type={seg_type}, seq={seq_num}, ack={ack_num}, from={addr}")
-                    
-                    # Handle different types of segments
-                    if seg_type == SYN:
-                        # New connection request
-                        self._handle_syn(addr, seq_num)
-                    
-                    elif client_key in self.connections:
-                        conn = self.connections[client_key]
-                        
-                        if seg_type == ACK:
-                            # Acknowledgment for data sent
-                            self._handle_ack(conn, ack_num)
-                        
-                        elif seg_type == DATA:
-                            # Data segment
-                            self._handle_data(conn, seq_num, ack_num, payload)
-                        
-                        elif seg_type == FIN:
-                            # Connection termination request
-                            self._handle_fin(conn, seq_num)
-                
-                except UnicodeDecodeError as ude:
-                    print(f"UnicodeDecodeError while processing segment from {addr}: {ude}")
-                    if DEBUG:
-                        debug_print(f"Problematic segment: {binascii.hexlify(segment)}")
-                except Exception as inner_e:
-                    print(f"Error processing segment from {addr}: {inner_e}")
-                    if DEBUG:
-                        import traceback
-                        traceback.print_exc()
-                
+                    for datagram, addr in self.batch_receiver.receive(self.socket.gettimeout()):
+                        self._handle_segment(datagram, addr)
+                except Exception as e:
+                    mrt_log.error("Error receiving segment: %s", e)
+                continue
+            
+            buffer = self.buffer_pool.acquire()
+            try:
+                size, addr = self.socket.recvfrom_into(buffer)
+                self._handle_segment(memoryview(buffer)[:size], addr)
             except socket.timeout:
                 pass
             except Exception as e:
-                print(f"Error receiving segment: {e}")
+                mrt_log.error("Error receiving segment: %s", e)
                 if DEBUG:
                     import traceback
                     traceback.print_exc()
+            finally:
+                self.buffer_pool.release(buffer)
+    
+    def _handle_segment(self, segment, addr):
+        """
+        Parse, log and dispatch one received datagram.
+
+        arguments:
+        segment -- the datagram; payloads parsed out of it are copied before it is reused
+        addr -- the (host, port) it came from
+
+        return:
+        The Connection the segment belongs to, or None if it was corrupted or unknown.
+        """
+        self.datagrams_received += 1
+        try:
+            # Parse and verify the segment
+            client_key = self._get_client_key(addr[0], addr[1])
+            conn = self.connections.get(client_key)
+            parsed = self._parse_segment(segment, conn.checksum if conn else None)
+            
+            if parsed is None:  # Corrupted segment
+                self.corrupt_segments += 1
+                mrt_log.info("Received corrupted segment from %s", addr)
+                return None
+            
+            seg_type, seq_num, ack_num, payload = parsed.type, parsed.seq, parsed.ack, parsed.payload
+            
+            # Log the received segment
+            self._log_segment(addr[1], self.listen_port, seq_num, ack_num, seg_type, parsed.payload_len, "RECV")
+            mrt_log.debug("RECV: type=%d, seq=%d, ack=%d, from=%s", seg_type, seq_num, ack_num, addr)
+            
+            # Handle different types of segments
+            if seg_type == SYN:
+                # New connection request
+                self._handle_syn(addr, seq_num, payload)
+            
+            elif client_key in self.connections:
+                conn = self.connections[client_key]
+                
+                # After the FIN only its retransmissions are answered: anything
+                # else is a reconnected client whose SYN has not arrived yet
+                if not conn.connected and not (seg_type == FIN and seq_num == conn.fin_seq):
+                    mrt_log.debug("Ignoring segment for the closed connection of %s", addr)
+                
+                elif seg_type == ACK:
+                    # Acknowledgment for data sent
+                    self._handle_ack(conn, ack_num)
+                
+                elif seg_type == DATA:
+                    # Data segment
+                    self._handle_data(conn, seq_num, ack_num, payload, parsed.flags, parsed.options)
+                
+                elif seg_type == FIN:
+                    # Connection termination request
+                    self._handle_fin(conn, seq_num)
+            
+            return self.connections.get(client_key)
+        
+        except UnicodeDecodeError as ude:
+            print(f"UnicodeDecodeError while processing segment from {addr}: {ude}")
+            if DEBUG:
+                debug_print(f"Problematic segment: {binascii.hexlify(segment)}")
+        except Exception as inner_e:
+            print(f"Error processing segment from {addr}: {inner_e}")
+            if DEBUG:
+                import traceback
+                traceback.print_exc()
+        return None
+    
+    def _ticket_mac(self, body, addr):
+        """MAC of a session ticket body issued to the client at IP address addr."""
+        return hmac.new(self.ticket_key, bytes(body) + addr.encode('ascii'), hashlib.sha256).digest()[:TICKET_MAC_SIZE]
+    
+    def _issue_ticket(self, conn):
+        """Session ticket that lets the client of conn resume with the same version and checksum."""
+        body = TICKET_BODY.pack(conn.version, conn.checksum.ident, int(time.time()) + mrt_segment.TICKET_LIFETIME)
+        return body + self._ticket_mac(body, conn.addr)
+    
+    def _check_ticket(self, ticket, addr):
+        """
+        Validate a session ticket presented by the client at IP address addr.
+        
+        return:
+        (version, checksum) of the session, or None if the ticket is forged,
+        expired or names a version or checksum this server no longer accepts.
+        """
+        if len(ticket) != TICKET_BODY.size + TICKET_MAC_SIZE:
+            return None
+        body = ticket[:TICKET_BODY.size]
+        if not hmac.compare_digest(ticket[TICKET_BODY.size:], self._ticket_mac(body, addr)):
+            return None
+        version, ident, expiry = TICKET_BODY.unpack(body)
+        checksum = mrt_checksum.from_ident(ident)
+        if expiry < time.time() or version not in self.versions or checksum is None \
+                or checksum.name not in self.checksums:
+            return None
+        return version, checksum
     
-    def _handle_syn(self, addr, seq_num):
-        """Handle SYN segment from client."""
+    def _handle_syn(self, addr, seq_num, offer=b''):
+        """
+        Handle SYN segment from client.
+        
+        The SYN payload lists the wire format versions and checksums the client
+        supports; the choices and the free receive window go back in the
+        SYN-ACK payload. A SYN without payload comes from a version 1 only
+        client and gets an empty SYN-ACK.
+        A SYN with a valid session ticket resumes the ticket's version and
+        checksum: the client is already sending DATA in that format. Every
+        SYN-ACK to a client that offered parameters carries a fresh ticket.
+        """
         # Generate a random sequence number for this connection
         server_seq_num = random.randint(0, 1000)
         
@@ -279,44 +413,160 @@ class Server:
         # Set acknowledgment number to client's sequence number + 1
         ack_num = seq_num + 1
         
+        # A closed connection gives way to a new one from the same address and
+        # port (a client reconnecting), once the application has its data
+        old = self.connections.get(client_key)
+        if old is not None and not old.connected and old.ack_num != ack_num \
+                and (old.accepted or not (old.received_data or old.streams)):
+            with self.lock:
+                del self.connections[client_key]
+        
         # Create new connection object if it doesn't exist
         if client_key not in self.connections:
             conn = Connection(self, addr[0], addr[1], server_seq_num, ack_num)
+            offers = mrt_segment.decode_handshake(offer)
+            session = self._check_ticket(offers.get(mrt_segment.HS_TICKET, b''), addr[0])
+            if session:
+                conn.version, conn.checksum = session
+                print(f"Resumed session of {addr}")
+            else:
+                conn.version = mrt_segment.choose_version(offers.get(mrt_segment.HS_VERSIONS, b''), self.versions)
+                conn.checksum = mrt_segment.choose_checksum(offers.get(mrt_segment.HS_CHECKSUMS, b''),
+                                                            self.checksums)
+            conn.handshake_reply = mrt_segment.encode_handshake({
+                mrt_segment.HS_VERSIONS: [conn.version],
+                mrt_segment.HS_CHECKSUMS: [conn.checksum.ident],
+                mrt_segment.HS_TICKET: self._issue_ticket(conn),
+                mrt_segment.HS_WINDOW: mrt_segment.WINDOW_FIELD.pack(conn.free_space()),
+            }) if offer else b''
             with self.lock:
                 self.connections[client_key] = conn
+            self.connections_opened += 1
+            with self.connection_ready:
+                self.connection_ready.notify_all()
             
             # Send SYN-ACK segment
-            syn_ack_segment = self._create_segment(SYN_ACK, server_seq_num, ack_num)
+            syn_ack_segment = self._create_segment(SYN_ACK, server_seq_num, ack_num,
+                                                   conn.handshake_reply, conn.free_space())
             self.socket.sendto(syn_ack_segment, addr)
             self._log_segment(self.listen_port, addr[1], server_seq_num, ack_num, SYN_ACK, 0)
-            print(f"Sent SYN-ACK to {addr}, seq={server_seq_num}, ack={ack_num}")
+            print(f"Sent SYN-ACK to {addr}, seq={server_seq_num}, ack={ack_num}, version={conn.version}, checksum={conn.checksum.name}")
         else:
             # Connection already exists, resend SYN-ACK
             conn = self.connections[client_key]
-            syn_ack_segment = self._create_segment(SYN_ACK, conn.seq_num, conn.ack_num)
+            syn_ack_segment = self._create_segment(SYN_ACK, conn.seq_num, conn.ack_num,
+                                                   conn.handshake_reply, conn.free_space())
             self.socket.sendto(syn_ack_segment, addr)
             self._log_segment(self.listen_port, addr[1], conn.seq_num, conn.ack_num, SYN_ACK, 0)
             print(f"Resent SYN-ACK to {addr}, seq={conn.seq_num}, ack={conn.ack_num}")
     
+    def _send_ack(self, conn):
+        """
+        Send a cumulative ACK advertising the connection's free receive window.
+        
+        With version 2, out-of-order segments waiting in receive_buffer are
+        reported as SACK blocks so the client only retransmits the holes.
+        """
+        window = conn.free_space()
+        conn.last_advertised_window = window
+        conn.unacked_segments = 0
+        conn.ack_deadline = None
+        self.delayed_acks.pop(conn, None)
+        options = b''
+        if conn.version == mrt_segment.V2 and conn.receive_buffer:
+            options = mrt_segment.encode_sack(conn.sack_blocks())
+        ack_segment = self._create_segment(ACK, conn.seq_num, conn.next_expected_seq, window=window,
+                                           version=conn.version, checksum=conn.checksum, options=options)
+        self.socket.sendto(ack_segment, (conn.addr, conn.port))
+        conn.acks_sent += 1
+        self._log_segment(self.listen_port, conn.port, conn.seq_num, conn.next_expected_seq, ACK, 0)
+    
+    def _delay_ack(self, conn):
+        """
+        Count an in-order segment towards the next ACK. The ACK goes out once
+        ack_frequency segments are waiting or after ack_delay, whichever is first.
+        
+        return:
+        True if an ACK was sent now.
+        """
+        conn.unacked_segments += 1
+        if conn.unacked_segments >= self.ack_frequency:
+            self._send_ack(conn)
+            return True
+        if conn.ack_deadline is None:
+            conn.ack_deadline = time.monotonic() + self.ack_delay
+            self.delayed_acks[conn] = conn.ack_deadline
+        return False
+    
+    def _flush_delayed_acks(self):
+        """Send the delayed ACKs whose timer has expired (receiver thread)."""
+        now = time.monotonic()
+        for conn, deadline in list(self.delayed_acks.items()):
+            if deadline <= now:
+                with conn.lock:
+                    if conn.ack_deadline is not None and conn.ack_deadline <= now:
+                        self._send_ack(conn)
+                        mrt_log.debug("Sent delayed ACK %d to %s:%d", conn.next_expected_seq, conn.addr, conn.port)
+    
+    def _update_window(self, conn):
+        """
+        Send a window update after the application has read data, if the last
+        advertised window was nearly closed (buffer above BUFFER_THRESHOLD).
+        """
+        low_water = (1 - BUFFER_THRESHOLD) * self.receive_window
+        with conn.lock:
+            if conn.connected and conn.last_advertised_window < low_water <= conn.free_space():
+                self._send_ack(conn)
+                mrt_log.debug("Sent window update %d to %s:%d", conn.last_advertised_window, conn.addr, conn.port)
+    
     def _handle_ack(self, conn, ack_num):
         """Handle ACK segment from client."""
         # Just update the connection state
-        print(f"Received ACK {ack_num} from {conn.addr}:{conn.port}")
+        mrt_log.debug("Received ACK %d from %s:%d", ack_num, conn.addr, conn.port)
     
-    def _handle_data(self, conn, seq_num, ack_num, payload):
-        """Handle DATA segment from client."""
+    def _handle_data(self, conn, seq_num, ack_num, payload, flags=0, options=b''):
+        """
+        Handle DATA segment from client.
+        
+        In-order segments are acknowledged through the delayed ACK policy
+        (_delay_ack). Out-of-order segments, duplicates, segments that fill a
+        gap and segments flagged FLAG_PUSH are acknowledged immediately.
+        
+        A segment with a STREAM option is handed to its stream as soon as it
+        arrives (see _deliver_stream); the connection's sequence numbers then
+        only track it for acknowledgment.
+        """
         debug_print(f"DATA segment: seq={seq_num}, ack={ack_num}, payload_size={len(payload)}")
         debug_print(f"Connection state: next_expected_seq={conn.next_expected_seq}")
         debug_print(f"Current received_data size: {len(conn.received_data)} bytes")
         debug_print(f"Buffered segments: {sorted(conn.receive_buffer.keys())}")
         
         with conn.lock:
+            # Drop new data that does not fit in the receive window. The ACK tells
+            # the client how much space is left (this is also the zero-window probe reply)
+            if seq_num >= conn.next_expected_seq and seq_num not in conn.receive_buffer \
+                    and len(payload) > conn.free_space():
+                debug_print(f"Receive window full, dropping seq={seq_num} ({len(payload)} bytes, {conn.free_space()} free)")
+                self._send_ack(conn)
+                mrt_log.debug("Sent ACK %d with window %d (window full)", conn.next_expected_seq, conn.last_advertised_window)
+                return
+            
+            # payload points into the receiver thread's datagram buffer; keep a copy
+            if seq_num >= conn.next_expected_seq and seq_num not in conn.receive_buffer:
+                stream = mrt_segment.decode_stream(options) if options else None
+                if stream is not None:
+                    self._deliver_stream(conn, stream[0], stream[1], bytes(payload),
+                                         flags & mrt_segment.FLAG_FIN_STREAM)
+                    payload = b''  # Only a placeholder in the connection's own order
+                else:
+                    payload = bytes(payload)
+            
             # Check if this is the next expected segment
             if seq_num == conn.next_expected_seq:
                 debug_print(f"Adding segment seq={seq_num} directly to received_data ({len(payload)} bytes)")
                 # Add payload to received data
                 before_len = len(conn.received_data)
-                conn.received_data += payload
+                conn.received_data.append(payload)
                 after_len = len(conn.received_data)
                 
                 debug_print(f"received_data size change: {before_len} -> {after_len}")
@@ -331,13 +581,14 @@ class Server:
                 
                 segments_processed = 0
                 bytes_processed = 0
+                now = time.monotonic() if conn.receive_buffer else None
                 
                 while next_seq in conn.receive_buffer:
                     buffered_payload = conn.receive_buffer[next_seq]
                     debug_print(f"Found buffered segment seq={next_seq} with {len(buffered_payload)} bytes")
                     
                     before_len = len(conn.received_data)
-                    conn.received_data += buffered_payload
+                    conn.received_data.append(buffered_payload)
                     after_len = len(conn.received_data)
                     
                     debug_print(f"received_data size change from buffer: {before_len} -> {after_len}")
@@ -346,18 +597,24 @@ class Server:
                     segments_processed += 1
                     
                     del conn.receive_buffer[next_seq]
+                    conn.buffered_bytes -= len(buffered_payload)
+                    conn.reassembly_delay.observe(now - conn.buffered_at.pop(next_seq))
                     next_seq += 1
                 
                 conn.next_expected_seq = next_seq
+                conn.data_ready.notify_all()
                 
                 if segments_processed > 0:
                     debug_print(f"Processed {segments_processed} buffered segments ({bytes_processed} bytes)")
                 
                 # Send ACK for the latest segment we've processed
-                ack_segment = self._create_segment(ACK, conn.seq_num, conn.next_expected_seq)
-                self.socket.sendto(ack_segment, (conn.addr, conn.port))
-                self._log_segment(self.listen_port, conn.port, conn.seq_num, conn.next_expected_seq, ACK, 0)
-                print(f"Sent ACK {conn.next_expected_seq} to {conn.addr}:{conn.port}")
+                if segments_processed or conn.receive_buffer or flags & mrt_segment.FLAG_PUSH:
+                    self._send_ack(conn)
+                    mrt_log.debug("Sent ACK %d to %s:%d", conn.next_expected_seq, conn.addr, conn.port)
+                elif self._delay_ack(conn):
+                    mrt_log.debug("Sent ACK %d to %s:%d", conn.next_expected_seq, conn.addr, conn.port)
+                else:
+                    debug_print(f"Delaying ACK {conn.next_expected_seq} ({conn.unacked_segments} unacknowledged)")
                 
                 debug_print(f"After processing: received_data size={len(conn.received_data)}, next_expected_seq={conn.next_expected_seq}")
                 debug_print(f"Remaining buffered segments: {sorted(conn.receive_buffer.keys())}")
@@ -365,39 +622,64 @@ class Server:
             elif seq_num > conn.next_expected_seq:
                 # Out of order segment, buffer it
                 debug_print(f"Out-of-order segment seq={seq_num}, expecting {conn.next_expected_seq}")
-                conn.receive_buffer[seq_num] = payload
+                if seq_num not in conn.receive_buffer:
+                    conn.receive_buffer[seq_num] = payload
+                    conn.buffered_at[seq_num] = time.monotonic()
+                    conn.buffered_bytes += len(payload)
+                    conn.segments_received += 1
+                    conn.total_bytes_received += len(payload)
                 conn.out_of_order_segments += 1
                 
                 # Debug buffer contents
                 debug_print(f"Buffer now contains segments: {sorted(conn.receive_buffer.keys())}")
-                debug_print(f"Total buffered data: {sum(len(data) for data in conn.receive_buffer.values())} bytes")
+                debug_print(f"Total buffered data: {conn.buffered_bytes} bytes")
                 
                 # Send ACK for the last in-order segment we've received
-                ack_segment = self._create_segment(ACK, conn.seq_num, conn.next_expected_seq)
-                self.socket.sendto(ack_segment, (conn.addr, conn.port))
-                self._log_segment(self.listen_port, conn.port, conn.seq_num, conn.next_expected_seq, ACK, 0)
-                print(f"Sent duplicate ACK {conn.next_expected_seq} to {conn.addr}:{conn.port}")
+                self._send_ack(conn)
+                mrt_log.debug("Sent duplicate ACK %d to %s:%d", conn.next_expected_seq, conn.addr, conn.port)
                 
             else:
                 # Duplicate segment, ignore but send ACK
                 debug_print(f"Duplicate segment seq={seq_num}, already received (next_expected_seq={conn.next_expected_seq})")
                 conn.duplicate_segments += 1
                 
-                ack_segment = self._create_segment(ACK, conn.seq_num, conn.next_expected_seq)
-                self.socket.sendto(ack_segment, (conn.addr, conn.port))
-                self._log_segment(self.listen_port, conn.port, conn.seq_num, conn.next_expected_seq, ACK, 0)
-                print(f"Sent ACK {conn.next_expected_seq} for duplicate segment")
+                self._send_ack(conn)
+                mrt_log.debug("Sent ACK %d for duplicate segment", conn.next_expected_seq)
+    
+    def _deliver_stream(self, conn, stream_id, stream_seq, payload, last):
+        """
+        Put a new segment on its stream (conn.lock held), creating the
+        stream on its first segment, and deliver whatever is now in stream order.
+        """
+        stream = conn.streams.get(stream_id)
+        if stream is None:
+            stream = conn.streams[stream_id] = Stream(stream_id)
+            conn.new_streams.append(stream)
+            debug_print(f"New stream {stream_id} from {conn.addr}:{conn.port}")
+        if last:
+            stream.fin_seq = stream_seq
+        if stream_seq < stream.next_seq or stream_seq in stream.pending:
+            return
+        stream.pending[stream_seq] = payload
+        conn.stream_bytes += len(payload)
+        while stream.next_seq in stream.pending:
+            stream.received_data.append(stream.pending.pop(stream.next_seq))
+            stream.next_seq += 1
+        conn.data_ready.notify_all()
     
     def _handle_fin(self, conn, seq_num):
         """Handle FIN segment from client."""
         # Send FIN-ACK segment
-        fin_ack_segment = self._create_segment(FIN_ACK, conn.seq_num, seq_num + 1)
+        fin_ack_segment = self._create_segment(FIN_ACK, conn.seq_num, seq_num + 1, version=conn.version, checksum=conn.checksum)
         self.socket.sendto(fin_ack_segment, (conn.addr, conn.port))
         self._log_segment(self.listen_port, conn.port, conn.seq_num, seq_num + 1, FIN_ACK, 0)
         print(f"Sent FIN-ACK to {conn.addr}:{conn.port}")
         
         # Mark connection as closed - don't remove it yet as we might need to resend FIN-ACK
-        conn.connected = False
+        with conn.data_ready:
+            conn.connected = False
+            conn.fin_seq = seq_num
+            conn.data_ready.notify_all()
         
         # Print debug stats
         if DEBUG:
@@ -411,29 +693,89 @@ class Server:
             debug_print(f"Remaining buffered data size: {sum(len(data) for data in conn.receive_buffer.values())} bytes")
             debug_print("=====================================")
     
-    def accept(self):
+    def _pending_connection(self):
+        """A connection accept() has not returned yet that is open or still holds data, if any."""
+        for conn in list(self.connections.values()):
+            if not conn.accepted and (conn.connected or conn.received_data or conn.streams):
+                return conn
+        return None
+    
+    def accept(self, timeout=None):
         """
         Accept a connection from a client.
         Blocking until a connection is established.
         
+        A client that already sent all its data and closed is still accepted,
+        so the data it left in the receive buffer can be read.
+        
+        arguments:
+        timeout -- the maximum number of seconds to wait, or None to wait forever
+        
         return:
-        A connection object that can be used to receive data from this client.
+        A connection object that can be used to receive data from this client,
+        or None if the timeout expired or the server was closed first.
         """
         print("Waiting for client connection...")
         
-        # Wait for a connection to be established
-        while not self.connections or not any(conn.connected for conn in self.connections.values()):
-            time.sleep(0.1)
+        # Sleep until _handle_syn announces a new connection or close() is called
+        with self.connection_ready:
+            self.connection_ready.wait_for(lambda: not self.listening or self._pending_connection(), timeout)
+            conn = self._pending_connection()
         
-        # Find the first connected client and return it
-        for client_key, conn in self.connections.items():
-            if conn.connected:
-                print(f"Accepted connection from {conn.addr}:{conn.port}")
-                return conn
+        if conn is None:
+            print("Timed out waiting for client connection" if self.listening else "Server closed")
+            return None
         
-        return None
+        conn.accepted = True
+        print(f"Accepted connection from {conn.addr}:{conn.port}")
+        return conn
+    
+    def accept_stream(self, conn, timeout=None):
+        """
+        Wait for the client to open a new stream on a connection.
+        
+        Streams are returned in the order their first segment arrived.
+        
+        arguments:
+        conn -- the connection the stream belongs to
+        timeout -- the maximum number of seconds to wait, or None to wait forever
+        
+        return:
+        A Stream to pass to receive(), or None if the timeout expired or the
+        client closed the connection first.
+        """
+        with conn.data_ready:
+            conn.data_ready.wait_for(lambda: conn.new_streams or not conn.connected, timeout)
+            if not conn.new_streams:
+                return None
+            stream = conn.new_streams.popleft()
+        stream.accepted = True
+        print(f"Accepted stream {stream.id} from {conn.addr}:{conn.port}")
+        return stream
+    
+    def _is_open(self, conn, stream):
+        """Whether more data can still arrive on the connection's default stream or on stream."""
+        return conn.connected and (stream is None or not stream.finished)
+    
+    def _take(self, conn, stream, n=None):
+        """Take up to n bytes from the default stream or stream (conn.lock held), see ReceiveBuffer.take."""
+        if stream is None:
+            return conn.received_data.take(n)
+        pieces = stream.received_data.take(n)
+        conn.stream_bytes -= sum(len(piece) for piece in pieces)
+        self._retire_stream(conn, stream)
+        return pieces
     
-    def receive(self, conn, length):
+    def _retire_stream(self, conn, stream):
+        """
+        Forget stream once it is finished and read to the end (conn.lock held).
+        Stream ids are not reused, and a late copy of one of its segments is
+        dropped as a duplicate by the connection's sequence numbers.
+        """
+        if stream.finished and not stream.received_data:
+            conn.streams.pop(stream.id, None)
+    
+    def receive(self, conn, length, timeout=None, stream=None):
         """
         Receive data from the client.
         Blocking until the specified amount of data is received.
@@ -441,63 +783,143 @@ class Server:
         arguments:
         conn -- the connection to receive data from
         length -- the amount of data to receive in bytes
+        timeout -- the maximum number of seconds to wait, or None to wait forever
+        stream -- read this Stream (see accept_stream) instead of the default stream
         
         return:
-        The received data as bytes.
+        The received data as bytes. Shorter than length if the client closed
+        the connection (or finished the stream) or the timeout expired first.
         """
-        if not conn or not conn.connected:
+        if not conn:
+            raise Exception("Connection is not established")
+        buffer = conn.received_data if stream is None else stream.received_data
+        
+        # Data that arrived before the client closed can still be read. A
+        # finished stream reads as empty, like the end of a file.
+        if not self._is_open(conn, stream) and not buffer:
+            if stream is not None:
+                with conn.lock:
+                    self._retire_stream(conn, stream)
+                return b''
             raise Exception("Connection is not established")
         
-        print(f"Waiting to receive {length} bytes from {conn.addr}:{conn.port}")
+        mrt_log.debug("Waiting to receive %d bytes from %s:%d", length, conn.addr, conn.port)
         debug_print(f"receive() called for {length} bytes")
         debug_print(f"Current received_data size: {len(conn.received_data)} bytes")
         debug_print(f"Current buffered segments: {sorted(conn.receive_buffer.keys())}")
         
         # Wait until we have enough data
-        wait_start_time = time.time()
-        wait_iteration = 0
-        
-        while len(conn.received_data) < length and conn.connected:
-            wait_iteration += 1
-            if wait_iteration % 10 == 0:  # Log every 10 iterations (approximately every second)
-                elapsed = time.time() - wait_start_time
-                debug_print(f"Still waiting after {elapsed:.2f}s... have {len(conn.received_data)}/{length} bytes")
-                debug_print(f"Buffered segments: {sorted(conn.receive_buffer.keys())}")
-                if conn.receive_buffer:
-                    debug_print(f"Total buffered data: {sum(len(data) for data in conn.receive_buffer.values())} bytes")
-                    smallest_seq = min(conn.receive_buffer.keys()) if conn.receive_buffer else None
-                    gap = smallest_seq - conn.next_expected_seq if smallest_seq is not None else None
-                    debug_print(f"Next expected seq: {conn.next_expected_seq}, smallest buffered: {smallest_seq}, gap: {gap}")
+        deadline = None if timeout is None else time.monotonic() + timeout
+        chunks = []  # In-order data already taken out of the receive window
+        collected = 0
+        
+        while True:
+            with conn.data_ready:
+                if collected + len(buffer) >= length or not self._is_open(conn, stream):
+                    break
+                
+                if not buffer:
+                    # Sleep until _handle_data delivers in-order data or the client closes
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        break
+                    conn.data_ready.wait(remaining)
+                    continue
+                
+                # Take what is already in order, so a request larger than the
+                # receive window cannot stall the sender
+                collected += len(buffer)
+                chunks.extend(self._take(conn, stream))
+            self._update_window(conn)
+        
+        # Check if the connection was closed (or the timeout expired) before receiving enough data
+        if collected + len(buffer) < length:
+            reason = "Connection closed" if not conn.connected else "Stream finished" if stream and stream.finished \
+                else "Timed out"
+            debug_print(f"{reason} before receiving enough data. Available: {collected + len(buffer)}/{length} bytes")
+            print(f"{reason} before receiving enough data. Received {collected + len(buffer)}/{length} bytes")
             
-            time.sleep(0.1)
-        
-        # Check if the connection was closed before receiving enough data
-        if not conn.connected and len(conn.received_data) < length:
-            debug_print(f"Connection closed before receiving enough data. Available: {len(conn.received_data)}/{length} bytes")
-            print(f"Connection closed before receiving enough data. Received {len(conn.received_data)}/{length} bytes")
+            with conn.lock:
+                chunks.extend(self._take(conn, stream))
+            self._update_window(conn)
+            data = b''.join(chunks)
             
             # Debug dump of first part of data
-            if len(conn.received_data) > 0:
-                preview_len = min(50, len(conn.received_data))
-                debug_print(f"Data preview: {binascii.hexlify(conn.received_data[:preview_len]).decode()} ({preview_len} bytes)")
+            if len(data) > 0:
+                preview_len = min(50, len(data))
+                debug_print(f"Data preview: {binascii.hexlify(data[:preview_len]).decode()} ({preview_len} bytes)")
             
-            return conn.received_data
+            return data
         
         # Return the requested amount of data
         with conn.lock:
-            debug_print(f"Receiving {length} bytes from received_data buffer (buffer size: {len(conn.received_data)} bytes)")
-            data = conn.received_data[:length]
-            conn.received_data = conn.received_data[length:]
-            debug_print(f"After receiving: received_data size={len(conn.received_data)} bytes")
-            
-            # Debug dump of retrieved data
-            if len(data) > 0:
-                preview_len = min(50, len(data))
-                debug_print(f"Data preview: {binascii.hexlify(data[:preview_len]).decode()} ({preview_len} bytes)")
+            remaining = length - collected
+            debug_print(f"Receiving {remaining} bytes from received_data buffer (buffer size: {len(buffer)} bytes)")
+            chunks.extend(self._take(conn, stream, remaining))
+            debug_print(f"After receiving: received_data size={len(buffer)} bytes")
+        self._update_window(conn)
+        data = b''.join(chunks)
+        
+        # Debug dump of retrieved data
+        if len(data) > 0:
+            preview_len = min(50, len(data))
+            debug_print(f"Data preview: {binascii.hexlify(data[:preview_len]).decode()} ({preview_len} bytes)")
         
         print(f"Received {len(data)} bytes from {conn.addr}:{conn.port}")
         return data
-    
+
+    def receive_message(self, conn, timeout=None, stream=None):
+        """
+        Receive the next message the client sent with send_message().
+        Blocking until the whole message has arrived.
+
+        arguments:
+        conn -- the connection to receive from
+        timeout -- the maximum number of seconds to wait for a message to start,
+                   or None to wait forever; once started it is read to the end
+        stream -- read from this Stream (see accept_stream) instead of the default stream
+
+        return:
+        The message as bytes, or None if the client closed the connection (or
+        finished the stream) or the timeout expired before a whole message arrived.
+        """
+        if not conn:
+            raise Exception("Connection is not established")
+        buffer = conn.received_data if stream is None else stream.received_data
+        header_size = mrt_segment.MESSAGE_HEADER.size
+
+        # Wait for the length prefix
+        with conn.data_ready:
+            conn.data_ready.wait_for(lambda: len(buffer) >= header_size or not self._is_open(conn, stream), timeout)
+            if len(buffer) < header_size:
+                return None
+            length, = mrt_segment.MESSAGE_HEADER.unpack(buffer.peek(header_size))
+            self._take(conn, stream, header_size)
+        self._update_window(conn)
+
+        readable = buffer or self._is_open(conn, stream)
+        message = self.receive(conn, length, stream=stream) if length and readable else b''
+        if len(message) < length:
+            print(f"Message truncated: received {len(message)}/{length} bytes")
+            return None
+        return message
+
+    def stats(self):
+        """
+        Snapshot of the server's counters and of every connection it holds.
+        Safe to call from any thread.
+
+        return:
+        An mrt_metrics.ServerStats.
+        """
+        with self.lock:
+            connections = list(self.connections.values())
+        return mrt_metrics.ServerStats(
+            port=self.listen_port, datagrams_received=self.datagrams_received,
+            corrupt_segments=self.corrupt_segments, connections_opened=self.connections_opened,
+            open_connections=sum(conn.connected for conn in connections),
+            connections=tuple(conn.stats() for conn in connections))
+
     def close(self):
         """
         Close all connections and clean up.
@@ -522,11 +944,15 @@ class Server:
         for client_key, conn in list(self.connections.items()):
             if conn.connected:
                 # Send FIN-ACK segment
-                fin_ack_segment = self._create_segment(FIN_ACK, conn.seq_num, conn.ack_num)
+                fin_ack_segment = self._create_segment(FIN_ACK, conn.seq_num, conn.ack_num, version=conn.version, checksum=conn.checksum)
                 self.socket.sendto(fin_ack_segment, (conn.addr, conn.port))
                 self._log_segment(self.listen_port, conn.port, conn.seq_num, conn.ack_num, FIN_ACK, 0)
                 print(f"Sent FIN-ACK to {conn.addr}:{conn.port}")
+            with conn.data_ready:
                 conn.connected = False
+                conn.data_ready.notify_all()
+        with self.connection_ready:
+            self.connection_ready.notify_all()
         
         # Close the log file and socket
         if self.log_file:
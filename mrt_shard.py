@@ -0,0 +1,281 @@
+#
+# Columbia University - CSEE 4119 Computer Networks
+# Assignment 2 - Mini Reliable Transport Protocol
+#
+# mrt_shard.py - a server sharded over worker processes that share the listen port with SO_REUSEPORT
+#
+
+import multiprocessing
+import os
+import queue
+import socket
+import threading
+import time
+from collections import namedtuple
+
+import mrt_log
+import mrt_server
+
+# Constants
+RECEIVE_CHUNK = 1 << 20  # Bytes per receive() call of the default handler
+ACCEPT_POLL = 1.0  # How often a worker's accept loop checks for shutdown, in seconds
+
+# A connection accepted by one of the workers. The Connection object itself
+# lives in the worker process; this is what the parent gets to see.
+ShardConnection = namedtuple('ShardConnection', ['worker', 'addr', 'port'])
+
+def drain(server, conn):
+    """
+    Default connection handler: receive until the client closes and discard
+    the data, on the default stream and on every multiplexed stream. Unread
+    stream data counts against the connection's receive window, so each
+    stream is read in its own thread while the default stream is read here.
+
+    return:
+    The number of bytes received on all streams together.
+    """
+    totals = []  # Bytes received per stream
+    readers = []
+
+    def drain_stream(stream):
+        total = 0
+        while True:
+            chunk = server.receive(conn, RECEIVE_CHUNK, stream=stream)
+            if not chunk:  # The stream is finished or the client closed
+                break
+            total += len(chunk)
+        totals.append(total)
+
+    def accept_streams():
+        while True:
+            stream = server.accept_stream(conn)
+            if stream is None:  # The client closed
+                return
+            reader = threading.Thread(target=drain_stream, args=(stream,), daemon=True)
+            readers.append(reader)
+            reader.start()
+
+    acceptor = threading.Thread(target=accept_streams, daemon=True)
+    acceptor.start()
+    total = 0
+    while True:
+        try:
+            total += len(server.receive(conn, RECEIVE_CHUNK))
+        except Exception:
+            # The client's FIN can arrive between two receive() calls, and
+            # receive() refuses a closed connection with nothing left to read
+            if conn.connected or conn.received_data:
+                raise
+            break
+    acceptor.join()
+    for reader in readers:
+        reader.join()
+    return total + sum(totals)
+
+def _worker_stats(index, server):
+    """Counters of one worker's Server, summed over its connections."""
+    connections = list(server.connections.values())
+    return {
+        'worker': index,
+        'pid': os.getpid(),
+        'connections': len(connections),
+        'open': sum(conn.connected for conn in connections),
+        'bytes_received': sum(conn.total_bytes_received for conn in connections),
+        'segments_received': sum(conn.segments_received for conn in connections),
+        'out_of_order_segments': sum(conn.out_of_order_segments for conn in connections),
+        'duplicate_segments': sum(conn.duplicate_segments for conn in connections),
+    }
+
+def _default_log_path(listen_port, server_options):
+    """The log path template of the workers: log_<port>_{worker}.txt, or .bin in the binary format."""
+    root, extension = os.path.splitext(mrt_log.log_path(listen_port, server_options.get('log_format', mrt_log.TEXT)))
+    return root + "_{worker}" + extension
+
+def _worker_main(index, listen_port, receive_buffer_size, server_options, handler, accepted, results, control):
+    """
+    Body of a worker process: run a Server bound with SO_REUSEPORT, hand
+    every accepted connection to handler in its own thread and answer
+    control requests from the parent until told to close.
+    """
+    server_options = dict(server_options)
+    template = server_options.pop('log_path', None) or _default_log_path(listen_port, server_options)
+    server = mrt_server.Server()
+    server.init(listen_port, receive_buffer_size, reuse_port=True,
+                log_path=template.format(port=listen_port, worker=index), **server_options)
+
+    def serve(conn, info):
+        try:
+            value = handler(server, conn)
+        except Exception as e:
+            print(f"Worker {index}: handler failed for {conn.addr}:{conn.port}: {e}")
+            value = e
+        results.put((info, value))
+
+    def accept_loop():
+        while server.listening:
+            conn = server.accept(timeout=ACCEPT_POLL)
+            if conn is None:
+                continue
+            info = ShardConnection(index, conn.addr, conn.port)
+            accepted.put(info)
+            threading.Thread(target=serve, args=(conn, info), daemon=True).start()
+
+    threading.Thread(target=accept_loop, daemon=True).start()
+    control.send('ready')
+
+    while True:
+        try:
+            command = control.recv()
+        except EOFError:  # The parent went away
+            command = 'close'
+        if command == 'stats':
+            control.send(_worker_stats(index, server))
+        elif command == 'close':
+            stats = _worker_stats(index, server)
+            server.close()
+            try:
+                control.send(stats)
+            except OSError:
+                pass
+            return
+
+class ShardedServer:
+    """
+    An MRT server spread over worker processes.
+
+    Every worker runs its own Server on the same listen port (SO_REUSEPORT),
+    so the kernel spreads clients over the workers by the hash of their
+    address and port, and each worker owns its share of the connections.
+    Parsing, checksums and reassembly then run on as many cores as there are
+    workers. Connections are handled inside the workers by a handler
+    function (by default drain, which reads and discards the default stream
+    and every stream the client opens); the parent sees which connections
+    were accepted, what their handlers returned and per-worker statistics.
+    """
+    def __init__(self):
+        self.listen_port = None
+        self.workers = []  # multiprocessing.Process per worker
+        self.controls = []  # Parent end of each worker's control pipe
+        self.accepted = None  # Queue of ShardConnection
+        self.results = None  # Queue of (ShardConnection, handler return value)
+        self.lock = threading.Lock()
+
+    def init(self, listen_port, receive_buffer_size, workers=None, handler=drain, **server_options):
+        """
+        Fork the workers and wait until all of them listen.
+
+        arguments:
+        listen_port -- the port that the server is listening on
+        receive_buffer_size -- the buffer size for receiving segments
+        workers -- number of worker processes (default: one per CPU)
+        handler -- called as handler(server, conn) in a worker thread for every
+                   accepted connection; its return value is passed to result()
+        server_options -- further keyword arguments for Server.init (receive_window, versions, ...);
+                          log_path is a template formatted with port and worker, e.g. "logs/{port}-{worker}.txt"
+                          (default: log_<port>_<worker>.txt, or .bin with log_format=mrt_log.BINARY)
+        """
+        if not hasattr(socket, "SO_REUSEPORT"):
+            raise Exception("SO_REUSEPORT is not supported on this platform")
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise Exception("Forking worker processes is not supported on this platform")
+        if "{worker}" not in (server_options.get('log_path') or "{worker}"):
+            raise Exception("log_path must contain {worker}, or all workers write the same file")
+
+        self.listen_port = listen_port
+        workers = workers or os.cpu_count() or 1
+        # One ticket key for all workers: a resumed client may land on any of them
+        server_options.setdefault('ticket_key', os.urandom(32))
+        context = multiprocessing.get_context("fork")  # Workers inherit handler without pickling it
+        self.accepted = context.Queue()
+        self.results = context.Queue()
+
+        print(f"Starting {workers} server workers on port {listen_port}")
+        for index in range(workers):
+            parent_end, worker_end = context.Pipe()
+            process = context.Process(target=_worker_main, name=f"mrt-worker-{index}",
+                                      args=(index, listen_port, receive_buffer_size, server_options, handler,
+                                            self.accepted, self.results, worker_end))
+            process.daemon = True
+            process.start()
+            worker_end.close()
+            self.workers.append(process)
+            self.controls.append(parent_end)
+
+        for index, control in enumerate(self.controls):
+            if not control.poll(10) or control.recv() != 'ready':
+                self.close()
+                raise Exception(f"Server worker {index} failed to start")
+
+    def accept(self, timeout=None):
+        """
+        Wait for the next connection accepted by any worker.
+
+        arguments:
+        timeout -- the maximum number of seconds to wait, or None to wait forever
+
+        return:
+        A ShardConnection, or None if the timeout expired first.
+        """
+        try:
+            return self.accepted.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def result(self, timeout=None):
+        """
+        Wait for the next connection whose handler has finished.
+
+        arguments:
+        timeout -- the maximum number of seconds to wait, or None to wait forever
+
+        return:
+        (ShardConnection, handler return value), or None if the timeout expired first.
+        """
+        try:
+            return self.results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def stats(self):
+        """
+        Collect the current counters of every worker.
+
+        return:
+        A list with one dict per worker (worker, pid, connections, open,
+        bytes_received, segments_received, out_of_order_segments, duplicate_segments).
+        """
+        with self.lock:
+            for control in self.controls:
+                control.send('stats')
+            return [control.recv() for control in self.controls]
+
+    def close(self):
+        """
+        Close every worker's server and wait for the workers to exit.
+
+        return:
+        The final statistics of the workers that answered (see stats()).
+        """
+        print(f"Stopping {len(self.workers)} server workers")
+        final = []
+        with self.lock:
+            for control in self.controls:
+                try:
+                    control.send('close')
+                except OSError:
+                    pass
+            deadline = time.monotonic() + 5
+            for control in self.controls:
+                try:
+                    if control.poll(max(deadline - time.monotonic(), 0)):
+                        final.append(control.recv())
+                except (EOFError, OSError):
+                    pass
+                control.close()
+            for process in self.workers:
+                process.join(max(deadline - time.monotonic(), 0))
+                if process.is_alive():
+                    process.terminate()
+            self.controls = []
+            self.workers = []
+        return final
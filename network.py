@@ -94,7 +94,7 @@ def handleMessage(ns, ca, sa, st):
             # Identify segment type if possible (first byte)
             if len(d) > 0:
                 seg_type = d[0]
-                type_str = {0: "SYN", 1: "SYN-ACK", 2: "ACK", 3: "DATA", 4: "FIN", 5: "FIN-ACK"}.get(seg_type, "UNKNOWN")
+                type_str = {0: "SYN", 1: "SYN-ACK", 2: "ACK", 3: "DATA", 4: "FIN", 5: "FIN-ACK"}.get(seg_type & 0x0F, "UNKNOWN")
                 print(f"Forwarding {type_str} segment")
                 
             if a == sa: